@@ -1,21 +1,34 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
 import os
+import queue
 import subprocess
 import sys
-import pandas as pd
-from process import process_file, process_entity_details
+import threading
+from instrument import format_stages
+from worker import JobCancelled, ReportWorker
 
-# Keep global storage of values for search filtering
-card_values_full = []
-cashier_values_full = []
+# pandas, openpyxl and process.py are only imported in this worker process, which outlives each report
+worker = ReportWorker()
+
+# Search indexes over the loaded file's cards and cashiers (None until one is loaded), and the page shown in each dropdown
+card_search = None
+cashier_search = None
+search_pages = {"card": 0, "cashier": 0}
+# Keys that move around the dropdown rather than edit the search text
+NAVIGATION_KEYS = {"Up", "Down", "Left", "Right", "Return", "Escape", "Tab", "Next", "Prior", "Home", "End"}
 
 # ---------- Helpers ----------
 def detect_available_fields(file_path):
-    """Check available columns in the uploaded file and decide which inputs to show."""
+    """Check available columns in the uploaded file and decide which inputs to show.
+
+    Runs here rather than in the worker: reading a header needs no pandas, and
+    the worker may still be importing it.
+    """
     try:
-        df = pd.read_excel(file_path, nrows=0)
-        headers = set(col.lower() for col in df.columns)
+        from ingest import probe_schema
+        columns, _ = probe_schema(file_path)
+        headers = set(col.lower() for col in columns)
 
         available = {
             "has_cards": "card_no" in headers,
@@ -25,89 +38,198 @@ def detect_available_fields(file_path):
     except Exception:
         return {"has_cards": False, "has_cashiers": False}
 
+# ---------- Background jobs ----------
+current_cancel = None
+
+def set_busy(busy, cancellable=False):
+    """Enable or disable everything that starts a job: one job runs at a time, since they share current_cancel."""
+    state = "disabled" if busy else "normal"
+    for button in (run_button, run_button_tab2, browse_button, browse_button_tab2):
+        button.config(state=state)
+    cancel_button.config(state="normal" if busy and cancellable else "disabled")
+
+def start_job(work, on_done, status_var, cancellable=True):
+    """Run ``work(progress, cancel_event)`` on a worker thread so the window stays responsive.
+
+    Progress and the outcome are passed back through a queue and handled on the
+    Tk thread; ``on_done(result)`` is called there when the work succeeds.
+    """
+    global current_cancel
+    cancel_event = threading.Event()
+    current_cancel = cancel_event
+    events = queue.Queue()
+
+    def progress(stage, index, total):
+        events.put(("progress", stage, index, total))
+
+    def target():
+        try:
+            events.put(("done", work(progress, cancel_event)))
+        except JobCancelled:
+            events.put(("cancelled",))
+        except Exception as e:
+            events.put(("error", e))
+
+    progress_bar["value"] = 0
+    status_var.set("Starting...")
+    set_busy(True, cancellable)
+    threading.Thread(target=target, daemon=True).start()
+    root.after(100, poll_job, events, on_done, status_var)
+
+def poll_job(events, on_done, status_var):
+    try:
+        while True:
+            event = events.get_nowait()
+            if event[0] == "progress":
+                _, stage, index, total = event
+                progress_bar["value"] = 100 * index / total
+                status_var.set(f"{stage.capitalize()}...")
+                continue
+
+            set_busy(False)
+            if event[0] == "done":
+                progress_bar["value"] = 100
+                status_var.set("Done")
+                on_done(event[1])
+            elif event[0] == "cancelled":
+                progress_bar["value"] = 0
+                status_var.set("Cancelled")
+                messagebox.showinfo("Cancelled", "The job was cancelled and its partial output removed.")
+            else:
+                status_var.set("Failed")
+                messagebox.showerror("Error", str(event[1]))
+            return
+    except queue.Empty:
+        pass
+    root.after(100, poll_job, events, on_done, status_var)
+
+def cancel_job():
+    if current_cancel is not None:
+        current_cancel.set()
+        status_var.set("Cancelling after the current stage...")
+        cancel_button.config(state="disabled")
+
 # ---------- Tab 1 ----------
 def run_app():
     file_path = file_entry.get()
     if not file_path:
-        messagebox.showerror("Error", "Please select an Excel file.")
+        messagebox.showerror("Error", "Please select an Excel or CSV file.")
         return
 
     available = detect_available_fields(file_path)
 
-    try:
-        top_cards = None
-        top_cashiers = None
-
-        if available["has_cards"]:
-            try:
-                top_cards = int(cards_entry.get())
-            except ValueError:
-                messagebox.showerror("Error", "Please enter a valid number for Top Cards.")
-                return
-
-        if available["has_cashiers"]:
-            try:
-                top_cashiers = int(cashiers_entry.get())
-            except ValueError:
-                messagebox.showerror("Error", "Please enter a valid number for Top Cashiers.")
-                return
-
-        # Process file
-        output_folder, last_output_file, password = process_file(
-            file_path,
-            top_n_cards=top_cards,
-            top_n_cashiers=top_cashiers,
-            encrypt=encrypt_var.get(),
-            separate_cards=separate_var.get(),
-            include_intervals=interval_var.get()  # NEW: pass transaction interval choice
+    top_cards = None
+    top_cashiers = None
+
+    if available["has_cards"]:
+        try:
+            top_cards = int(cards_entry.get())
+        except ValueError:
+            messagebox.showerror("Error", "Please enter a valid number for Top Cards.")
+            return
+
+    if available["has_cashiers"]:
+        try:
+            top_cashiers = int(cashiers_entry.get())
+        except ValueError:
+            messagebox.showerror("Error", "Please enter a valid number for Top Cashiers.")
+            return
+
+    # Capture the options now; the checkboxes may change while the report runs
+    options = {
+        "encrypt": encrypt_var.get(),
+        "separate_cards": separate_var.get(),
+        "include_intervals": interval_var.get(),  # NEW: pass transaction interval choice
+        "velocity_alerts": velocity_var.get(),
+        "collusion_ranking": collusion_var.get(),
+    }
+    per_month = per_month_var.get()
+    show_timings = timings_var.get()
+
+    def work(progress, cancel_event):
+        thresholds = worker.run("velocity_thresholds") if options["velocity_alerts"] else None
+        if per_month:
+            output_folder, monthly_results = worker.run(
+                "process_file_by_month", file_path, top_n_cards=top_cards, top_n_cashiers=top_cashiers,
+                progress=progress, cancel_event=cancel_event, **options
+            )
+            if not monthly_results:
+                raise RuntimeError("No dated transactions found to split by month.")
+            return output_folder, monthly_results[-1][1], monthly_results, None, thresholds
+        output_folder, last_output_file, password, run_record = worker.run(
+            "run_report", file_path, top_n_cards=top_cards, top_n_cashiers=top_cashiers,
+            progress=progress, cancel_event=cancel_event, **options
         )
+        return output_folder, last_output_file, None, run_record, thresholds
 
-        # Show report summary
-        preview_text.config(state="normal")
-        preview_text.delete(1.0, tk.END)
-        preview_text.insert(tk.END, "=== Report Summary Preview ===\n\n")
-        preview_text.insert(tk.END, f"Source File: {os.path.basename(file_path)}\n")
+    def on_done(result):
+        output_folder, last_output_file, monthly_results, run_record, thresholds = result
+        show_report_summary(file_path, available, top_cards, top_cashiers, options,
+                            output_folder, last_output_file, monthly_results,
+                            run_record if show_timings else None, thresholds)
 
-        if available["has_cards"]:
-            preview_text.insert(tk.END, f"Top N Cards: {top_cards}\n")
+    start_job(work, on_done, status_var)
 
-        if available["has_cashiers"]:
-            preview_text.insert(tk.END, f"Top N Cashiers: {top_cashiers}\n")
+def show_report_summary(file_path, available, top_cards, top_cashiers, options, output_folder, last_output_file,
+                        monthly_results, run_record=None, velocity_thresholds=None):
+    preview_text.config(state="normal")
+    preview_text.delete(1.0, tk.END)
+    preview_text.insert(tk.END, "=== Report Summary Preview ===\n\n")
+    preview_text.insert(tk.END, f"Source File: {os.path.basename(file_path)}\n")
 
-        preview_text.insert(tk.END, f"Output Folder: {output_folder}\n")
-        preview_text.insert(tk.END, f"Last Generated File: {os.path.basename(last_output_file)}\n")
+    if available["has_cards"]:
+        preview_text.insert(tk.END, f"Top N Cards: {top_cards}\n")
 
-        if encrypt_var.get():
-            preview_text.insert(tk.END, "Encryption: ENABLED\n")
-            preview_text.insert(tk.END, "(Password saved in password_log.txt)\n")
-        else:
-            preview_text.insert(tk.END, "Encryption: DISABLED\n")
+    if available["has_cashiers"]:
+        preview_text.insert(tk.END, f"Top N Cashiers: {top_cashiers}\n")
 
-        if separate_var.get():
-            preview_text.insert(tk.END, "Card Separation: ENABLED (8880 = Blue, 8881 = Yellow)\n")
-        else:
-            preview_text.insert(tk.END, "Card Separation: DISABLED\n")
+    preview_text.insert(tk.END, f"Output Folder: {output_folder}\n")
+    if monthly_results:
+        preview_text.insert(tk.END, f"Monthly Reports: {len(monthly_results)} "
+                                    f"({monthly_results[0][0]} to {monthly_results[-1][0]})\n")
+    preview_text.insert(tk.END, f"Last Generated File: {os.path.basename(last_output_file)}\n")
 
-        if interval_var.get():
-            preview_text.insert(tk.END, "Transaction Intervals: INCLUDED\n")
-        else:
-            preview_text.insert(tk.END, "Transaction Intervals: EXCLUDED\n")
+    if options["encrypt"]:
+        preview_text.insert(tk.END, "Encryption: ENABLED\n")
+        preview_text.insert(tk.END, "(Password saved in password_log.txt)\n")
+    else:
+        preview_text.insert(tk.END, "Encryption: DISABLED\n")
 
-        preview_text.config(state="disabled")
+    if options["separate_cards"]:
+        preview_text.insert(tk.END, "Card Separation: ENABLED (8880 = Blue, 8881 = Yellow)\n")
+    else:
+        preview_text.insert(tk.END, "Card Separation: DISABLED\n")
 
-        # Enable open button
-        open_button.config(
-            state="normal",
-            text=f"Open {os.path.basename(last_output_file)}",
-            command=lambda: open_output_file(last_output_file)
-        )
+    if options["include_intervals"]:
+        preview_text.insert(tk.END, "Transaction Intervals: INCLUDED\n")
+    else:
+        preview_text.insert(tk.END, "Transaction Intervals: EXCLUDED\n")
 
-        messagebox.showinfo("Success", "Processing complete! Check the Report Summary Preview below.")
-    except Exception as e:
-        messagebox.showerror("Error", str(e))
+    if options["velocity_alerts"]:
+        count, window_minutes, hop_minutes = velocity_thresholds
+        preview_text.insert(tk.END, f"Velocity Alerts: INCLUDED ({count}+ transactions in "
+                                    f"{window_minutes} min, branch change within {hop_minutes} min)\n")
+
+    if options["collusion_ranking"]:
+        preview_text.insert(tk.END, "Collusion Ranking: INCLUDED (CashierConcentration and CardRings sheets)\n")
+
+    if run_record:
+        preview_text.insert(tk.END, "\nStage Timings (also saved in run_log.jsonl):\n")
+        preview_text.insert(tk.END, "\n".join(format_stages(run_record)) + "\n", "mono")
+
+    preview_text.config(state="disabled")
+
+    # Enable open button
+    open_button.config(
+        state="normal",
+        text=f"Open {os.path.basename(last_output_file)}",
+        command=lambda: open_output_file(last_output_file)
+    )
+
+    messagebox.showinfo("Success", "Processing complete! Check the Report Summary Preview below.")
 
 def browse_file():
-    file_path = filedialog.askopenfilename(filetypes=[("Excel files", "*.xlsx")])
+    file_path = filedialog.askopenfilename(filetypes=[("Excel or CSV files", "*.xlsx *.csv"), ("Excel files", "*.xlsx"), ("CSV files", "*.csv")])
     if not file_path:
         return
     file_entry.delete(0, tk.END)
@@ -142,30 +264,36 @@ def open_output_file(file_path):
 
 # ---------- Tab 2 ----------
 def browse_file_tab2():
-    global card_values_full, cashier_values_full
-    file_path = filedialog.askopenfilename(filetypes=[("Excel files", "*.xlsx")])
+    file_path = filedialog.askopenfilename(filetypes=[("Excel or CSV files", "*.xlsx *.csv"), ("Excel files", "*.xlsx"), ("CSV files", "*.csv")])
     if not file_path:
         return
     file_entry_tab2.delete(0, tk.END)
     file_entry_tab2.insert(0, file_path)
 
-    try:
-        df = pd.read_excel(file_path)
-        if "card_no" in df.columns:
-            df["card_no"] = df["card_no"].astype(str)
-
-        card_values_full = sorted(df["card_no"].dropna().unique().tolist()) if "card_no" in df.columns else []
-        cashier_values_full = sorted(df["cashier"].dropna().unique().tolist()) if "cashier" in df.columns else []
-
-        card_dropdown["values"] = card_values_full
-        cashier_dropdown["values"] = cashier_values_full
-
+    # Reading the file and indexing its values take a while on large extracts; keep the old values out of reach meanwhile
+    card_dropdown.config(state="disabled")
+    cashier_dropdown.config(state="disabled")
+    card_var.set("")
+    cashier_var.set("")
+
+    def work(progress, cancel_event):
+        from search import SearchIndex  # numpy; not needed until a file is loaded
+        try:
+            cards, cashiers = worker.run("entity_values", file_path)
+        except RuntimeError as e:
+            raise RuntimeError(f"Could not load file: {e}") from e
+        return SearchIndex(cards), SearchIndex(cashiers)
+
+    def on_done(indexes):
+        global card_search, cashier_search
+        card_search, cashier_search = indexes
+        search_pages.update(card=0, cashier=0)
+        card_dropdown["values"] = card_search.search("")[0]
+        cashier_dropdown["values"] = cashier_search.search("")[0]
         card_dropdown.config(state="normal")
         cashier_dropdown.config(state="normal")
-        card_var.set("")
-        cashier_var.set("")
-    except Exception as e:
-        messagebox.showerror("Error", f"Could not load file: {e}")
+
+    start_job(work, on_done, status_var_tab2, cancellable=False)
 
 def on_card_selected(event):
     if card_var.get():
@@ -181,24 +309,40 @@ def on_cashier_selected(event):
     else:
         card_dropdown.config(state="normal")
 
+def show_search_page(kind, page):
+    """Fill the card or cashier dropdown with one page of matches for the text typed so far."""
+    from search import PAGE_SIZE
+    index, var, dropdown = (card_search, card_var, card_dropdown) if kind == "card" else (
+        cashier_search, cashier_var, cashier_dropdown)
+    if index is None:
+        return  # no file loaded yet
+    page = max(page, 0)
+    matches, more = index.search(var.get(), offset=page * PAGE_SIZE)
+    if not matches and page > 0:
+        return  # already on the last page
+    search_pages[kind] = page
+    dropdown["values"] = matches
+    if more or page > 0:
+        first = page * PAGE_SIZE + 1
+        status_var_tab2.set(f"Matches {first}-{first + len(matches) - 1}"
+                            f"{' (PgDn for more)' if more else ''}{' (PgUp for previous)' if page else ''}")
+    else:
+        status_var_tab2.set("")
+    if matches:
+        dropdown.after(50, lambda: dropdown.event_generate("<Down>"))
+
 def filter_card_list(event):
-    value = card_var.get().lower()
-    filtered = [v for v in card_values_full if value in str(v).lower()]
-    card_dropdown["values"] = filtered
-    if filtered:
-        card_dropdown.after(50, lambda: card_dropdown.event_generate("<Down>"))
+    if event.keysym not in NAVIGATION_KEYS:
+        show_search_page("card", 0)
 
 def filter_cashier_list(event):
-    value = cashier_var.get().lower()
-    filtered = [v for v in cashier_values_full if value in str(v).lower()]
-    cashier_dropdown["values"] = filtered
-    if filtered:
-        cashier_dropdown.after(50, lambda: cashier_dropdown.event_generate("<Down>"))
+    if event.keysym not in NAVIGATION_KEYS:
+        show_search_page("cashier", 0)
 
 def run_tab2():
     file_path = file_entry_tab2.get()
     if not file_path:
-        messagebox.showerror("Error", "Please select an Excel file.")
+        messagebox.showerror("Error", "Please select an Excel or CSV file.")
         return
 
     chosen_card = card_var.get()
@@ -212,120 +356,161 @@ def run_tab2():
         messagebox.showerror("Error", "Please select a Card or Cashier.")
         return
 
-    try:
-        output_file = process_entity_details(file_path, card_no=chosen_card if chosen_card else None,
-                                             cashier=chosen_cashier if chosen_cashier else None)
+    def work(progress, cancel_event):
+        return worker.run("process_entity_details", file_path, card_no=chosen_card if chosen_card else None,
+                          cashier=chosen_cashier if chosen_cashier else None)
+
+    def on_done(output_file):
         messagebox.showinfo("Success", f"Details exported to:\n{output_file}")
         open_output_file(output_file)
-    except Exception as e:
-        messagebox.showerror("Error", str(e))
+
+    start_job(work, on_done, status_var_tab2, cancellable=False)
 
 # ---------- Build UI ----------
-root = tk.Tk()
-root.title("VScan Report Generator")
-
-# Notebook (tabs)
-notebook = ttk.Notebook(root)
-notebook.pack(fill="both", expand=True)
-
-# --- Tab 1: Main ---
-tab1 = ttk.Frame(notebook)
-notebook.add(tab1, text="Generate Top Cards/Cashiers")
-
-# File input
-tk.Label(tab1, text="Excel File:").grid(row=0, column=0, padx=5, pady=5, sticky="w")
-file_frame = tk.Frame(tab1)
-file_frame.grid(row=0, column=1, columnspan=2, padx=5, pady=5, sticky="we")
-tab1.grid_columnconfigure(1, weight=1)
-
-file_entry = tk.Entry(file_frame)
-file_entry.pack(side="left", fill="x", expand=True)
-browse_button = tk.Button(file_frame, text="Browse", command=browse_file)
-browse_button.pack(side="left", padx=(5, 0))
-
-# Top N Cards
-cards_label = tk.Label(tab1, text="Top N Cards:")
-cards_entry = tk.Entry(tab1, width=10)
-cards_entry.insert(0, "20")
-
-# Top N Cashiers
-cashiers_label = tk.Label(tab1, text="Top N Cashiers:")
-cashiers_entry = tk.Entry(tab1, width=10)
-cashiers_entry.insert(0, "20")
-
-cards_label.grid_remove()
-cards_entry.grid_remove()
-cashiers_label.grid_remove()
-cashiers_entry.grid_remove()
-
-# Configuration label
-tk.Label(tab1, text="Configuration:", font=("Arial", 10, "bold")).grid(
-    row=3, column=0, padx=5, pady=(10, 0), sticky="w"
-)
-
-options_frame = tk.Frame(tab1)
-options_frame.grid(row=4, column=0, columnspan=3, padx=5, pady=5, sticky="w")
-
-encrypt_var = tk.BooleanVar()
-separate_var = tk.BooleanVar()
-interval_var = tk.BooleanVar()  # NEW: transaction intervals checkbox
-
-encrypt_checkbox = tk.Checkbutton(options_frame, text="Encrypt Output File", variable=encrypt_var)
-encrypt_checkbox.pack(side="left", padx=(0, 15))
-
-separate_checkbox = tk.Checkbutton(options_frame, text="Separate Card/Cashier", variable=separate_var)
-separate_checkbox.pack(side="left", padx=(0, 15))
-
-interval_checkbox = tk.Checkbutton(options_frame, text="Include Transaction Intervals", variable=interval_var)
-interval_checkbox.pack(side="left")
-
-run_button = tk.Button(tab1, text="Generate Report", command=run_app, bg="green", fg="white")
-run_button.grid(row=5, column=0, columnspan=3, pady=10)
-
-tk.Label(tab1, text="Report Summary Preview:", font=("Arial", 10, "bold")).grid(
-    row=6, column=0, columnspan=3, sticky="w", padx=5, pady=(10, 0)
-)
-preview_text = tk.Text(tab1, width=100, height=10, wrap="word", state="disabled", bg="#f9f9f9")
-preview_text.grid(row=7, column=0, columnspan=3, padx=5, pady=5)
-
-open_button = tk.Button(tab1, text="Open Output File", state="disabled")
-open_button.grid(row=8, column=0, columnspan=3, pady=5)
-
-# --- Tab 2: Card/Cashier Details ---
-tab2 = ttk.Frame(notebook)
-notebook.add(tab2, text="Extract Card/Cashier Details")
-
-tk.Label(tab2, text="Excel File:").grid(row=0, column=0, padx=5, pady=5, sticky="w")
-file_frame_tab2 = tk.Frame(tab2)
-file_frame_tab2.grid(row=0, column=1, columnspan=2, padx=5, pady=5, sticky="we")
-tab2.grid_columnconfigure(1, weight=1)
-
-file_entry_tab2 = tk.Entry(file_frame_tab2)
-file_entry_tab2.pack(side="left", fill="x", expand=True)
-browse_button_tab2 = tk.Button(file_frame_tab2, text="Browse", command=browse_file_tab2)
-browse_button_tab2.pack(side="left", padx=(5, 0))
-
-# Dropdowns
-tk.Label(tab2, text="Select Card No:").grid(row=1, column=0, padx=5, pady=5, sticky="w")
-card_var = tk.StringVar()
-card_dropdown = ttk.Combobox(tab2, textvariable=card_var, state="normal")
-card_dropdown.grid(row=1, column=1, padx=5, pady=5, sticky="we")
-card_dropdown.bind("<KeyRelease>", filter_card_list)
-
-tk.Label(tab2, text="Select Cashier:").grid(row=2, column=0, padx=5, pady=5, sticky="w")
-cashier_var = tk.StringVar()
-cashier_dropdown = ttk.Combobox(tab2, textvariable=cashier_var, state="normal")
-cashier_dropdown.grid(row=2, column=1, padx=5, pady=5, sticky="we")
-cashier_dropdown.bind("<KeyRelease>", filter_cashier_list)
-
-card_dropdown.bind("<<ComboboxSelected>>", on_card_selected)
-cashier_dropdown.bind("<<ComboboxSelected>>", on_cashier_selected)
-
-run_button_tab2 = tk.Button(tab2, text="Export Details", command=run_tab2, bg="green", fg="white")
-run_button_tab2.grid(row=3, column=0, columnspan=3, pady=10)
-
-# --- Tab 3 (empty for now) ---
-tab3 = ttk.Frame(notebook)
-notebook.add(tab3, text="Tab 3")
-
-root.mainloop()
+# Guarded so report worker processes can import this module without opening a window
+if __name__ == "__main__":
+    worker.start()  # warms up while the window is built
+    root = tk.Tk()
+    root.title("VScan Report Generator")
+
+    # Notebook (tabs)
+    notebook = ttk.Notebook(root)
+    notebook.pack(fill="both", expand=True)
+
+    # --- Tab 1: Main ---
+    tab1 = ttk.Frame(notebook)
+    notebook.add(tab1, text="Generate Top Cards/Cashiers")
+
+    # File input
+    tk.Label(tab1, text="Excel/CSV File:").grid(row=0, column=0, padx=5, pady=5, sticky="w")
+    file_frame = tk.Frame(tab1)
+    file_frame.grid(row=0, column=1, columnspan=2, padx=5, pady=5, sticky="we")
+    tab1.grid_columnconfigure(1, weight=1)
+
+    file_entry = tk.Entry(file_frame)
+    file_entry.pack(side="left", fill="x", expand=True)
+    browse_button = tk.Button(file_frame, text="Browse", command=browse_file)
+    browse_button.pack(side="left", padx=(5, 0))
+
+    # Top N Cards
+    cards_label = tk.Label(tab1, text="Top N Cards:")
+    cards_entry = tk.Entry(tab1, width=10)
+    cards_entry.insert(0, "20")
+
+    # Top N Cashiers
+    cashiers_label = tk.Label(tab1, text="Top N Cashiers:")
+    cashiers_entry = tk.Entry(tab1, width=10)
+    cashiers_entry.insert(0, "20")
+
+    cards_label.grid_remove()
+    cards_entry.grid_remove()
+    cashiers_label.grid_remove()
+    cashiers_entry.grid_remove()
+
+    # Configuration label
+    tk.Label(tab1, text="Configuration:", font=("Arial", 10, "bold")).grid(
+        row=3, column=0, padx=5, pady=(10, 0), sticky="w"
+    )
+
+    options_frame = tk.Frame(tab1)
+    options_frame.grid(row=4, column=0, columnspan=3, padx=5, pady=5, sticky="w")
+
+    encrypt_var = tk.BooleanVar()
+    separate_var = tk.BooleanVar()
+    interval_var = tk.BooleanVar()  # NEW: transaction intervals checkbox
+    per_month_var = tk.BooleanVar()
+    velocity_var = tk.BooleanVar()
+    collusion_var = tk.BooleanVar()
+    timings_var = tk.BooleanVar()
+
+    encrypt_checkbox = tk.Checkbutton(options_frame, text="Encrypt Output File", variable=encrypt_var)
+    encrypt_checkbox.pack(side="left", padx=(0, 15))
+
+    separate_checkbox = tk.Checkbutton(options_frame, text="Separate Card/Cashier", variable=separate_var)
+    separate_checkbox.pack(side="left", padx=(0, 15))
+
+    interval_checkbox = tk.Checkbutton(options_frame, text="Include Transaction Intervals", variable=interval_var)
+    interval_checkbox.pack(side="left", padx=(0, 15))
+
+    per_month_checkbox = tk.Checkbutton(options_frame, text="One Report per Month", variable=per_month_var)
+    per_month_checkbox.pack(side="left", padx=(0, 15))
+
+    velocity_checkbox = tk.Checkbutton(options_frame, text="Velocity Alerts", variable=velocity_var)
+    velocity_checkbox.pack(side="left", padx=(0, 15))
+
+    collusion_checkbox = tk.Checkbutton(options_frame, text="Collusion Ranking", variable=collusion_var)
+    collusion_checkbox.pack(side="left", padx=(0, 15))
+
+    timings_checkbox = tk.Checkbutton(options_frame, text="Show Stage Timings", variable=timings_var)
+    timings_checkbox.pack(side="left")
+
+    run_frame = tk.Frame(tab1)
+    run_frame.grid(row=5, column=0, columnspan=3, pady=10)
+    run_button = tk.Button(run_frame, text="Generate Report", command=run_app, bg="green", fg="white")
+    run_button.pack(side="left", padx=(0, 10))
+    cancel_button = tk.Button(run_frame, text="Cancel", command=cancel_job, state="disabled")
+    cancel_button.pack(side="left")
+
+    # Progress of the running report
+    progress_frame = tk.Frame(tab1)
+    progress_frame.grid(row=6, column=0, columnspan=3, padx=5, sticky="we")
+    progress_bar = ttk.Progressbar(progress_frame, mode="determinate", maximum=100)
+    progress_bar.pack(side="left", fill="x", expand=True)
+    status_var = tk.StringVar(value="Idle")
+    tk.Label(progress_frame, textvariable=status_var, width=40, anchor="w").pack(side="left", padx=(5, 0))
+
+    tk.Label(tab1, text="Report Summary Preview:", font=("Arial", 10, "bold")).grid(
+        row=7, column=0, columnspan=3, sticky="w", padx=5, pady=(10, 0)
+    )
+    preview_text = tk.Text(tab1, width=100, height=10, wrap="word", state="disabled", bg="#f9f9f9")
+    preview_text.tag_configure("mono", font=("Courier", 9))
+    preview_text.grid(row=8, column=0, columnspan=3, padx=5, pady=5)
+
+    open_button = tk.Button(tab1, text="Open Output File", state="disabled")
+    open_button.grid(row=9, column=0, columnspan=3, pady=5)
+
+    # --- Tab 2: Card/Cashier Details ---
+    tab2 = ttk.Frame(notebook)
+    notebook.add(tab2, text="Extract Card/Cashier Details")
+
+    tk.Label(tab2, text="Excel/CSV File:").grid(row=0, column=0, padx=5, pady=5, sticky="w")
+    file_frame_tab2 = tk.Frame(tab2)
+    file_frame_tab2.grid(row=0, column=1, columnspan=2, padx=5, pady=5, sticky="we")
+    tab2.grid_columnconfigure(1, weight=1)
+
+    file_entry_tab2 = tk.Entry(file_frame_tab2)
+    file_entry_tab2.pack(side="left", fill="x", expand=True)
+    browse_button_tab2 = tk.Button(file_frame_tab2, text="Browse", command=browse_file_tab2)
+    browse_button_tab2.pack(side="left", padx=(5, 0))
+
+    # Dropdowns
+    tk.Label(tab2, text="Select Card No:").grid(row=1, column=0, padx=5, pady=5, sticky="w")
+    card_var = tk.StringVar()
+    card_dropdown = ttk.Combobox(tab2, textvariable=card_var, state="normal")
+    card_dropdown.grid(row=1, column=1, padx=5, pady=5, sticky="we")
+    card_dropdown.bind("<KeyRelease>", filter_card_list)
+
+    tk.Label(tab2, text="Select Cashier:").grid(row=2, column=0, padx=5, pady=5, sticky="w")
+    cashier_var = tk.StringVar()
+    cashier_dropdown = ttk.Combobox(tab2, textvariable=cashier_var, state="normal")
+    cashier_dropdown.grid(row=2, column=1, padx=5, pady=5, sticky="we")
+    cashier_dropdown.bind("<KeyRelease>", filter_cashier_list)
+    card_dropdown.bind("<Next>", lambda e: show_search_page("card", search_pages["card"] + 1))
+    card_dropdown.bind("<Prior>", lambda e: show_search_page("card", search_pages["card"] - 1))
+    cashier_dropdown.bind("<Next>", lambda e: show_search_page("cashier", search_pages["cashier"] + 1))
+    cashier_dropdown.bind("<Prior>", lambda e: show_search_page("cashier", search_pages["cashier"] - 1))
+
+    card_dropdown.bind("<<ComboboxSelected>>", on_card_selected)
+    cashier_dropdown.bind("<<ComboboxSelected>>", on_cashier_selected)
+
+    run_button_tab2 = tk.Button(tab2, text="Export Details", command=run_tab2, bg="green", fg="white")
+    run_button_tab2.grid(row=3, column=0, columnspan=3, pady=10)
+    status_var_tab2 = tk.StringVar(value="")
+    tk.Label(tab2, textvariable=status_var_tab2, anchor="w").grid(row=4, column=0, columnspan=3, padx=5, sticky="w")
+
+    # --- Tab 3 (empty for now) ---
+    tab3 = ttk.Frame(notebook)
+    notebook.add(tab3, text="Tab 3")
+
+    root.mainloop()
+    worker.stop()
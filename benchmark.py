@@ -0,0 +1,356 @@
+import argparse
+import contextlib
+import io
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from cache import clear_aggregates
+from instrument import peak_rss_mb
+from process import (OUTPUT_DIR_ENV, build_interval_column, build_intervals, compact_ids, entity_timeline,
+                     encrypt_excel, encrypt_excel_buffer, process_dynamic_schema, process_file, summarize_entities)
+from worker import ReportWorker
+from writer import new_streaming_workbook, write_raw_data
+
+SUITE_SIZES = [10_000, 50_000, 200_000]
+SUITE_TOP_N = [20, 100]
+# What the GUI imports before its window can open, now and before the report modules moved to the worker
+STARTUP_IMPORTS = {
+    "window imports (lazy, app.py)": "import app",
+    "window imports (eager, before)": "import tkinter, cache, ingest, instrument, process, search",
+}
+
+def _heavy_tailed_weights(rng, n):
+    weights = rng.pareto(1.2, n) + 1
+    return weights / weights.sum()
+
+def make_transactions(n_rows, seed=0):
+    """Return a synthetic fraud-analysis frame with the columns process.py expects.
+
+    Activity per card and per cashier is heavy-tailed (Pareto), each cashier
+    works at one branch, and transactions fall in store hours across March 2024.
+    The same ``n_rows`` and ``seed`` always produce the same frame.
+    """
+    rng = np.random.default_rng(seed)
+    n_cards = max(n_rows // 20, 10)
+    cards = np.char.add(
+        np.where(rng.random(n_cards) < 0.5, "8880", "8881"),
+        np.char.zfill(np.arange(n_cards).astype(str), 12),
+    )
+    n_cashiers = max(n_rows // 200, 5)
+    cashiers = np.char.add("C", np.char.zfill(np.arange(n_cashiers).astype(str), 5))
+    cashier_branch = rng.integers(100, 160, n_cashiers)
+    cashier_idx = rng.choice(n_cashiers, n_rows, p=_heavy_tailed_weights(rng, n_cashiers))
+
+    days = rng.integers(0, 31, n_rows) * 86400
+    time_of_day = np.clip(rng.normal(14 * 3600, 3 * 3600, n_rows), 8 * 3600, 22 * 3600 - 1).astype(np.int64)
+    seconds = (days + time_of_day).astype("timedelta64[s]")
+    df = pd.DataFrame({
+        "card_no": rng.choice(cards, n_rows, p=_heavy_tailed_weights(rng, n_cards)),
+        "cashier": cashiers[cashier_idx],
+        "branch_code": cashier_branch[cashier_idx],
+        "register_no": rng.integers(1, 9, n_rows),
+        "transaction_datetime": np.datetime64("2024-03-01") + seconds,
+        "trans_total": rng.gamma(2.0, 300.0, n_rows).round(2),
+        "point_earned": rng.integers(0, 50, n_rows).astype(float),
+    })
+    return df
+
+# ---------- Reference implementations (pre-vectorization) ----------
+def _legacy_build_intervals(entity_data, date_col):
+    result_lines = []
+    entity_data = entity_data.sort_values(date_col)
+    for day, day_df in entity_data.groupby(entity_data[date_col].dt.date):
+        times = day_df[date_col].dropna().sort_values().tolist()
+        if len(times) <= 1:
+            continue
+        intervals = []
+        for i in range(1, len(times)):
+            diff = (times[i] - times[i - 1]).total_seconds() / 60
+            intervals.append(str(int(diff)))
+        first_time = times[0].strftime("%Y-%m-%d %H:%M")
+        result_lines.append(f"{first_time}: " + " > ".join(intervals))
+    return "\n".join(result_lines) if result_lines else "N/A"
+
+def _legacy_build_interval_column(df, date_col, entity_col):
+    intervals = []
+    df_sorted = df.sort_values([entity_col, date_col])
+    last_times = {}
+    for idx, row in df_sorted.iterrows():
+        entity = row[entity_col]
+        current_time = row[date_col]
+        if pd.isna(current_time):
+            intervals.append(None)
+            continue
+        if entity in last_times:
+            intervals.append((current_time - last_times[entity]).total_seconds() / 60)
+        else:
+            intervals.append(None)
+        last_times[entity] = current_time
+    return intervals
+
+def _timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - start
+
+# ---------- Benchmarks ----------
+def bench_intervals(n_rows, top_n=20, legacy=True):
+    df = make_transactions(n_rows)
+    date_col, entity_col = "transaction_datetime", "card_no"
+    top = df[entity_col].value_counts().head(top_n).index
+
+    def vectorized():
+        timeline = entity_timeline(df, date_col, entity_col)
+        build_interval_column(df, date_col, entity_col, timeline=timeline)
+        build_intervals(timeline, top)
+
+    def reference():
+        _legacy_build_interval_column(df, date_col, entity_col)
+        for entity in top:
+            _legacy_build_intervals(df[df[entity_col] == entity], date_col)
+
+    new_s = _timed(vectorized)
+    old_s = _timed(reference) if legacy else None
+    return {"rows": n_rows, "legacy_s": old_s, "vectorized_s": new_s}
+
+def _write_raw_data_child(n_rows, streaming, queue):
+    df = make_transactions(n_rows)
+    baseline = peak_rss_mb()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "raw.xlsx")
+        start = time.perf_counter()
+        if streaming:
+            wb = new_streaming_workbook()
+            write_raw_data(wb, df)
+            wb.save(path)
+        else:
+            with pd.ExcelWriter(path, engine="openpyxl") as writer:
+                df.to_excel(writer, sheet_name="RawData", index=False)
+        elapsed = time.perf_counter() - start
+    peak = peak_rss_mb()
+    queue.put({
+        "rows": n_rows,
+        "writer": "streaming" if streaming else "openpyxl",
+        "seconds": elapsed,
+        "rows_per_s": n_rows / elapsed,
+        "peak_rss_delta_mb": (peak - baseline) if peak is not None else None,
+    })
+
+def bench_writer(n_rows, streaming):
+    """Write RawData in a fresh process so its peak RSS reflects only that writer."""
+    queue = multiprocessing.Queue()
+    proc = multiprocessing.Process(target=_write_raw_data_child, args=(n_rows, streaming, queue))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+def _write_report(target, df):
+    wb = new_streaming_workbook()
+    write_raw_data(wb, df)
+    wb.save(target)
+
+def bench_encrypt(n_rows, password="Bench-Pass-1"):
+    """Compare writing a plaintext workbook then encrypting it from disk with encrypting it from memory."""
+    df = make_transactions(n_rows)
+    with tempfile.TemporaryDirectory() as tmp:
+        plain = os.path.join(tmp, "report.xlsx")
+
+        def disk():
+            _write_report(plain, df)
+            encrypt_excel(plain, os.path.join(tmp, "disk_encrypted.xlsx"), password)
+            os.remove(plain)
+
+        def memory():
+            buffer = io.BytesIO()
+            _write_report(buffer, df)
+            encrypt_excel_buffer(buffer, os.path.join(tmp, "memory_encrypted.xlsx"), password)
+
+        disk_s = _timed(disk)
+        memory_s = _timed(memory)
+        size_mb = os.path.getsize(os.path.join(tmp, "memory_encrypted.xlsx")) / 1024 ** 2
+    return {"rows": n_rows, "workbook_mb": size_mb, "disk_s": disk_s, "memory_s": memory_s}
+
+def _repeated(func, repeat, setup=None):
+    """Run ``func`` ``repeat`` times (with fresh arguments from ``setup``); return the best and median seconds."""
+    times = [_timed(func, *(setup() if setup else ())) for _ in range(repeat)]
+    return min(times), float(np.median(times))
+
+def _suite_input(n_rows, seed):
+    """Write the generated frame to a stable CSV path so repeat runs reuse the parsed-input cache."""
+    folder = os.path.join(tempfile.gettempdir(), "vscan_bench")
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, f"transactions_{n_rows}_seed{seed}.csv")
+    if not os.path.exists(path):
+        make_transactions(n_rows, seed).to_csv(path, index=False)
+    return path
+
+@contextlib.contextmanager
+def _scratch_output():
+    """Send reports and their password/run logs to a temporary folder, here and in processes started meanwhile."""
+    previous = os.environ.get(OUTPUT_DIR_ENV)
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ[OUTPUT_DIR_ENV] = tmp
+        try:
+            yield tmp
+        finally:
+            if previous is None:
+                del os.environ[OUTPUT_DIR_ENV]
+            else:
+                os.environ[OUTPUT_DIR_ENV] = previous
+
+def _forget_aggregates():
+    """Setup for _repeated: drop the in-memory summaries, so each repeat computes them again."""
+    clear_aggregates()
+    return ()
+
+def _process_file_quietly(input_file, top_n):
+    with contextlib.redirect_stdout(io.StringIO()):
+        _, final_file, _ = process_file(input_file, top_n_cards=top_n, top_n_cashiers=top_n, encrypt=False)
+    os.remove(final_file)
+
+def bench_suite(sizes=SUITE_SIZES, top_ns=SUITE_TOP_N, repeat=3, seed=0):
+    """Time the report stages and the full pipeline at each size and top-N.
+
+    process_file runs against a CSV and reads it through the input cache after
+    the first repeat, so its best time excludes parsing; the in-memory
+    summaries are cleared before each repeat, so it still includes them.
+    Reports and their logs go to a temporary folder, not TopTransactionsPerMonth.
+    """
+    date_col = "transaction_datetime"
+    results = []
+
+    def add(case, n_rows, top_n, timing):
+        results.append({"case": case, "rows": n_rows, "top_n": top_n, "repeat": repeat,
+                        "best_s": timing[0], "median_s": timing[1]})
+
+    with _scratch_output() as tmp:
+        output_file = os.path.join(tmp, "report.xlsx")
+        for n_rows in sizes:
+            df = compact_ids(make_transactions(n_rows, seed))
+            input_file = _suite_input(n_rows, seed)
+
+            add("build_interval_column", n_rows, None,
+                _repeated(lambda: build_interval_column(df, date_col, "card_no"), repeat))
+            for top_n in top_ns:
+                for entity_col in ("card_no", "cashier"):
+                    add(f"summarize_entities {entity_col}", n_rows, top_n, _repeated(
+                        lambda: summarize_entities(df, entity_col, date_col=date_col, top_n=top_n), repeat))
+                add("process_dynamic_schema", n_rows, top_n, _repeated(
+                    lambda frame: process_dynamic_schema(frame, output_file, top_n, top_n), repeat,
+                    setup=lambda: (df.copy(),)))
+                add("process_file", n_rows, top_n, _repeated(lambda: _process_file_quietly(input_file, top_n), repeat,
+                                                     setup=_forget_aggregates))
+    results = pd.DataFrame(results, columns=["case", "rows", "top_n", "repeat", "best_s", "median_s"])
+    results["top_n"] = results["top_n"].astype("Int64")
+    return results
+
+def _fresh_interpreter(code):
+    """Run ``code`` in a new interpreter from this folder; return its wall time and its last stdout line."""
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                         capture_output=True, text=True, check=True)
+    return time.perf_counter() - start, out.stdout.split()[-1] if out.stdout.strip() else None
+
+def bench_startup(n_rows=10_000, repeat=3):
+    """Time what the GUI pays before its window opens, and a report in a fresh interpreter against the warm worker.
+
+    Startup cases run in new interpreters: "imports" is the import statement
+    alone, "process" includes interpreter start and exit. The warm-worker case
+    is a repeat report in a ReportWorker that has already run one, with its
+    in-memory summaries cleared first so only the imports and parsed input are warm.
+    Reports and their logs go to a temporary folder, not TopTransactionsPerMonth.
+    """
+    with _scratch_output():
+        return _bench_startup(n_rows, repeat)
+
+def _bench_startup(n_rows, repeat):
+    results = []
+    for case, statement in STARTUP_IMPORTS.items():
+        code = f"import time; t = time.perf_counter(); {statement}; print(time.perf_counter() - t)"
+        runs = [_fresh_interpreter(code) for _ in range(repeat)]
+        results.append({"case": case, "imports_s": min(float(r[1]) for r in runs), "process_s": min(r[0] for r in runs)})
+
+    input_file = _suite_input(n_rows, 0)
+    code = f"from benchmark import _process_file_quietly; _process_file_quietly({input_file!r}, 20)"
+    results.append({"case": f"report {n_rows} rows, fresh interpreter",
+                    "process_s": min(_fresh_interpreter(code)[0] for _ in range(repeat))})
+    worker = ReportWorker()
+    try:
+        def warm_report():
+            with contextlib.redirect_stdout(io.StringIO()):
+                os.remove(worker.run("run_report", input_file, top_n_cards=20, top_n_cashiers=20, encrypt=False)[1])
+        def forget_aggregates():
+            worker.run("clear_aggregates")
+            return ()
+        warm_report()
+        results.append({"case": f"report {n_rows} rows, warm worker",
+                        "process_s": _repeated(warm_report, repeat, setup=forget_aggregates)[0]})
+    finally:
+        worker.stop()
+    return pd.DataFrame(results, columns=["case", "imports_s", "process_s"])
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the process.py interval engine, RawData writers and encryption.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=None,
+                        help="Row counts (default: 100k 1M 5M, or 10k 50k 200k with --suite).")
+    parser.add_argument("--no-legacy", action="store_true", help="Skip the row-by-row reference implementation.")
+    parser.add_argument("--writer", action="store_true", help="Benchmark the RawData writers instead of intervals.")
+    parser.add_argument("--encrypt", action="store_true", help="Benchmark on-disk against in-memory encryption.")
+    parser.add_argument("--startup", action="store_true",
+                        help="Time GUI startup imports and a report in a fresh interpreter against the warm worker.")
+    parser.add_argument("--suite", action="store_true",
+                        help="Time summarize_entities, build_interval_column, process_dynamic_schema and process_file.")
+    parser.add_argument("--top-n", type=int, nargs="+", default=SUITE_TOP_N, help="Top-N values for --suite.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per --suite case; the best and median are kept.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark_results.csv", help="Where --suite writes its results.")
+    args = parser.parse_args()
+    if args.sizes is None:
+        args.sizes = SUITE_SIZES if args.suite else [100_000, 1_000_000, 5_000_000]
+
+    if args.suite:
+        results = bench_suite(args.sizes, args.top_n, repeat=args.repeat, seed=args.seed)
+        # One line per case in a fixed order and precision, so two result files diff cleanly
+        results.to_csv(args.output, index=False, float_format="%.3f")
+        print(results.to_string(index=False, float_format=lambda x: f"{x:.3f}"))
+        print(f"\nWrote {args.output}")
+        return
+
+    if args.startup:
+        results = bench_startup(repeat=args.repeat)
+        print(results.to_string(index=False, na_rep="-", float_format=lambda x: f"{x:.3f}"))
+        return
+
+    if args.encrypt:
+        print(f"{'rows':>10} {'workbook MB':>12} {'disk (s)':>9} {'memory (s)':>11}")
+        for n_rows in args.sizes:
+            r = bench_encrypt(n_rows)
+            print(f"{r['rows']:>10} {r['workbook_mb']:>12.1f} {r['disk_s']:>9.1f} {r['memory_s']:>11.1f}")
+        return
+
+    if args.writer:
+        print(f"{'rows':>10} {'writer':>10} {'seconds':>9} {'rows/s':>10} {'peak RSS +MB':>13}")
+        for n_rows in args.sizes:
+            for streaming in (False, True):
+                r = bench_writer(n_rows, streaming)
+                rss = f"{r['peak_rss_delta_mb']:.0f}" if r["peak_rss_delta_mb"] is not None else "-"
+                print(f"{r['rows']:>10} {r['writer']:>10} {r['seconds']:>9.1f} {r['rows_per_s']:>10.0f} {rss:>13}")
+        return
+
+    print(f"{'rows':>10} {'legacy (s)':>12} {'vectorized (s)':>15} {'speedup':>9}")
+    for n_rows in args.sizes:
+        r = bench_intervals(n_rows, legacy=not args.no_legacy)
+        legacy = f"{r['legacy_s']:.2f}" if r["legacy_s"] is not None else "-"
+        speedup = f"{r['legacy_s'] / r['vectorized_s']:.0f}x" if r["legacy_s"] is not None else "-"
+        print(f"{r['rows']:>10} {legacy:>12} {r['vectorized_s']:>15.2f} {speedup:>9}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import hashlib
+import os
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+from ingest import parse_input
+
+def _user_dir():
+    """Per-user folder for files holding card numbers: %LOCALAPPDATA%\\VScan on Windows, ~/.cache/VScan elsewhere."""
+    base = os.environ.get("LOCALAPPDATA") or os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "VScan")
+
+USER_DIR = _user_dir()
+CACHE_DIR = os.path.join(USER_DIR, "cache")
+CACHE_MAX_BYTES = 4 * 1024 ** 3
+# Parsed extracts hold card numbers in plaintext; entries unused for this long are removed
+CACHE_MAX_AGE_SECONDS = 7 * 24 * 3600
+_HASH_BLOCK = 1024 * 1024
+# Datasets whose per-entity aggregates stay in memory
+AGGREGATE_CACHE_ENTRIES = 4
+
+# cache_key -> aggregates dict, least recently used first
+_aggregates = OrderedDict()
+# (absolute path, size, mtime) -> cache key, so a file is hashed once per change rather than on every read
+_keys = {}
+
+def _content_digest(path):
+    """Hash the whole file, so an edit that keeps its size and mtime still changes the key."""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(_HASH_BLOCK), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def cache_key(path):
+    """Return the cache key for ``path``: its absolute path, size, mtime and a hash of its content.
+
+    The content is hashed again only when the size or mtime has changed since
+    this process last hashed the file.
+    """
+    st = os.stat(path)
+    stat_key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    if stat_key not in _keys:
+        ident = f"{stat_key[0]}|{st.st_size}|{st.st_mtime_ns}|{_content_digest(path)}"
+        _keys[stat_key] = hashlib.sha1(ident.encode("utf-8")).hexdigest()
+    return _keys[stat_key]
+
+def _evict(cache_dir, max_bytes, max_age=CACHE_MAX_AGE_SECONDS):
+    """Remove the least recently used files in ``cache_dir`` until it fits in ``max_bytes``,
+    and any not used within ``max_age`` seconds.
+
+    The folder listing is the index: every file counts, including leftovers of
+    interrupted writes, and a file's mtime is its last use.
+    """
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue  # removed by another process meanwhile
+        if os.path.isfile(path):
+            entries.append((st.st_mtime, st.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    now = time.time()
+    for mtime, size, path in sorted(entries):
+        if total <= max_bytes and now - mtime <= max_age:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass  # in use by another process; try again next time
+
+def _store(df, data_file, cache_dir, max_bytes):
+    """Write ``df`` to ``data_file`` as Parquet and trim the cache; frames Arrow cannot store
+    faithfully (e.g. an Excel column mixing numbers and text) are not cached."""
+    tmp = f"{data_file}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        df.to_parquet(tmp)
+        os.replace(tmp, data_file)
+        _evict(cache_dir, max_bytes)
+    except Exception:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+
+def read_input(path, cache_dir=None, max_bytes=CACHE_MAX_BYTES, key=None):
+    """Return the parsed input file, from the on-disk cache when the same file was parsed before.
+
+    Entries are Parquet files in a per-user folder (CACHE_DIR), one per
+    ``cache_key``; pass ``key`` when it is already known to skip hashing the file again.
+    """
+    cache_dir = cache_dir or CACHE_DIR
+    data_file = os.path.join(cache_dir, f"{key or cache_key(path)}.parquet")
+    try:
+        df = pd.read_parquet(data_file)
+        os.utime(data_file)  # mark as recently used
+        return df
+    except Exception:
+        pass  # not cached yet, or an unreadable entry; parse again below
+
+    df = parse_input(path)
+    _store(df, data_file, cache_dir, max_bytes)
+    return df
+
+def load_aggregates(key, max_entries=AGGREGATE_CACHE_ENTRIES):
+    """Return the aggregates dict kept in memory for the dataset with cache key ``key``.
+
+    The dict is filled in by summarize_entities and its callers, so repeated
+    reports on the same input reuse the summaries already computed. At most
+    ``max_entries`` datasets are held; the least recently used one is dropped
+    beyond that. It is never written to disk, since it holds card numbers. An
+    empty dict is returned for a dataset not seen before.
+    """
+    if key in _aggregates:
+        _aggregates.move_to_end(key)
+        return _aggregates[key]
+
+    aggregates = _aggregates[key] = {}
+    while len(_aggregates) > max_entries:
+        _aggregates.popitem(last=False)
+    return aggregates
+
+def clear_aggregates():
+    """Drop the aggregates kept in memory for every dataset."""
+    _aggregates.clear()
@@ -0,0 +1,163 @@
+import argparse
+import contextlib
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+INPUT_EXTENSIONS = (".xlsx", ".csv")
+
+def expand_inputs(patterns):
+    """Resolve files, directories and glob patterns into a sorted list of unique input files."""
+    files = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = [os.path.join(pattern, name) for name in os.listdir(pattern)]
+        elif glob.has_magic(pattern):
+            matches = glob.glob(pattern)
+        else:
+            matches = [pattern]
+        for path in matches:
+            name = os.path.basename(path)
+            if name.lower().endswith(INPUT_EXTENSIONS) and not name.startswith("~$"):
+                files.append(os.path.abspath(path))
+    return sorted(set(files))
+
+def _output_prefix(input_file):
+    """Reports are named after their input so extracts covering the same month do not overwrite each other."""
+    return os.path.splitext(os.path.basename(input_file))[0] + "_"
+
+def run_one(input_file, options):
+    """Worker: build the report (or the card/cashier detail exports) for one input and describe the outcome."""
+    # Imported here so a bad install fails per file in the JSON result rather than at startup
+    from heavy_hitters import process_file_two_pass
+    from incremental import process_file_incremental
+    from process import process_entity_details_batch, process_file
+    from sqlsource import SQLiteSource, process_sql_source
+
+    result = {"input": input_file, "status": "ok"}
+    start = time.perf_counter()
+    try:
+        # process.py reports progress on stdout; keep stdout for the JSON results
+        with contextlib.redirect_stdout(sys.stderr):
+            if options["card_nos"] or options["cashiers"]:
+                result["outputs"] = process_entity_details_batch(
+                    input_file, card_nos=options["card_nos"], cashiers=options["cashiers"],
+                    include_intervals=options["include_intervals"], output_prefix=_output_prefix(input_file))
+            else:
+                stats = {}
+                report_options = dict(
+                    top_n_cards=options["top_n_cards"], top_n_cashiers=options["top_n_cashiers"],
+                    encrypt=options["encrypt"], separate_cards=options["separate_cards"],
+                    include_intervals=options["include_intervals"], streaming=options["streaming"],
+                    output_prefix=f"{input_file}_" if options["sqlite"] else _output_prefix(input_file), stats=stats)
+                if options["sqlite"]:
+                    source = SQLiteSource(options["sqlite"], input_file)
+                    try:
+                        _, final_file, _ = process_sql_source(source, raw_data=options["raw_data"], **report_options)
+                    finally:
+                        source.close()
+                    result["fetched_rows"] = stats["fetched_rows"]
+                elif options["incremental"]:
+                    _, final_file, _ = process_file_incremental(
+                        input_file, include_raw_data=options["raw_data"], **report_options)
+                    result["folded_rows"] = stats["folded_rows"]
+                elif options["two_pass"]:
+                    _, final_file, _ = process_file_two_pass(input_file, **report_options)
+                    result["candidates"] = stats["candidates"]
+                else:
+                    _, final_file, _ = process_file(input_file, velocity_alerts=options["velocity_alerts"],
+                                                    collusion_ranking=options["collusion_ranking"],
+                                                    output_format=options["output_format"], excel=options["excel"],
+                                                    **report_options)
+                result.update(output=final_file, rows=stats["rows"], stages=stats["stages"])
+    except Exception as e:
+        result.update(status="error", error=f"{type(e).__name__}: {e}")
+    result["seconds"] = round(time.perf_counter() - start, 3)
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Build VScan reports for many extracts without the GUI. Prints one JSON result per input file.")
+    parser.add_argument("inputs", nargs="+",
+                        help="Input .xlsx/.csv files, directories or glob patterns; table names with --sqlite.")
+    parser.add_argument("--top-cards", type=int, default=20)
+    parser.add_argument("--top-cashiers", type=int, default=20)
+    parser.add_argument("--no-encrypt", action="store_true", help="Leave the reports unencrypted.")
+    parser.add_argument("--separate", action="store_true", help="Separate card and cashier tables on TopCards.")
+    parser.add_argument("--no-intervals", action="store_true", help="Skip the transaction interval columns.")
+    parser.add_argument("--streaming", action="store_true",
+                        help="Use the streaming workbook writer (always used once RawData outgrows one sheet).")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Fold only rows newer than the last run of each input into its stored aggregates.")
+    parser.add_argument("--two-pass", action="store_true",
+                        help="Read each input twice in chunks instead of loading it; for extracts too large for memory. "
+                             "No RawData sheet.")
+    parser.add_argument("--sqlite", metavar="DATABASE",
+                        help="Report on tables of this SQLite file, aggregating in the database; no RawData sheet.")
+    parser.add_argument("--raw-data", action="store_true",
+                        help="With --incremental or --sqlite, also write the RawData sheet.")
+    parser.add_argument("--velocity", action="store_true",
+                        help="Add a VelocityAlerts sheet of card/cashier transaction bursts and fast branch changes.")
+    parser.add_argument("--collusion", action="store_true",
+                        help="Add CashierConcentration and CardRings sheets ranking every cashier and shared-card group.")
+    parser.add_argument("--format", choices=["xlsx", "parquet", "feather"], default="xlsx", dest="output_format",
+                        help="Write each sheet as a Parquet or Feather file instead of the workbook (.aes when encrypted).")
+    parser.add_argument("--excel", action="store_true",
+                        help="With --format parquet/feather, also build the workbook from the columnar files.")
+    parser.add_argument("--card", action="append", default=[], dest="card_nos",
+                        help="Export details for this card instead of building reports (repeatable).")
+    parser.add_argument("--cashier", action="append", default=[], dest="cashiers",
+                        help="Export details for this cashier instead of building reports (repeatable).")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Files processed at once (default: one per CPU). Each worker holds one whole extract in memory.")
+    args = parser.parse_args(argv)
+
+    files = sorted(set(args.inputs)) if args.sqlite else expand_inputs(args.inputs)
+    if not files:
+        parser.error("no .xlsx or .csv input files matched")
+
+    options = {
+        "top_n_cards": args.top_cards,
+        "top_n_cashiers": args.top_cashiers,
+        "encrypt": not args.no_encrypt,
+        "separate_cards": args.separate,
+        "include_intervals": not args.no_intervals,
+        "streaming": args.streaming,
+        "incremental": args.incremental,
+        "two_pass": args.two_pass,
+        "sqlite": args.sqlite,
+        "velocity_alerts": args.velocity,
+        "collusion_ranking": args.collusion,
+        "output_format": args.output_format,
+        "excel": args.excel,
+        "raw_data": args.raw_data,
+        "card_nos": args.card_nos,
+        "cashiers": args.cashiers,
+    }
+    if args.incremental and args.two_pass:
+        parser.error("--incremental and --two-pass cannot be combined")
+    if args.output_format != "xlsx" and (args.incremental or args.two_pass or args.sqlite):
+        parser.error("--format applies to normal runs; it cannot be combined with --incremental, --two-pass or --sqlite")
+    if args.sqlite and (args.incremental or args.two_pass or args.velocity or args.collusion or args.card_nos
+                        or args.cashiers):
+        parser.error("--sqlite builds TopCards/TopCashiers only; it cannot be combined with --incremental, --two-pass, "
+                     "--velocity, --collusion, --card or --cashier")
+    if (args.velocity or args.collusion) and (args.incremental or args.two_pass):
+        parser.error("--velocity and --collusion need the full input; they cannot be combined with --incremental "
+                     "or --two-pass")
+    workers = min(args.workers or os.cpu_count() or 1, len(files))
+
+    failed = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_one, path, options) for path in files]
+        for future in as_completed(futures):
+            result = future.result()
+            failed += result["status"] != "ok"
+            print(json.dumps(result), flush=True)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+
+from process import as_str_category
+
+# A card's transactions at one cashier that count as a repeat
+MIN_REPEAT = 2
+# Cashiers with fewer transactions are not scored: their shares are too noisy
+MIN_CASHIER_TXNS = 20
+# A card seen at no more than MAX_CARD_CASHIERS cashiers can be part of a shared-card ring
+MAX_CARD_CASHIERS = 3
+# A ring needs this many shared cards, between cashiers this similar (cosine over their ring cards)
+MIN_SHARED_CARDS = 3
+MIN_RING_SIMILARITY = 0.5
+MAX_RING_CASHIERS = 5
+_LISTED_CARDS = 50
+
+RING_COLUMNS = ["Cashiers", "Cashier Count", "Shared Cards", "Ring Transactions", "Share of Cashiers' Transactions",
+                "Cards"]
+
+def cashier_card_matrix(df):
+    """Return the cashier x card transaction counts as a CSR matrix, with the cashier and card labels.
+
+    Rows with either key missing are left out; labels are the keys' string form.
+    """
+    cashier_keys = as_str_category(df["cashier"])
+    card_keys = as_str_category(df["card_no"])
+    cashier_codes = cashier_keys.cat.codes.to_numpy()
+    card_codes = card_keys.cat.codes.to_numpy()
+    both = (cashier_codes >= 0) & (card_codes >= 0)
+    # Renumber so unused categories get no empty rows or columns
+    rows, cashier_used = pd.factorize(cashier_codes[both])
+    cols, card_used = pd.factorize(card_codes[both])
+    matrix = sparse.csr_matrix((np.ones(len(rows), dtype=np.int64), (rows, cols)),
+                               shape=(len(cashier_used), len(card_used)))
+    matrix.sum_duplicates()
+    cashiers = pd.Index(np.asarray(cashier_keys.cat.categories, dtype=object)[cashier_used])
+    cards = pd.Index(np.asarray(card_keys.cat.categories, dtype=object)[card_used])
+    return matrix, cashiers, cards
+
+def _z_scores(values):
+    """Standard scores; 0 when every value is the same."""
+    std = values.std()
+    return np.zeros(len(values)) if not std > 0 else (values - values.mean()) / std
+
+def rank_cashier_concentration(matrix, cashiers):
+    """Score every cashier on how much of their business comes from repeat cards that are loyal to them.
+
+    A card's loyalty to a cashier is the share of the card's transactions made
+    with that cashier. Loyal Repeat Share weights each repeat card's
+    transactions (at least MIN_REPEAT with the cashier) by that loyalty; Score
+    is its z-score across the cashiers with at least MIN_CASHIER_TXNS
+    transactions, highest first.
+    """
+    totals = np.asarray(matrix.sum(axis=1)).ravel()
+    card_totals = np.asarray(matrix.sum(axis=0)).ravel()
+    repeats = matrix.multiply(matrix >= MIN_REPEAT).tocsr()
+    loyal = repeats.multiply(repeats).multiply(1.0 / card_totals[None, :]).tocsr()  # M_cj * (M_cj / n_j)
+    shares = matrix.multiply(1.0 / np.maximum(totals, 1)[:, None]).tocsr()
+
+    out = pd.DataFrame({
+        "Cashier": cashiers.astype(str),
+        "Transactions": totals,
+        "Cards": np.diff(matrix.indptr),
+        "Repeat Cards": np.diff(repeats.indptr),
+        "Loyal Repeat Share": np.asarray(loyal.sum(axis=1)).ravel() / np.maximum(totals, 1),
+        "Card Concentration (HHI)": np.asarray(shares.multiply(shares).sum(axis=1)).ravel(),
+    })
+    out = out[out["Transactions"] >= MIN_CASHIER_TXNS].reset_index(drop=True)
+    out["Score"] = _z_scores(out["Loyal Repeat Share"].to_numpy())
+    out[["Loyal Repeat Share", "Card Concentration (HHI)", "Score"]] = out[
+        ["Loyal Repeat Share", "Card Concentration (HHI)", "Score"]].round(4)
+    return out.sort_values(["Score", "Transactions"], ascending=False, kind="stable").reset_index(drop=True)
+
+def find_card_rings(matrix, cashiers, cards):
+    """Find groups of cashiers that share a cluster of cards almost nobody else serves.
+
+    Ring cards are cards seen at no more than MAX_CARD_CASHIERS cashiers that
+    came back (MIN_REPEAT times) to at least two of them. Two cashiers
+    are linked when they share at least MIN_SHARED_CARDS such cards and their
+    ring-card sets have cosine similarity of at least MIN_RING_SIMILARITY; each
+    connected group of up to MAX_RING_CASHIERS cashiers is reported with the
+    cards whose cashiers all belong to it. Most shared cards first.
+    """
+    card_cashiers = np.diff((matrix > 0).tocsc().indptr)
+    presence = (matrix >= MIN_REPEAT).astype(np.int64).tocsc()
+    repeat_cashiers = np.diff(presence.indptr)
+    ring_cols = np.flatnonzero((repeat_cashiers >= 2) & (card_cashiers <= MAX_CARD_CASHIERS))
+    if len(ring_cols) == 0:
+        return pd.DataFrame(columns=RING_COLUMNS)
+    ring = presence[:, ring_cols].tocsr()
+
+    # Shared ring cards for every pair of cashiers, and their cosine similarity
+    shared = (ring @ ring.T).tocoo()
+    degree = np.diff(ring.indptr)
+    off_diagonal = shared.row != shared.col
+    a, b, n = shared.row[off_diagonal], shared.col[off_diagonal], shared.data[off_diagonal]
+    cosine = n / np.sqrt(degree[a] * degree[b])
+    linked = (n >= MIN_SHARED_CARDS) & (cosine >= MIN_RING_SIMILARITY)
+    if not linked.any():
+        return pd.DataFrame(columns=RING_COLUMNS)
+    graph = sparse.coo_matrix((np.ones(linked.sum()), (a[linked], b[linked])), shape=shared.shape)
+    _, labels = connected_components(graph, directed=False)
+
+    sizes = np.bincount(labels)
+    grouped = np.flatnonzero((sizes[labels] >= 2) & (sizes[labels] <= MAX_RING_CASHIERS))
+    groups, group_of = np.unique(labels[grouped], return_inverse=True)
+    membership = sparse.csr_matrix((np.ones(len(grouped), dtype=np.int64), (group_of, grouped)),
+                                   shape=(len(groups), matrix.shape[0]))
+
+    # A card belongs to a group when every cashier it was seen at is in the group
+    inside = (membership @ (matrix[:, ring_cols] > 0).astype(np.int64)).tocoo()
+    keep = inside.data == card_cashiers[ring_cols][inside.col]
+    members = sparse.csr_matrix((np.ones(keep.sum(), dtype=np.int64), (inside.row[keep], inside.col[keep])),
+                                shape=inside.shape)
+    ring_txns = np.asarray((membership @ matrix[:, ring_cols]).multiply(members).sum(axis=1)).ravel()
+    group_txns = membership @ np.asarray(matrix.sum(axis=1)).ravel()
+
+    cashier_names = cashiers.astype(str).to_numpy(dtype=object)
+    card_names = cards.astype(str).to_numpy(dtype=object)[ring_cols]
+    member_lists = np.split(membership.indices, membership.indptr[1:-1])
+    card_lists = np.split(members.indices, members.indptr[1:-1])
+    out = pd.DataFrame({
+        "Cashiers": [", ".join(cashier_names[m]) for m in member_lists],
+        "Cashier Count": np.diff(membership.indptr),
+        "Shared Cards": np.diff(members.indptr),
+        "Ring Transactions": ring_txns,
+        "Share of Cashiers' Transactions": (ring_txns / np.maximum(group_txns, 1)).round(4),
+        "Cards": [", ".join(card_names[c[:_LISTED_CARDS]]) + (" ..." if len(c) > _LISTED_CARDS else "")
+                  for c in card_lists],
+    })
+    out = out[out["Shared Cards"] >= MIN_SHARED_CARDS]
+    return out.sort_values(["Shared Cards", "Ring Transactions"], ascending=False, kind="stable").reset_index(drop=True)
+
+def collusion_sheets(df, aggregates=None):
+    """Return the CashierConcentration and CardRings tables for ``df`` as {sheet name: frame}.
+
+    The cashier x card matrix is kept in ``aggregates`` (see cache.load_aggregates) when given.
+    """
+    if "cashier" not in df.columns or "card_no" not in df.columns:
+        return {}
+    if aggregates is None:
+        aggregates = {}
+    if "cashier_card_matrix" not in aggregates:
+        aggregates["cashier_card_matrix"] = cashier_card_matrix(df)
+    matrix, cashiers, cards = aggregates["cashier_card_matrix"]
+    return {
+        "CashierConcentration": rank_cashier_concentration(matrix, cashiers),
+        "CardRings": find_card_rings(matrix, cashiers, cards),
+    }
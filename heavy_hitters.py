@@ -0,0 +1,196 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from ingest import CSV_CHUNK_SIZE, choose_date_column, iter_input_chunks, read_header
+from incremental import (expand_cashiers_from_state, finish_lines, fold_rows, new_state, state_columns,
+                         summarize_from_state)
+from instrument import RunRecorder, note_rows, write_run_record
+from process import (ReportCancelled, as_str_category, encrypt_output, log_output, month_range, output_folders,
+                     remove_quietly, report_target, report_stage, write_report)
+
+TWO_PASS_STAGES = ["count", "fold", "card summary", "cashier summary", "write", "encrypt"]
+# Counters kept per entity column; retries grow this when the candidates cannot be proven complete
+DEFAULT_CAPACITY = 10_000
+_GROWTH = 8
+_MAX_RETRIES = 2
+
+class FrequentItems:
+    """Misra-Gries frequent-items sketch over string keys, updated one chunk at a time.
+
+    At most ``capacity`` counters are kept. Each stored count is a lower bound
+    on the key's true count and ``error`` bounds how far below it can be, so
+    every key's true count lies in [count, count + error] (absent keys: [0, error]).
+    ``capacity=None`` keeps every key, i.e. exact counting.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.counts = pd.Series(dtype="int64")
+        self.error = 0
+
+    def update(self, keys):
+        """Add the non-missing values of ``keys`` (a chunk's column)."""
+        keys = as_str_category(keys)
+        codes = keys.cat.codes.to_numpy()
+        chunk_counts = np.bincount(codes[codes >= 0], minlength=len(keys.cat.categories))
+        chunk = pd.Series(chunk_counts, index=pd.Index(keys.cat.categories, dtype=object))
+        merged = self.counts.add(chunk[chunk > 0], fill_value=0).astype("int64")
+        if self.capacity is not None and len(merged) > self.capacity:
+            # Subtract the (capacity+1)-th largest count from every counter and drop those left at zero
+            cut = int(np.partition(merged.to_numpy(), len(merged) - self.capacity - 1)[len(merged) - self.capacity - 1])
+            merged = merged[merged > cut] - cut
+            self.error += cut
+        self.counts = merged
+
+    def candidates(self, n):
+        """Return the keys that may rank in the top ``n``, or None if absent keys cannot be ruled out."""
+        counts = self.counts.to_numpy()
+        if len(counts) < n:
+            # Fewer keys than requested: complete only if nothing was ever dropped
+            return self.counts.index if self.error == 0 else None
+        nth_lower = int(np.partition(counts, len(counts) - n)[len(counts) - n])
+        if self.error >= nth_lower:
+            return None
+        # Everything whose upper bound reaches the n-th lower bound, ties included
+        return self.counts.index[counts + self.error >= nth_lower]
+
+def _count_pass(input_file, entity_cols, top_ns, capacity, chunksize, cancel_event):
+    """First pass: sketch each entity column and find the date range. Returns candidates per column (or None)."""
+    sketches = {col: FrequentItems(capacity) for col in entity_cols}
+    first = last = None
+    rows = 0
+    for chunk in iter_input_chunks(input_file, chunksize):
+        if cancel_event is not None and cancel_event.is_set():
+            raise ReportCancelled("Cancelled while counting")
+        rows += len(chunk)
+        for col, sketch in sketches.items():
+            sketch.update(chunk[col])
+        date_col = choose_date_column(chunk.columns)
+        if date_col and chunk[date_col].notna().any():
+            lo, hi = chunk[date_col].min(), chunk[date_col].max()
+            first = lo if first is None else min(first, lo)
+            last = hi if last is None else max(last, hi)
+    candidates = {col: sketches[col].candidates(top_ns[col]) for col in entity_cols}
+    return candidates, rows, first, last
+
+def find_candidates(input_file, entity_cols, top_ns, capacity=DEFAULT_CAPACITY, chunksize=CSV_CHUNK_SIZE,
+                    cancel_event=None):
+    """Return a superset of each column's exact top-N keys, scanning the input with bounded memory.
+
+    If the sketch cannot prove a column's candidates complete (flat distributions),
+    that column is scanned again with more counters and finally with exact counting.
+    Also returns the row count and the first/last transaction time.
+    """
+    found = {}
+    pending = list(entity_cols)
+    rows, first, last = 0, None, None
+    for size in [capacity * _GROWTH ** i for i in range(_MAX_RETRIES + 1)] + [None]:
+        candidates, rows, first, last = _count_pass(input_file, pending, top_ns, size, chunksize, cancel_event)
+        found.update({col: keys for col, keys in candidates.items() if keys is not None})
+        pending = [col for col in pending if candidates[col] is None]
+        if not pending:
+            break
+    return found, rows, first, last
+
+def fold_candidates(input_file, candidates, chunksize=CSV_CHUNK_SIZE, cancel_event=None):
+    """Second pass: fold the rows of each column's candidate keys into an incremental state of its own.
+
+    Only the aggregates are kept, never the rows, plus each candidate row's
+    entity id and time: the input need not be in time order, so the interval
+    lines are built from those once the whole file is read. Returns
+    {entity column: state} and the number of rows folded.
+    """
+    states = {}
+    folded = 0
+    for chunk in iter_input_chunks(input_file, chunksize):
+        if cancel_event is not None and cancel_event.is_set():
+            raise ReportCancelled("Cancelled while folding rows")
+        date_col = choose_date_column(chunk.columns)
+        for col, keys in candidates.items():
+            if col not in states:
+                states[col] = new_state(state_columns(chunk, date_col), date_col, summarized=(col,))
+            chunk_keys = as_str_category(chunk[col])
+            wanted = np.flatnonzero(chunk_keys.cat.categories.isin(keys))
+            mask = np.isin(chunk_keys.cat.codes.to_numpy(), wanted)
+            if mask.any():
+                folded += fold_rows(states[col], chunk[mask], defer_lines=True)
+    for state in states.values():
+        finish_lines(state)
+    return states, folded
+
+def process_file_two_pass(input_file, top_n_cards=20, top_n_cashiers=20, encrypt=True, separate_cards=False,
+                          include_intervals=True, streaming=False, capacity=DEFAULT_CAPACITY, chunksize=CSV_CHUNK_SIZE,
+                          progress=None, cancel_event=None, output_prefix="", stats=None):
+    """Build TopCards/TopCashiers for an input too large to load, reading it twice in chunks.
+
+    The first pass keeps a bounded FrequentItems sketch per entity column to find
+    candidate top cards and cashiers; the second folds each chunk's rows of those
+    candidates into per-entity aggregates (incremental.fold_rows), from which the
+    tables come out as summarize_entities would give them on the whole input.
+    No rows are kept: memory is bounded by the sketch capacity, the candidates'
+    aggregates (their distinct days, values and cashier x card pairs) and the
+    time of each candidate row, kept until the interval lines are built.
+    There is no RawData sheet.
+    The other arguments and the return value are as for process_file.
+    """
+    output_folder, log_file = output_folders()
+    progress = recorder = RunRecorder(progress)
+
+    report_stage("count", progress, cancel_event, TWO_PASS_STAGES)
+    top_ns = {"card_no": top_n_cards, "cashier": top_n_cashiers}
+    header = read_header(input_file)
+    entity_cols = [col for col in top_ns if col in header]
+    date_col = choose_date_column(header)
+    if not date_col or not entity_cols:
+        raise RuntimeError("Two-pass mode needs a transaction date column and a card_no or cashier column.")
+    candidates, rows, first, last = find_candidates(input_file, entity_cols, top_ns, capacity, chunksize, cancel_event)
+    note_rows(progress, rows)
+
+    report_stage("fold", progress, cancel_event, TWO_PASS_STAGES)
+    states, folded = fold_candidates(input_file, candidates, chunksize, cancel_event)
+    note_rows(progress, folded)
+
+    report_stage("card summary", progress, cancel_event, TWO_PASS_STAGES)
+    card_summary = None
+    if "card_no" in states:
+        card_summary = summarize_from_state(states["card_no"], "card_no", top_n_cards, include_intervals)
+        note_rows(progress, len(card_summary))
+
+    report_stage("cashier summary", progress, cancel_event, TWO_PASS_STAGES)
+    expanded_df = None
+    if "cashier" in states:
+        cashier_summary = summarize_from_state(states["cashier"], "cashier", top_n_cashiers, include_intervals)
+        if not cashier_summary.empty:
+            expanded_df = expand_cashiers_from_state(states["cashier"], cashier_summary)
+            note_rows(progress, len(expanded_df))
+
+    report_stage("write", progress, cancel_event, TWO_PASS_STAGES)
+    if (card_summary is None or card_summary.empty) and expanded_df is None:
+        raise RuntimeError("No cards or cashiers found to summarize.")
+    output_file = os.path.join(output_folder, f"{output_prefix}top_transaction_{month_range(first, last)}.xlsx")
+    target = report_target(output_file, encrypt)
+    try:
+        write_report(None, target, card_summary, expanded_df, separate_cards, streaming, cancel_event=cancel_event)
+        report_stage("encrypt", progress, cancel_event, TWO_PASS_STAGES)
+    except ReportCancelled:
+        if not encrypt:
+            remove_quietly(output_file)
+        raise
+
+    final_file, password = encrypt_output(output_file, encrypt, buffer=target if encrypt else None)
+    log_output(log_file, input_file, final_file, encrypt, password, separate_cards, include_intervals)
+    record = recorder.record(
+        input=os.path.abspath(input_file), output=final_file, rows=rows,
+        candidates={col: len(keys) for col, keys in candidates.items()},
+        options={"top_n_cards": top_n_cards, "top_n_cashiers": top_n_cashiers, "encrypt": encrypt,
+                 "separate_cards": separate_cards, "include_intervals": include_intervals,
+                 "two_pass": True, "capacity": capacity, "chunksize": chunksize},
+    )
+    write_run_record(os.path.dirname(log_file), record)
+    if stats is not None:
+        stats.update(record)
+
+    print(f"Saved {'and encrypted ' if encrypt else ''}{final_file}")
+    return output_folder, final_file, (password if encrypt else None)
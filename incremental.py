@@ -0,0 +1,560 @@
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+from cache import USER_DIR
+from instrument import RunRecorder, note_rows, write_run_record
+from process import (ReportCancelled, as_str_category, assemble_cashier_table, build_interval_column, encrypt_output,
+                     entity_label, entity_timeline, finish_summary, group_sums, load_report_input, log_output,
+                     month_range, output_folders, remove_quietly, report_target, report_stage, txn_column,
+                     write_report)
+
+INCREMENTAL_STAGES = ["read", "fold", "card summary", "cashier summary", "write", "encrypt"]
+# States hold card numbers and are loaded with pickle, so they stay in the user's own folder, not the output folder
+STATE_DIR = os.path.join(USER_DIR, "incremental")
+STATE_VERSION = 2
+_NS_PER_DAY = 86_400_000_000_000
+# Timestamps are kept as int64 nanoseconds; NaT (an undated row) is the smallest int64
+_NAT = np.iinfo(np.int64).min
+
+def _distinct_specs(entity_col, columns):
+    """The (column, count name, list name) triples summarize_entities reports for ``entity_col``.
+
+    Cashier/card distincts come from the pair table, so they are not listed here.
+    """
+    specs = []
+    if "branch_code" in columns:
+        specs.append(("branch_code", "Distinct Branches", "Branch List"))
+    elif "branch_name" in columns:
+        specs.append(("branch_name", "Distinct Branches", "Branch List"))
+    if "register_no" in columns:
+        specs.append(("register_no", "Distinct Registers", "Register List"))
+    return specs
+
+def state_columns(df, date_col):
+    """The columns of ``df`` a state aggregates."""
+    wanted = ["card_no", "cashier", "branch_code", "branch_name", "register_no",
+              "trans_total", "transaction_amount", "point_earned", date_col]
+    return [c for c in wanted if c in df.columns]
+
+def new_state(columns, date_col, summarized=("card_no", "cashier")):
+    """Return an empty incremental state for inputs with ``columns`` (see state_columns).
+
+    Only the entity columns in ``summarized`` get aggregates; for the other one
+    just its keys are numbered, to label the cashier x card pair table.
+    """
+    state = {"version": STATE_VERSION, "columns": list(columns), "date_col": date_col,
+             "watermark": None, "min_time": None, "rows_folded": 0, "undated_folded": 0, "next_pos": 0,
+             "entities": {}, "pairs": None}
+    for entity_col in ("card_no", "cashier"):
+        if entity_col not in columns:
+            continue
+        if entity_col not in summarized:
+            state["entities"][entity_col] = {"keys_only": True, "summary": pd.DataFrame(index=pd.Index([], dtype=object))}
+            continue
+        state["entities"][entity_col] = {
+            # One row per entity in first-seen order; the row position is the entity id used by the other tables
+            "summary": pd.DataFrame({"first_pos": pd.Series(dtype="int64"), "month": pd.Series(dtype=object),
+                                     "count": pd.Series(dtype="int64"), "first": pd.Series(dtype="int64"),
+                                     "last": pd.Series(dtype="int64"), "sum_total": pd.Series(dtype="float64"),
+                                     "sum_points": pd.Series(dtype="float64")},
+                                    index=pd.Index([], dtype=object)),
+            "days": pd.DataFrame({"eid": pd.Series(dtype="int64"), "day": pd.Series(dtype="int64"),
+                                  "n": pd.Series(dtype="int64"), "first_pos": pd.Series(dtype="int64")}),
+            "distinct": {col: pd.DataFrame({"eid": pd.Series(dtype="int64"), "value": pd.Series(dtype=object),
+                                            "first_pos": pd.Series(dtype="int64")})
+                         for col, _, _ in _distinct_specs(entity_col, columns)},
+            "lines": pd.DataFrame({"eid": pd.Series(dtype="int64"), "day": pd.Series(dtype="int64"),
+                                   "head": pd.Series(dtype="int64"), "gaps": pd.Series(dtype=object)}),
+        }
+    if "card_no" in columns and "cashier" in columns:
+        state["pairs"] = pd.DataFrame({"cashier": pd.Series(dtype="int64"), "card": pd.Series(dtype="int64"),
+                                       "count": pd.Series(dtype="int64"), "first": pd.Series(dtype="datetime64[ns]"),
+                                       "last": pd.Series(dtype="datetime64[ns]"), "sum_total": pd.Series(dtype="float64"),
+                                       "first_pos": pd.Series(dtype="int64")})
+    return state
+
+def load_state(path):
+    """Return the state pickled at ``path``, or None if there is none or it cannot be read."""
+    try:
+        state = pd.read_pickle(path)
+    except Exception:
+        return None
+    return state if isinstance(state, dict) and state.get("version") == STATE_VERSION else None
+
+def save_state(state, path):
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    pd.to_pickle(state, tmp)
+    os.replace(tmp, path)
+
+def state_path(input_file, state_dir=None):
+    """The state file for ``input_file``: one per input path, kept in ``state_dir`` (STATE_DIR by default)."""
+    abs_path = os.path.abspath(input_file)
+    stem = os.path.splitext(os.path.basename(abs_path))[0]
+    digest = hashlib.sha1(abs_path.encode("utf-8")).hexdigest()[:12]
+    return os.path.join(state_dir or STATE_DIR, f"{stem}_{digest}.pkl")
+
+def _string_codes(values):
+    """Return integer codes for the string form of ``values`` (-1 where missing) and the strings they index."""
+    keys = as_str_category(values)
+    return keys.cat.codes.to_numpy().astype(np.int64), np.asarray(keys.cat.categories, dtype=object)
+
+def _entity_ids(summary, keys):
+    """Map ``keys`` (unique strings) to entity ids, numbering unseen keys after the existing ones."""
+    eids = summary.index.get_indexer(keys)
+    unseen = eids < 0
+    eids[unseen] = len(summary) + np.arange(unseen.sum())
+    return eids
+
+def _fold_lines(lines, eids, ns, old_last):
+    """Extend the per-entity-day interval lines with new timestamps.
+
+    Each (entity, day) keeps the time of its first transaction and its gaps in
+    whole minutes joined with " > ", exactly as build_intervals renders them;
+    the first new timestamp of an entity continues from ``old_last``.
+    """
+    order = np.lexsort((ns, eids))
+    s_eid = eids[order]
+    s_ns = ns[order]
+    first_of = np.ones(len(order), dtype=bool)
+    first_of[1:] = s_eid[1:] != s_eid[:-1]
+    prev = np.empty_like(s_ns)
+    prev[1:] = s_ns[:-1]
+    prev[first_of] = old_last[s_eid[first_of]]
+    has_prev = ~first_of | (prev != np.iinfo(np.int64).min)
+    day = s_ns // _NS_PER_DAY
+    cont = has_prev & (prev // _NS_PER_DAY == day)
+
+    heads = pd.DataFrame({"eid": s_eid[~cont], "day": day[~cont], "head": s_ns[~cont]})
+    gaps = ((s_ns[cont] - prev[cont]) / 1e9 / 60).astype("int64").astype(str)
+    tails = (
+        pd.Series(gaps).groupby([s_eid[cont], day[cont]], sort=False).agg(" > ".join)
+        .rename_axis(["eid", "day"]).rename("gaps").reset_index()
+    )
+    starts_here = pd.MultiIndex.from_frame(tails[["eid", "day"]]).isin(pd.MultiIndex.from_frame(heads[["eid", "day"]]))
+    new_lines = heads.merge(tails[starts_here], on=["eid", "day"], how="left")
+    new_lines["gaps"] = new_lines["gaps"].fillna("")
+
+    # The other gaps continue a stored line: the day the entity was last seen on
+    carried = tails[~starts_here]
+    if not carried.empty:
+        at = pd.MultiIndex.from_frame(lines[["eid", "day"]]).get_indexer(pd.MultiIndex.from_frame(carried[["eid", "day"]]))
+        old_gaps = lines["gaps"].to_numpy(dtype=object).copy()
+        old_gaps[at] = [g + " > " + a if g else a for g, a in zip(old_gaps[at], carried["gaps"])]
+        lines = lines.assign(gaps=old_gaps)
+    return pd.concat([lines, new_lines], ignore_index=True)
+
+def _fold_keys(est, rows, entity_col):
+    """Number the new keys of a key-only entity column; returns the entity id of each row (-1 where missing)."""
+    key_codes, key_strings = _string_codes(rows[entity_col])
+    present = key_codes >= 0
+    codes, unique_codes = pd.factorize(key_codes[present])
+    uniques = key_strings[unique_codes]
+    eids = _entity_ids(est["summary"], uniques)
+    unseen = eids >= len(est["summary"])
+    if unseen.any():
+        est["summary"] = pd.concat([est["summary"], pd.DataFrame(index=pd.Index(uniques[unseen], dtype=object))])
+    out = np.full(len(rows), -1, dtype=np.int64)
+    out[present] = eids[codes]
+    return out
+
+def _earliest(a, b):
+    """Elementwise minimum of two int64 timestamp arrays, ignoring NaT."""
+    return np.where(a == _NAT, b, np.where(b == _NAT, a, np.minimum(a, b)))
+
+def _fold_entity(est, rows, entity_col, pos, ns, columns, defer_lines=False):
+    """Fold the new ``rows`` into one entity's aggregates; returns the entity id of each folded row.
+
+    Undated rows (NaT in ``ns``) count towards the totals, sums and distinct
+    lists but not the first/last times, days or intervals, as in summarize_entities.
+    With ``defer_lines`` the dated rows' timestamps are set aside for finish_lines.
+    """
+    key_codes, key_strings = _string_codes(rows[entity_col])
+    present = key_codes >= 0
+    codes, unique_codes = pd.factorize(key_codes[present])
+    uniques = key_strings[unique_codes]
+    n_new = len(uniques)
+    p, t = pos[present], ns[present]
+
+    summary = est["summary"]
+    eids = _entity_ids(summary, uniques)
+    old_last = np.full(len(summary) + n_new, _NAT, dtype=np.int64)
+    old_last[:len(summary)] = summary["last"].to_numpy()
+
+    first_rows = ~pd.Series(codes).duplicated().to_numpy()
+    first_times = pd.to_datetime(t[first_rows].view("datetime64[ns]"))
+    grouped = pd.DataFrame({"code": codes, "t": t.view("datetime64[ns]")}).groupby("code")["t"]
+    part = pd.DataFrame({
+        "first_pos": p[first_rows],
+        "month": [str(m) for m in first_times.to_period("M")],  # "NaT" when the first row is undated
+        "count": np.bincount(codes, minlength=n_new),
+        "first": grouped.min().reindex(range(n_new)).to_numpy(dtype="datetime64[ns]").view("int64"),
+        "last": grouped.max().reindex(range(n_new)).to_numpy(dtype="datetime64[ns]").view("int64"),
+        "sum_total": 0.0,
+        "sum_points": 0.0,
+    }, index=pd.Index(uniques, dtype=object))
+    txn_col = txn_column(columns)
+    if txn_col:
+        part["sum_total"] = group_sums(rows[txn_col][present], codes, n_new)
+    if "point_earned" in columns:
+        part["sum_points"] = group_sums(rows["point_earned"][present], codes, n_new)
+
+    seen = eids < len(summary)
+    updated = summary.copy()
+    for col, combine in (("count", np.add), ("first", _earliest), ("last", np.maximum),
+                         ("sum_total", np.add), ("sum_points", np.add)):
+        values = updated[col].to_numpy().copy()
+        values[eids[seen]] = combine(values[eids[seen]], part[col].to_numpy()[seen])
+        updated[col] = values
+    # New entities are appended so existing entity ids stay valid
+    est["summary"] = pd.concat([updated, part[~seen]])
+
+    row_eids = eids[codes]
+    dated = t != _NAT
+    day = t[dated] // _NS_PER_DAY
+    day_part = (
+        pd.DataFrame({"eid": row_eids[dated], "day": day, "pos": p[dated]})
+        .groupby(["eid", "day"], sort=False).agg(n=("pos", "size"), first_pos=("pos", "min")).reset_index()
+    )
+    est["days"] = (
+        pd.concat([est["days"], day_part], ignore_index=True)
+        .groupby(["eid", "day"], sort=False).agg(n=("n", "sum"), first_pos=("first_pos", "min")).reset_index()
+    )
+
+    for col, table in est["distinct"].items():
+        value_codes, value_strings = _string_codes(rows[col])
+        value_codes = value_codes[present]
+        has = value_codes >= 0
+        part_values = (
+            pd.DataFrame({"eid": row_eids[has], "value": value_codes[has], "first_pos": p[has]})
+            .drop_duplicates(["eid", "value"])
+        )
+        part_values["value"] = value_strings[part_values["value"].to_numpy()]
+        # Stored pairs come first, so drop_duplicates keeps each value's earliest appearance
+        est["distinct"][col] = pd.concat([table, part_values], ignore_index=True).drop_duplicates(["eid", "value"])
+
+    if defer_lines:
+        est.setdefault("line_times", []).append((row_eids[dated], t[dated]))
+    else:
+        est["lines"] = _fold_lines(est["lines"], row_eids[dated], t[dated], old_last)
+
+    out = np.full(len(rows), -1, dtype=np.int64)
+    out[present] = row_eids
+    return out
+
+def _fold_pairs(pairs, cashier_eids, card_eids, pos, ns, amounts):
+    """Fold new rows into the cashier x card pair table (count, first/last time, amount sum, first-seen)."""
+    both = (cashier_eids >= 0) & (card_eids >= 0)
+    part = pd.DataFrame({"cashier": cashier_eids[both], "card": card_eids[both], "pos": pos[both],
+                         "t": ns[both].view("datetime64[ns]"),
+                         "amount": amounts[both] if amounts is not None else 0.0})
+    part = part.groupby(["cashier", "card"], sort=False).agg(
+        count=("pos", "size"), first=("t", "min"), last=("t", "max"),
+        sum_total=("amount", "sum"), first_pos=("pos", "min"),
+    ).reset_index()
+    return (
+        pd.concat([pairs, part], ignore_index=True)
+        .groupby(["cashier", "card"], sort=False)
+        .agg(count=("count", "sum"), first=("first", "min"), last=("last", "max"),
+             sum_total=("sum_total", "sum"), first_pos=("first_pos", "min"))
+        .reset_index()
+    )
+
+def fold_input(state, df, date_col):
+    """Fold the rows of ``df`` dated after the state's watermark into ``state``.
+
+    ``df`` may be the whole month-to-date extract or only the rows added since
+    the last run. If it holds a different number of rows at or before the
+    watermark than were folded, the extract was restated and the state is
+    rebuilt from ``df``. Rows without a parseable date are folded too: all of
+    them when ``df`` holds only new rows, otherwise the ones past the number
+    already folded, i.e. new undated rows are taken to be appended like the
+    dated ones. Returns the updated state and the number of rows folded.
+    """
+    columns = state_columns(df, date_col)
+    times = df[date_col]
+    dated = times.notna().to_numpy()
+    undated = np.flatnonzero(~dated)
+    if state is not None and (state["columns"] != columns or state["date_col"] != date_col):
+        state = None
+    if state is not None and state["watermark"] is not None:
+        n_old = int((dated & (times <= state["watermark"]).to_numpy()).sum())
+        if n_old and (n_old != state["rows_folded"] or len(undated) < state["undated_folded"]):
+            state = None
+        elif n_old:
+            undated = undated[state["undated_folded"]:]  # the whole extract again: skip the undated rows seen before
+    if state is None:
+        state = new_state(columns, date_col)
+        undated = np.flatnonzero(~dated)
+
+    fresh = dated.copy() if state["watermark"] is None else dated & (times > state["watermark"]).to_numpy()
+    fresh[undated] = True
+    return state, fold_rows(state, df[fresh])
+
+def fold_rows(state, rows, defer_lines=False):
+    """Fold every row of ``rows`` into ``state``, after the rows folded before; returns the number folded.
+
+    ``rows`` needs the state's columns. Rows are taken in order, so the order in
+    which entities and values are first seen is the order they are folded in.
+    Interval lines continue from each entity's last folded time, so they are
+    only right if later batches hold later rows; for batches in any other order
+    pass ``defer_lines`` and call finish_lines once every batch is folded.
+    """
+    if rows.empty:
+        return 0
+    columns = state["columns"]
+    ns = rows[state["date_col"]].to_numpy(dtype="datetime64[ns]").view("int64")
+    pos = state["next_pos"] + np.arange(len(rows), dtype=np.int64)
+    eids = {}
+    for entity_col, est in state["entities"].items():
+        if est.get("keys_only"):
+            eids[entity_col] = _fold_keys(est, rows, entity_col)
+        else:
+            eids[entity_col] = _fold_entity(est, rows, entity_col, pos, ns, columns, defer_lines)
+    if state["pairs"] is not None:
+        txn_col = txn_column(columns)
+        amounts = rows[txn_col].to_numpy(dtype="float64", na_value=0.0) if txn_col else None
+        state["pairs"] = _fold_pairs(state["pairs"], eids["cashier"], eids["card_no"], pos, ns, amounts)
+
+    stamped = ns[ns != _NAT]
+    if len(stamped):
+        batch_max = pd.Timestamp(stamped.max())
+        batch_min = pd.Timestamp(stamped.min())
+        state["watermark"] = batch_max if state["watermark"] is None else max(state["watermark"], batch_max)
+        state["min_time"] = batch_min if state["min_time"] is None else min(state["min_time"], batch_min)
+    state["rows_folded"] += len(stamped)
+    state["undated_folded"] += len(rows) - len(stamped)
+    state["next_pos"] += len(rows)
+    return len(rows)
+
+def finish_lines(state):
+    """Build the interval lines of a state folded with ``defer_lines`` from all its timestamps at once."""
+    for est in state["entities"].values():
+        pending = est.pop("line_times", None)
+        if not pending:
+            continue
+        eids = np.concatenate([e for e, _ in pending])
+        ns = np.concatenate([t for _, t in pending])
+        est["lines"] = _fold_lines(est["lines"], eids, ns, np.full(len(est["summary"]), _NAT, dtype=np.int64))
+
+def _ordered_lists(table, eids, value_col, strings=None):
+    """Return each entity's values joined with ", " in first-seen order, and their count."""
+    sub = table[np.isin(table["eid"].to_numpy(), eids)].sort_values(["eid", "first_pos"], kind="stable")
+    sub_eids = sub["eid"].to_numpy()
+    values = sub[value_col].to_numpy()
+    if strings is not None:
+        values = strings[values]
+    values = np.asarray(values, dtype=object)
+    starts = np.searchsorted(sub_eids, eids, side="left")
+    ends = np.searchsorted(sub_eids, eids, side="right")
+    return [", ".join(values[s:e]) for s, e in zip(starts, ends)], ends - starts
+
+def _day_labels(days, eids, busiest):
+    """Label of each entity's busiest (or quietest) day; ties go to the day seen first."""
+    sub = days[np.isin(days["eid"].to_numpy(), eids)]
+    picked = sub.sort_values(["eid", "n", "first_pos"], ascending=[True, not busiest, True]).drop_duplicates("eid")
+    labels = (pd.to_datetime(picked["day"].to_numpy() * _NS_PER_DAY).strftime("%Y-%m-%d")
+              + " (" + picked["n"].astype(str).to_numpy() + ")")
+    return pd.Series(labels, index=picked["eid"].to_numpy()).reindex(eids).fillna("N/A").to_numpy()
+
+def _interval_strings(lines, keys, eids):
+    sub = lines[np.isin(lines["eid"].to_numpy(), eids) & (lines["gaps"] != "").to_numpy()]
+    if sub.empty:
+        return {}
+    sub = sub.sort_values(["eid", "day"])
+    text = pd.to_datetime(sub["head"].to_numpy()).strftime("%Y-%m-%d %H:%M") + ": " + sub["gaps"].to_numpy()
+    joined = pd.Series(text, index=sub["eid"].to_numpy()).groupby(level=0).agg("\n".join)
+    key_by_eid = dict(zip(eids, keys))
+    return {key_by_eid[eid]: s for eid, s in joined.items()}
+
+def summarize_from_state(state, entity_col, top_n=20, include_intervals=True):
+    """Return the same table as ``summarize_entities`` for the folded rows, from the stored aggregates."""
+    est = state["entities"].get(entity_col)
+    if est is None or est.get("keys_only") or est["summary"].empty:
+        return pd.DataFrame()
+    summary = est["summary"]
+    columns = state["columns"]
+
+    # Most transactions first, ties to the entity seen first
+    ranked = np.lexsort((summary["first_pos"].to_numpy(), -summary["count"].to_numpy()))[:top_n]
+    top = summary.iloc[ranked]
+    keys = top.index.to_numpy(dtype=object)
+
+    out = pd.DataFrame({entity_label(entity_col): keys}, index=pd.Index(keys, dtype=object))
+    out["Month"] = top["month"].to_numpy()
+    out["Total Transactions"] = top["count"].to_numpy()
+    out["First Transaction"] = pd.to_datetime(top["first"].to_numpy())
+    out["Last Transaction"] = pd.to_datetime(top["last"].to_numpy())
+    out["Day with Most Transactions"] = _day_labels(est["days"], ranked, busiest=True)
+    out["Day with Fewest Transactions"] = _day_labels(est["days"], ranked, busiest=False)
+
+    specs = dict((col, (count_name, list_name)) for col, count_name, list_name in _distinct_specs(entity_col, columns))
+    branch_col = "branch_code" if "branch_code" in specs else ("branch_name" if "branch_name" in specs else None)
+    pairs = state["pairs"]
+
+    def add(count_name, list_name, table, value_col, strings=None):
+        lists, counts = _ordered_lists(table, ranked, value_col, strings)
+        out[count_name] = counts
+        out[list_name] = lists
+
+    if branch_col:
+        add(*specs[branch_col], est["distinct"][branch_col], "value")
+    if entity_col != "cashier" and pairs is not None:
+        cashier_keys = state["entities"]["cashier"]["summary"].index.to_numpy(dtype=object)
+        add("Distinct Cashiers", "Cashier List", pairs.rename(columns={"card": "eid"}), "cashier", cashier_keys)
+    if "register_no" in specs:
+        add(*specs["register_no"], est["distinct"]["register_no"], "value")
+    if entity_col == "cashier" and pairs is not None:
+        card_keys = state["entities"]["card_no"]["summary"].index.to_numpy(dtype=object)
+        add("Distinct Cards", "Cards List", pairs.rename(columns={"cashier": "eid"}), "card", card_keys)
+
+    if txn_column(columns):
+        out["Sum of Transaction Total"] = top["sum_total"].to_numpy()
+    if "point_earned" in columns:
+        out["Total Points"] = top["sum_points"].to_numpy()
+
+    interval_strings = _interval_strings(est["lines"], keys, ranked) if include_intervals else None
+    return finish_summary(out, keys, interval_strings)
+
+def expand_cashiers_from_state(state, cashier_summary):
+    """Return the TopCashiers table (cashier rows followed by their cards) from the stored pair table."""
+    pairs = state["pairs"]
+    if pairs is None or "Cards List" not in cashier_summary.columns:
+        return cashier_summary.copy()
+    leaders = cashier_summary.reset_index(drop=True)
+    cashier_index = state["entities"]["cashier"]["summary"].index
+    card_keys = state["entities"]["card_no"]["summary"].index.to_numpy(dtype=object)
+
+    leader_eids = cashier_index.get_indexer(leaders["Cashier"].astype(str))
+    picked = pd.DataFrame({"leader": np.arange(len(leaders)), "cashier": leader_eids})
+    cards = picked.merge(pairs, on="cashier", how="inner", sort=False)
+    cards = cards.sort_values(["leader", "first_pos"], kind="stable")
+    cards = pd.DataFrame({
+        "leader": cards["leader"].to_numpy(),
+        "card": card_keys[cards["card"].to_numpy()],
+        "Total_Transactions": cards["count"].to_numpy(),
+        "First_Transaction": pd.to_datetime(cards["first"].to_numpy()),
+        "Last_Transaction": pd.to_datetime(cards["last"].to_numpy()),
+        "Sum_Transaction_Total": cards["sum_total"].to_numpy(),
+    })
+    cards["card"] = cards["card"].str.strip()
+    return assemble_cashier_table(leaders, cards, has_sums=txn_column(state["columns"]) is not None)
+
+def _card_continuity(state):
+    """The watermark and each card's last folded timestamp (ns), read before new rows are folded."""
+    if state is None or state["watermark"] is None or "card_no" not in state["entities"]:
+        return None
+    return state["watermark"], state["entities"]["card_no"]["summary"]["last"].copy()
+
+def _raw_data_with_intervals(df, date_col, continuity):
+    """RawData for the incremental report: the input rows with interval_minutes.
+
+    With ``continuity`` (from _card_continuity), a card's first row in this input
+    continues from its last folded timestamp, so a file holding only the new
+    days gets the same gaps as the full extract.
+    """
+    df = df.copy()
+    if "card_no" not in df.columns:
+        return df
+    timeline = entity_timeline(df, date_col, "card_no")
+    intervals = build_interval_column(df, date_col, "card_no", timeline=timeline)
+    if continuity is not None:
+        watermark, card_last = continuity
+        first_of = timeline[timeline["gap"].isna()]
+        newer = first_of[first_of["time"] > watermark]
+        at = card_last.index.get_indexer(newer["entity"].astype(str).to_numpy())
+        known = at >= 0
+        last = card_last.to_numpy()[at[known]]
+        gaps = (newer["time"].to_numpy(dtype="datetime64[ns]").view("int64")[known] - last) / 1e9 / 60
+        values = intervals.to_numpy().copy()
+        values[newer.index.to_numpy()[known]] = gaps
+        intervals = pd.Series(values, index=df.index)
+    df["interval_minutes"] = intervals
+    return df
+
+def process_file_incremental(input_file, top_n_cards=20, top_n_cashiers=20, encrypt=True, separate_cards=False,
+                             include_intervals=True, include_raw_data=False, streaming=False, rebuild=False,
+                             progress=None, cancel_event=None, output_prefix="", stats=None):
+    """Build the TopCards/TopCashiers report for a growing month-to-date extract.
+
+    Per-entity aggregates are kept in a state file per input path, in the
+    user's own STATE_DIR; each run only folds in rows dated after the stored
+    watermark and regenerates the summary sheets from the aggregates. RawData is left out unless ``include_raw_data``
+    is set, since writing the whole month's rows is what makes a full run slow.
+    ``rebuild`` discards the stored state first. The other arguments and the
+    return value are as for process_file.
+
+    The tables match process_file's when the extract only grows at the end.
+    Entities and values are ordered by when they were folded in, so with rows
+    inserted before older ones, day ties and the order of the distinct lists
+    can differ from a full run.
+    """
+    output_folder, log_file = output_folders()
+    progress = recorder = RunRecorder(progress)
+
+    report_stage("read", progress, cancel_event, INCREMENTAL_STAGES)
+    df, date_col = load_report_input(input_file)
+    if not date_col:
+        raise RuntimeError("No transaction date column found; incremental mode needs one for its watermark.")
+    note_rows(progress, len(df))
+
+    report_stage("fold", progress, cancel_event, INCREMENTAL_STAGES)
+    path = state_path(input_file)
+    previous = None if rebuild else load_state(path)
+    continuity = _card_continuity(previous)
+    state, folded = fold_input(previous, df, date_col)
+    if state is not previous:
+        continuity = None  # restated extract: the state was rebuilt from this input
+    if state["watermark"] is None:
+        raise RuntimeError("No dated transactions found to report on.")
+    save_state(state, path)
+    note_rows(progress, folded)
+
+    report_stage("card summary", progress, cancel_event, INCREMENTAL_STAGES)
+    card_summary = summarize_from_state(state, "card_no", top_n_cards, include_intervals)
+    note_rows(progress, len(card_summary))
+
+    report_stage("cashier summary", progress, cancel_event, INCREMENTAL_STAGES)
+    expanded_df = None
+    cashier_summary = summarize_from_state(state, "cashier", top_n_cashiers, include_intervals)
+    if not cashier_summary.empty:
+        expanded_df = expand_cashiers_from_state(state, cashier_summary)
+        note_rows(progress, len(expanded_df))
+
+    report_stage("write", progress, cancel_event, INCREMENTAL_STAGES)
+    raw = None
+    if include_raw_data:
+        raw = _raw_data_with_intervals(df, date_col, continuity) if include_intervals else df
+    elif card_summary.empty and expanded_df is None:
+        raise RuntimeError("No card_no or cashier column to summarize.")
+    note_rows(progress, sum(len(t) for t in (raw, card_summary, expanded_df) if t is not None))
+    months = month_range(state["min_time"], state["watermark"])
+    output_file = os.path.join(output_folder, f"{output_prefix}top_transaction_{months}.xlsx")
+    target = report_target(output_file, encrypt)
+    try:
+        write_report(raw, target, card_summary if not card_summary.empty else None, expanded_df, separate_cards,
+                      streaming, cancel_event=cancel_event)
+        report_stage("encrypt", progress, cancel_event, INCREMENTAL_STAGES)
+    except ReportCancelled:
+        if not encrypt:
+            remove_quietly(output_file)
+        raise
+
+    final_file, password = encrypt_output(output_file, encrypt, buffer=target if encrypt else None)
+    log_output(log_file, input_file, final_file, encrypt, password, separate_cards, include_intervals)
+    record = recorder.record(
+        input=os.path.abspath(input_file), output=final_file, rows=len(df), folded_rows=folded,
+        watermark=str(state["watermark"]),
+        options={"top_n_cards": top_n_cards, "top_n_cashiers": top_n_cashiers, "encrypt": encrypt,
+                 "separate_cards": separate_cards, "include_intervals": include_intervals,
+                 "include_raw_data": include_raw_data, "incremental": True},
+    )
+    write_run_record(os.path.dirname(log_file), record)
+    if stats is not None:
+        stats.update(record)
+
+    print(f"Saved {'and encrypted ' if encrypt else ''}{final_file}")
+    return output_folder, final_file, (password if encrypt else None)
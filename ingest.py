@@ -0,0 +1,264 @@
+import csv
+import os
+import posixpath
+import re
+import zipfile
+from xml.etree.ElementTree import iterparse
+
+# pandas and openpyxl are imported where they are used, so the GUI can probe a header without them
+# Columns the reports read; everything else in a CSV extract is skipped at parse time
+ID_COLUMNS = ["card_no", "cashier", "branch_code", "branch_name", "register_no"]
+AMOUNT_COLUMNS = ["trans_total", "transaction_amount", "point_earned"]
+CSV_CHUNK_SIZE = 500_000
+
+_MAIN_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_REL_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+_PKG_REL_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+# (absolute path, size, mtime) -> (columns, date column)
+_schemas = {}
+
+def choose_date_column(columns):
+    """Return the transaction datetime column among ``columns``, or None."""
+    if "transaction_datetime" in columns:
+        return "transaction_datetime"
+    if "TransactionDateTime" in columns:
+        return "TransactionDateTime"
+    for col in columns:
+        if col.lower().startswith("transaction") and "time" in col.lower():
+            return col
+    return None
+
+def is_csv(path):
+    return str(path).lower().endswith(".csv")
+
+def _first_sheet_path(zf):
+    """Return the archive path of the workbook's first sheet."""
+    with zf.open("xl/workbook.xml") as f:
+        for _, elem in iterparse(f):
+            if elem.tag == f"{_MAIN_NS}sheet":
+                rel_id = elem.get(f"{_REL_NS}id")
+                break
+        else:
+            raise ValueError("workbook has no sheets")
+    with zf.open("xl/_rels/workbook.xml.rels") as f:
+        for _, elem in iterparse(f):
+            if elem.tag == f"{_PKG_REL_NS}Relationship" and elem.get("Id") == rel_id:
+                target = elem.get("Target")
+                return target.lstrip("/") if target.startswith("/") else posixpath.normpath(posixpath.join("xl", target))
+    raise ValueError("first sheet not found")
+
+def _column_number(ref):
+    letters = re.match(r"[A-Z]+", ref).group()
+    n = 0
+    for ch in letters:
+        n = n * 26 + ord(ch) - 64
+    return n - 1
+
+def _text(elem):
+    """Text of a shared or inline string: plain, or rich text runs concatenated (phonetic runs are skipped)."""
+    plain = elem.find(f"{_MAIN_NS}t")
+    if plain is not None:
+        return plain.text or ""
+    return "".join(run.findtext(f"{_MAIN_NS}t", default="") for run in elem.findall(f"{_MAIN_NS}r"))
+
+def _first_row_cells(zf, sheet_path):
+    """Stream the sheet XML up to row 1, the header pandas uses; returns {column number: (type, raw value)}."""
+    with zf.open(sheet_path) as f:
+        for _, elem in iterparse(f):
+            if elem.tag != f"{_MAIN_NS}row":
+                continue
+            if elem.get("r", "1") != "1":
+                return {}  # row 1 is blank
+            cells = {}
+            for pos, cell in enumerate(elem.iter(f"{_MAIN_NS}c")):
+                kind = cell.get("t", "n")
+                inline = cell.find(f"{_MAIN_NS}is")
+                value = cell.find(f"{_MAIN_NS}v")
+                if inline is not None:
+                    raw = _text(inline)
+                elif value is not None and value.text is not None:
+                    raw = value.text
+                else:
+                    continue
+                cells[_column_number(cell.get("r")) if cell.get("r") else pos] = (kind, raw)
+            return cells
+    return {}
+
+def _shared_strings(zf, wanted):
+    """Return the shared strings at the indexes in ``wanted``, reading no further than the last one."""
+    found = {}
+    if not wanted or "xl/sharedStrings.xml" not in zf.namelist():
+        return found
+    last = max(wanted)
+    with zf.open("xl/sharedStrings.xml") as f:
+        i = 0
+        for _, elem in iterparse(f):
+            if elem.tag != f"{_MAIN_NS}si":
+                continue
+            if i in wanted:
+                found[i] = _text(elem)
+            if i >= last:
+                break
+            i += 1
+            elem.clear()
+    return found
+
+def _header_value(kind, raw, strings):
+    if kind == "s":
+        return strings[int(raw)]
+    if kind in ("inlineStr", "str", "e"):
+        return raw
+    if kind == "b":
+        return str(raw == "1")
+    number = float(raw)
+    return str(int(number)) if number.is_integer() else str(number)
+
+def _dedupe(names):
+    """Rename repeated names the way pandas' Excel reader does: a, a.1, a.2 ..., skipping names already taken."""
+    out = list(names)
+    counts = {}
+    for i, name in enumerate(names):
+        col = name
+        count = counts.get(name, 0)
+        while count > 0:
+            counts[name] = count + 1
+            col = f"{name}.{count}"
+            count = count + 1 if col in out else counts.get(col, 0)
+        out[i] = col
+        counts[col] = count + 1
+    return out
+
+def _xlsx_header(path):
+    """Column names of the first sheet, read from row 1 without loading the workbook; [] if row 1 is blank,
+    as pandas' read_excel(nrows=0) gives."""
+    with zipfile.ZipFile(path) as zf:
+        cells = _first_row_cells(zf, _first_sheet_path(zf))
+        strings = _shared_strings(zf, {int(raw) for kind, raw in cells.values() if kind == "s"})
+    if not cells:
+        return []
+    names = [f"Unnamed: {i}" for i in range(max(cells) + 1)]
+    for i, (kind, raw) in cells.items():
+        names[i] = _header_value(kind, raw, strings)
+    return _dedupe(names)
+
+def _csv_header(path):
+    """Column names of a CSV's first row, or None where pandas would read them differently
+    (blank, repeated or undecodable names)."""
+    try:
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            names = next(csv.reader(f), [])
+    except (UnicodeDecodeError, csv.Error):
+        return None
+    if not names or "" in names or len(set(names)) < len(names):
+        return None
+    return names
+
+def probe_schema(path):
+    """Return ``(columns, date column)`` for an xlsx or csv input, reading only its header row.
+
+    Headers are read without pandas where possible: xlsx headers are streamed
+    from the first sheet's XML and csv headers parsed with the csv module, so
+    probing neither waits for pandas to import nor loads the workbook. Results
+    are cached per file path, size and modification time.
+    """
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    if key not in _schemas:
+        if is_csv(path):
+            columns = _csv_header(path)
+            if columns is None:
+                import pandas as pd
+                columns = [str(c) for c in pd.read_csv(path, nrows=0).columns]
+        else:
+            try:
+                columns = _xlsx_header(path)
+            except Exception:
+                import pandas as pd
+                columns = [str(c) for c in pd.read_excel(path, nrows=0).columns]
+        _schemas[key] = (columns, choose_date_column(columns))
+    columns, date_col = _schemas[key]
+    return list(columns), date_col
+
+def read_header(path):
+    """Return the column names of an xlsx or csv input without reading its rows."""
+    return probe_schema(path)[0]
+
+def _pin_chunk(chunk, id_cols, date_col, amount_cols):
+    import pandas as pd
+    for col in id_cols:
+        chunk[col] = chunk[col].astype("category")
+    if date_col:
+        chunk[date_col] = pd.to_datetime(chunk[date_col], errors="coerce")
+    for col in amount_cols:
+        chunk[col] = pd.to_numeric(chunk[col], errors="coerce")
+    return chunk
+
+def _report_columns(header):
+    date_col = choose_date_column(header)
+    id_cols = [c for c in ID_COLUMNS if c in header]
+    amount_cols = [c for c in AMOUNT_COLUMNS if c in header]
+    usecols = [c for c in header if c in id_cols or c in amount_cols or c == date_col]
+    return usecols, id_cols, date_col, amount_cols
+
+def _iter_csv_chunks(path, chunksize):
+    import pandas as pd
+    usecols, id_cols, date_col, amount_cols = _report_columns(read_header(path))
+    dtype = {c: object for c in id_cols}
+    if date_col:
+        dtype[date_col] = object
+    for chunk in pd.read_csv(path, usecols=usecols, dtype=dtype, chunksize=chunksize):
+        yield _pin_chunk(chunk, id_cols, date_col, amount_cols)
+
+def _iter_xlsx_chunks(path, chunksize):
+    import pandas as pd
+    from openpyxl import load_workbook
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = [str(c) for c in next(rows, ())]
+        usecols, id_cols, date_col, amount_cols = _report_columns(header)
+        keep = [header.index(c) for c in usecols]
+        batch = []
+        for row in rows:
+            batch.append([row[i] if i < len(row) else None for i in keep])
+            if len(batch) == chunksize:
+                yield _pin_chunk(pd.DataFrame(batch, columns=usecols), id_cols, date_col, amount_cols)
+                batch = []
+        if batch:
+            yield _pin_chunk(pd.DataFrame(batch, columns=usecols), id_cols, date_col, amount_cols)
+    finally:
+        wb.close()
+
+def iter_input_chunks(path, chunksize=CSV_CHUNK_SIZE):
+    """Yield an xlsx or csv input as DataFrames of up to ``chunksize`` rows, keeping only the report columns.
+
+    Chunks are typed like read_csv_input's result; each carries its own categories.
+    """
+    if is_csv(path):
+        return _iter_csv_chunks(path, chunksize)
+    return _iter_xlsx_chunks(path, chunksize)
+
+def read_csv_input(path, chunksize=CSV_CHUNK_SIZE):
+    """Read a CSV extract in chunks, keeping only the report columns.
+
+    IDs are read as text (so card numbers keep leading zeros) and stored as
+    categoricals, the date column is parsed to datetime64 and amounts to float.
+    """
+    import pandas as pd
+    usecols, id_cols, _, _ = _report_columns(read_header(path))
+    chunks = list(_iter_csv_chunks(path, chunksize))
+    if not chunks:
+        return pd.DataFrame(columns=usecols)
+
+    # Chunks carry their own categories; union them instead of falling back to object
+    df = pd.concat([chunk.drop(columns=id_cols) for chunk in chunks], ignore_index=True)
+    for col in id_cols:
+        df[col] = pd.Series(pd.api.types.union_categoricals([chunk[col] for chunk in chunks]), index=df.index)
+    return df[usecols]
+
+def parse_input(path):
+    """Parse an xlsx or csv input into a DataFrame."""
+    if is_csv(path):
+        return read_csv_input(path)
+    import pandas as pd
+    return pd.read_excel(path)
@@ -0,0 +1,117 @@
+import json
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+RUN_LOG_NAME = "run_log.jsonl"
+
+def _windows_peak_rss_mb():
+    import ctypes
+    from ctypes import wintypes
+
+    class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                    ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                    ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                    ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+    counters = PROCESS_MEMORY_COUNTERS()
+    counters.cb = ctypes.sizeof(counters)
+    handle = ctypes.windll.kernel32.GetCurrentProcess()
+    if not ctypes.windll.psapi.GetProcessMemoryInfo(handle, ctypes.byref(counters), counters.cb):
+        return None
+    return counters.PeakWorkingSetSize / 1024 ** 2
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB, or None where it cannot be read."""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and KB on Linux
+        return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+    if sys.platform == "win32":
+        try:
+            return _windows_peak_rss_mb()
+        except Exception:
+            return None
+    return None
+
+class RunRecorder:
+    """Progress callback that measures each report stage before forwarding to ``progress``.
+
+    Every stage gets its wall time, CPU time, the growth of the process's peak
+    RSS while it ran and, if noted with ``rows()``, the number of rows it produced.
+    """
+
+    def __init__(self, progress=None):
+        self.progress = progress
+        self.stages = []
+        self._current = None
+        self._run_start = (time.perf_counter(), time.process_time(), peak_rss_mb())
+
+    def __call__(self, name, index, total):
+        self.finish()
+        self._current = {"stage": name, "rows": None,
+                         "_start": (time.perf_counter(), time.process_time(), peak_rss_mb())}
+        if self.progress is not None:
+            self.progress(name, index, total)
+
+    def rows(self, n):
+        if self._current is not None:
+            self._current["rows"] = int(n)
+
+    def finish(self):
+        if self._current is None:
+            return
+        wall, cpu, rss = self._current.pop("_start")
+        self._current.update(_elapsed(wall, cpu, rss))
+        self.stages.append(self._current)
+        self._current = None
+
+    def record(self, **fields):
+        """Close the last stage and return the run as a JSON-serializable dict."""
+        self.finish()
+        record = {"timestamp": time.strftime("%Y-%m-%d %H:%M:%S")}
+        record.update(fields)
+        record.update(_elapsed(*self._run_start))
+        record["peak_rss_mb"] = _round(peak_rss_mb())
+        record["stages"] = self.stages
+        return record
+
+def _round(value, digits=3):
+    return None if value is None else round(value, digits)
+
+def _elapsed(wall, cpu, rss):
+    peak = peak_rss_mb()
+    return {
+        "wall_s": _round(time.perf_counter() - wall),
+        "cpu_s": _round(time.process_time() - cpu),
+        "peak_rss_delta_mb": _round(peak - rss, 1) if peak is not None and rss is not None else None,
+    }
+
+def note_rows(progress, n):
+    """Attach a row count to the current stage when ``progress`` is a RunRecorder."""
+    if isinstance(progress, RunRecorder):
+        progress.rows(n)
+
+def write_run_record(log_folder, record):
+    """Append ``record`` as one JSON line to the run log in ``log_folder``; returns the log path."""
+    path = os.path.join(log_folder, RUN_LOG_NAME)
+    with open(path, "a", encoding="utf-8") as log:
+        log.write(json.dumps(record, default=str) + "\n")
+    return path
+
+def format_stages(record):
+    """Render a run record's stages as fixed-width text lines."""
+    lines = [f"{'Stage':<16}{'Wall (s)':>10}{'CPU (s)':>10}{'Peak RSS +MB':>14}{'Rows':>12}"]
+    for stage in record["stages"]:
+        rss = "-" if stage["peak_rss_delta_mb"] is None else f"{stage['peak_rss_delta_mb']:.0f}"
+        rows = "-" if stage["rows"] is None else f"{stage['rows']:,}"
+        lines.append(f"{stage['stage']:<16}{stage['wall_s']:>10.2f}{stage['cpu_s']:>10.2f}{rss:>14}{rows:>12}")
+    lines.append(f"{'total':<16}{record['wall_s']:>10.2f}{record['cpu_s']:>10.2f}")
+    return lines
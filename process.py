@@ -1,71 +1,218 @@
+import io
 import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
 from datetime import datetime
 import secrets
 import string
-from openpyxl import load_workbook
-from openpyxl.styles import PatternFill
+
+from cache import cache_key, load_aggregates, read_input
+from ingest import ID_COLUMNS, choose_date_column
+from instrument import RunRecorder, note_rows, write_run_record
+from writer import (COLUMNAR_FORMATS, DEFAULT_CHUNK_SIZE, EXCEL_MAX_ROWS, ReportCancelled, append_frame,
+                    apply_fill_rules, check_cancelled, discard_workbook, fill_rule, new_streaming_workbook, read_columnar,
+                    side_by_side, write_columnar, write_frame, write_raw_data)
 
 def generate_password(length=14):
     alphabet = string.ascii_letters + string.digits
     return ''.join(secrets.choice(alphabet) for _ in range(length))
 
-def _choose_date_col(df):
-    if "transaction_datetime" in df.columns:
-        return "transaction_datetime"
-    if "TransactionDateTime" in df.columns:
-        return "TransactionDateTime"
-    for col in df.columns:
-        if col.lower().startswith("transaction") and "time" in col.lower():
-            return col
-    return None
-
-def _build_intervals(entity_data, date_col):
-    """Return multi-line string of intervals per day."""
-    result_lines = []
-    entity_data = entity_data.sort_values(date_col)
-
-    for day, day_df in entity_data.groupby(entity_data[date_col].dt.date):
-        times = day_df[date_col].dropna().sort_values().tolist()
-        if len(times) <= 1:
+def as_str_category(values):
+    """Return ``values`` as a categorical whose categories are the values' string form,
+    i.e. ``values.astype(str)`` without materializing one Python string per row."""
+    if isinstance(values.dtype, pd.CategoricalDtype) and pd.api.types.is_string_dtype(values.cat.categories):
+        return values
+    codes, uniques = pd.factorize(values)
+    categories = pd.Index(uniques).astype(str)
+    if not categories.is_unique:  # e.g. 1 and "1" both present
+        return values.astype(str).astype("category")
+    return pd.Series(pd.Categorical.from_codes(codes, categories=categories), index=values.index, name=values.name)
+
+def compact_ids(df):
+    """Store the ID columns as integer-coded categoricals, in place.
+
+    card_no becomes a categorical of strings (the form every report uses); the
+    other IDs keep their original values as categories so output is unchanged.
+    """
+    for col in ID_COLUMNS:
+        if col not in df.columns:
             continue
+        if col == "card_no":
+            df[col] = as_str_category(df[col])
+        elif not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype("category")
+    return df
 
-        intervals = []
-        for i in range(1, len(times)):
-            diff = (times[i] - times[i - 1]).total_seconds() / 60
-            intervals.append(str(int(diff)))
-
-        first_time = times[0].strftime("%Y-%m-%d %H:%M")
-        line = f"{first_time}: " + " > ".join(intervals)
-        result_lines.append(line)
-
-    return "\n".join(result_lines) if result_lines else "N/A"
-
-def _build_interval_column(df, date_col, entity_col):
-    """Return a list of intervals per row for the RawData sheet."""
-    intervals = []
-    df_sorted = df.sort_values([entity_col, date_col])
-    last_times = {}
-
-    for idx, row in df_sorted.iterrows():
-        entity = row[entity_col]
-        current_time = row[date_col]
-        if pd.isna(current_time):
-            intervals.append(None)
-            continue
-
-        if entity in last_times:
-            diff = (current_time - last_times[entity]).total_seconds() / 60
-            intervals.append(diff)
-        else:
-            intervals.append(None)
-
-        last_times[entity] = current_time
-
-    return intervals
-
-def summarize_entities(df, entity_col, date_col=None, top_n=20, include_intervals=True):
-    summaries = []
+def _choose_date_col(df):
+    return choose_date_column(df.columns)
+
+def entity_timeline(df, date_col, entity_col):
+    """Return the timestamped rows sorted by entity and time, with the gap in
+    minutes to the entity's previous transaction.
+
+    The frame is indexed by row position in ``df`` so results can be written
+    back in the original row order.
+    """
+    times = pd.to_datetime(df[date_col], errors="coerce")
+    codes = pd.factorize(df[entity_col])[0]
+    ns = times.to_numpy(dtype="datetime64[ns]").view("int64")
+
+    valid = np.flatnonzero(times.notna().to_numpy())
+    order = valid[np.lexsort((ns[valid], codes[valid]))]
+    sorted_codes = codes[order]
+    sorted_ns = ns[order]
+
+    gaps = np.full(len(order), np.nan)
+    if len(order) > 1:
+        same_entity = sorted_codes[1:] == sorted_codes[:-1]
+        diffs = (sorted_ns[1:] - sorted_ns[:-1]) / 1e9 / 60
+        gaps[1:] = np.where(same_entity, diffs, np.nan)
+
+    return pd.DataFrame(
+        {
+            "entity": df[entity_col].to_numpy()[order],
+            "time": times.to_numpy()[order],
+            "day": sorted_ns // 86_400_000_000_000,
+            "gap": gaps,
+        },
+        index=pd.Index(order, name="position"),
+    )
+
+def build_intervals(timeline, entities):
+    """Return a multi-line string of intervals per day for each entity."""
+    sub = timeline[timeline["entity"].isin(entities)]
+    if sub.empty:
+        return {}
+
+    # The first transaction of each entity-day starts a line; the rest carry its gaps.
+    day_start = sub["gap"].isna().to_numpy() | (sub["day"].diff().to_numpy() != 0)
+    heads = sub[day_start]
+    tails = sub[~day_start]
+    if tails.empty:
+        return {}
+
+    joined = (
+        tails["gap"].astype("int64").astype(str)
+        .groupby([tails["entity"], tails["day"]], sort=False)
+        .agg(" > ".join)
+    )
+    first_times = heads.set_index(["entity", "day"])["time"]
+    first_times = first_times.reindex(joined.index)
+    lines = first_times.dt.strftime("%Y-%m-%d %H:%M") + ": " + joined
+    return lines.groupby(level=0, sort=False).agg("\n".join).to_dict()
+
+def build_interval_column(df, date_col, entity_col, timeline=None):
+    """Return the interval in minutes per row for the RawData sheet, in ``df`` row order."""
+    if timeline is None:
+        timeline = entity_timeline(df, date_col, entity_col)
+    intervals = np.full(len(df), np.nan)
+    intervals[timeline.index.to_numpy()] = timeline["gap"].to_numpy()
+    return pd.Series(intervals, index=df.index)
+
+def entity_label(entity_col):
+    return "Card Number" if entity_col == "card_no" else ("Cashier" if entity_col == "cashier" else entity_col)
+
+def group_sums(values, codes, n_groups):
+    """Sum ``values`` per group code the same way ``Series.sum`` does, so totals match it bit-for-bit."""
+    order = np.argsort(codes, kind="stable")
+    bounds = np.searchsorted(codes[order], np.arange(n_groups + 1))
+    if pd.api.types.is_numeric_dtype(values.dtype) and not pd.api.types.is_bool_dtype(values.dtype):
+        arr = values.to_numpy(dtype="float64", na_value=0.0)[order]
+        return [float(arr[bounds[i]:bounds[i + 1]].sum()) for i in range(n_groups)]
+    ordered = values.iloc[order]
+    return [float(ordered.iloc[bounds[i]:bounds[i + 1]].sum()) for i in range(n_groups)]
+
+def _aggregate_entities(df, entity_col, date_col, entities=None):
+    """Return one summary row per entity, computed in a single grouped pass.
+
+    Rows follow the order in which the entities first appear in ``df`` and the
+    columns use the sheet names from ``summarize_entities`` (without intervals).
+    Pass ``entities`` to restrict the pass to those keys.
+    """
+    keys = df[entity_col]
+    rows = df[keys.isin(entities)] if entities is not None else df[keys.notna()]
+    codes, uniques = pd.factorize(rows[entity_col])
+    n_groups = len(uniques)
+    times = pd.to_datetime(rows[date_col], errors="coerce")
+
+    out = pd.DataFrame({entity_label(entity_col): [str(e) for e in uniques]})
+    first_rows = ~pd.Series(codes).duplicated().to_numpy()
+    out["Month"] = [str(p) for p in times[first_rows].dt.to_period("M")]
+    out["Total Transactions"] = np.bincount(codes, minlength=n_groups)
+    out["First Transaction"] = times.groupby(codes).min().reindex(range(n_groups)).to_numpy()
+    out["Last Transaction"] = times.groupby(codes).max().reindex(range(n_groups)).to_numpy()
+
+    # Busiest/quietest day: ties go to the day seen first, as with value_counts().idxmax()
+    days = pd.DataFrame({"code": codes, "day": times.dt.normalize().to_numpy(), "pos": np.arange(len(rows))})
+    day_counts = (
+        days.dropna(subset=["day"])
+        .groupby(["code", "day"], sort=False)
+        .agg(n=("pos", "size"), first_pos=("pos", "min"))
+        .reset_index()
+    )
+    day_counts["label"] = day_counts["day"].dt.strftime("%Y-%m-%d") + " (" + day_counts["n"].astype(str) + ")"
+    peak = day_counts.sort_values(["code", "n", "first_pos"], ascending=[True, False, True]).drop_duplicates("code")
+    low = day_counts.sort_values(["code", "n", "first_pos"]).drop_duplicates("code")
+    out["Day with Most Transactions"] = peak.set_index("code")["label"].reindex(range(n_groups)).fillna("N/A").to_numpy()
+    out["Day with Fewest Transactions"] = low.set_index("code")["label"].reindex(range(n_groups)).fillna("N/A").to_numpy()
+
+    def add_distinct(col, count_name, list_name):
+        values = rows[col]
+        out[count_name] = values.groupby(codes).nunique().reindex(range(n_groups), fill_value=0).to_numpy()
+        present = values.notna().to_numpy()
+        pairs = pd.DataFrame({"code": codes[present], "value": values[present].to_numpy()}).drop_duplicates()
+        pairs["value"] = pairs["value"].astype(str).to_numpy(dtype=object)  # only distinct pairs become strings
+        pairs = pairs.drop_duplicates().sort_values("code", kind="stable")
+        bounds = np.searchsorted(pairs["code"].to_numpy(), np.arange(n_groups + 1))
+        strings = pairs["value"].to_numpy(dtype=object)
+        out[list_name] = [", ".join(strings[bounds[i]:bounds[i + 1]]) for i in range(n_groups)]
+
+    if "branch_code" in rows.columns:
+        add_distinct("branch_code", "Distinct Branches", "Branch List")
+    elif "branch_name" in rows.columns:
+        add_distinct("branch_name", "Distinct Branches", "Branch List")
+    if "cashier" in rows.columns and entity_col != "cashier":
+        add_distinct("cashier", "Distinct Cashiers", "Cashier List")
+    if "register_no" in rows.columns:
+        add_distinct("register_no", "Distinct Registers", "Register List")
+    if entity_col == "cashier" and "card_no" in rows.columns:
+        add_distinct("card_no", "Distinct Cards", "Cards List")
+
+    if "trans_total" in rows.columns:
+        out["Sum of Transaction Total"] = group_sums(rows["trans_total"], codes, n_groups)
+    elif "transaction_amount" in rows.columns:
+        out["Sum of Transaction Total"] = group_sums(rows["transaction_amount"], codes, n_groups)
+    if "point_earned" in rows.columns:
+        out["Total Points"] = group_sums(rows["point_earned"], codes, n_groups)
+
+    out.index = uniques
+    return out
+
+def _ranked_entities(keys):
+    """Return every distinct key, most frequent first, ties going to the key seen first.
+
+    Same ranking as ``value_counts()`` on object columns, but also for
+    categoricals, whose value_counts breaks ties by category order and lists
+    unused categories.
+    """
+    codes, uniques = pd.factorize(keys)
+    counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+    return uniques[np.argsort(-counts, kind="stable")]
+
+def _top_entities(keys, top_n):
+    """Return the ``top_n`` most frequent keys, ranked as by _ranked_entities."""
+    return _ranked_entities(keys)[:top_n]
+
+def summarize_entities(df, entity_col, date_col=None, top_n=20, include_intervals=True, timeline=None,
+                       aggregates=None):
+    """Return the summary row of each of the ``top_n`` most active entities, busiest first.
+
+    ``aggregates`` is a dict kept for this ``df`` (see cache.load_aggregates):
+    the ranking and the rows summarized so far are stored in it, so a later call
+    with a different ``top_n`` or ``include_intervals`` only computes the rows it
+    has not seen yet.
+    """
     if entity_col not in df.columns:
         return pd.DataFrame()
 
@@ -74,71 +221,137 @@ def summarize_entities(df, entity_col, date_col=None, top_n=20, include_interval
     if date_col is None or date_col not in df.columns:
         return pd.DataFrame()
 
-    df_loc = df.copy()
-    df_loc[date_col] = pd.to_datetime(df_loc[date_col], errors="coerce")
-    df_loc["YearMonth"] = df_loc[date_col].dt.to_period("M")
-
-    top_entities = df_loc[entity_col].value_counts().head(top_n).index
-    for entity in top_entities:
-        entity_data = df_loc[df_loc[entity_col] == entity]
-
-        day_counts = entity_data[date_col].dt.date.value_counts()
-        peak_day = day_counts.idxmax() if not day_counts.empty else None
-        peak_count = int(day_counts.max()) if not day_counts.empty else 0
-        low_day = day_counts.idxmin() if not day_counts.empty else None
-        low_count = int(day_counts.min()) if not day_counts.empty else 0
-
-        entity_label = "Card Number" if entity_col == "card_no" else ("Cashier" if entity_col == "cashier" else entity_col)
-
-        summary = {
-            entity_label: str(entity),
-            "Month": str(entity_data["YearMonth"].iloc[0]),
-            "Total Transactions": len(entity_data),
-            "First Transaction": entity_data[date_col].min(),
-            "Last Transaction": entity_data[date_col].max(),
-            "Day with Most Transactions": f"{peak_day} ({peak_count})" if peak_day else "N/A",
-            "Day with Fewest Transactions": f"{low_day} ({low_count})" if low_day else "N/A",
-        }
-
-        if include_intervals:
-            summary["Transaction Intervals"] = _build_intervals(entity_data, date_col)
-
-        if "branch_code" in entity_data.columns:
-            summary["Distinct Branches"] = int(entity_data["branch_code"].nunique())
-            summary["Branch List"] = ", ".join(entity_data["branch_code"].dropna().astype(str).unique())
-        elif "branch_name" in entity_data.columns:
-            summary["Distinct Branches"] = int(entity_data["branch_name"].nunique())
-            summary["Branch List"] = ", ".join(entity_data["branch_name"].dropna().astype(str).unique())
-
-        if "cashier" in entity_data.columns and entity_col != "cashier":
-            summary["Distinct Cashiers"] = int(entity_data["cashier"].nunique())
-            summary["Cashier List"] = ", ".join(entity_data["cashier"].dropna().astype(str).unique())
-
-        if "register_no" in entity_data.columns:
-            summary["Distinct Registers"] = int(entity_data["register_no"].nunique())
-            summary["Register List"] = ", ".join(entity_data["register_no"].dropna().astype(str).unique())
-
-        if entity_col == "cashier" and "card_no" in entity_data.columns:
-            summary["Distinct Cards"] = int(entity_data["card_no"].nunique())
-            summary["Cards List"] = ", ".join(entity_data["card_no"].dropna().astype(str).unique())
-
-        if "trans_total" in entity_data.columns:
-            summary["Sum of Transaction Total"] = float(entity_data["trans_total"].sum())
-        elif "transaction_amount" in entity_data.columns:
-            summary["Sum of Transaction Total"] = float(entity_data["transaction_amount"].sum())
-
-        if "point_earned" in entity_data.columns:
-            summary["Total Points"] = float(entity_data["point_earned"].sum())
-
-        summaries.append(summary)
-
-    if summaries:
-        df_sum = pd.DataFrame(summaries)
-        df_sum = df_sum.sort_values("Total Transactions", ascending=False).reset_index(drop=True)
-        return df_sum
-    else:
+    if aggregates is None:
+        aggregates = {}
+    if entity_col not in aggregates:
+        aggregates[entity_col] = {"ranked": _ranked_entities(df[entity_col]), "rows": None,
+                                  "intervals": {}, "interval_rows": 0}
+    agg = aggregates[entity_col]
+    top_entities = agg["ranked"][:top_n]
+    n = len(top_entities)
+    if n == 0:
         return pd.DataFrame()
 
+    # Rows are kept in rank order, so any top_n is a prefix of what is stored
+    have = 0 if agg["rows"] is None else len(agg["rows"])
+    if n > have:
+        missing = agg["ranked"][have:n]
+        rows = _aggregate_entities(df, entity_col, date_col, entities=missing).loc[missing]
+        agg["rows"] = rows if agg["rows"] is None else pd.concat([agg["rows"], rows])
+    interval_strings = None
+    if include_intervals:
+        if agg["interval_rows"] < n:
+            if timeline is None:
+                timeline = entity_timeline(df, date_col, entity_col)
+            agg["intervals"].update(build_intervals(timeline, agg["ranked"][agg["interval_rows"]:n]))
+            agg["interval_rows"] = n
+        interval_strings = agg["intervals"]
+    return finish_summary(agg["rows"].iloc[:n].copy(), top_entities, interval_strings)
+
+def finish_summary(df_sum, top_entities, interval_strings=None):
+    """Add the Transaction Intervals column (when computed) to ranked summary rows and order them by count."""
+    if interval_strings is not None:
+        df_sum.insert(7, "Transaction Intervals", [interval_strings.get(e, "N/A") for e in top_entities])
+    return df_sum.sort_values("Total Transactions", ascending=False).reset_index(drop=True)
+
+# Velocity rules: VELOCITY_COUNT transactions within VELOCITY_WINDOW_MINUTES by one card or cashier,
+# or one card at two branches within BRANCH_HOP_MINUTES
+VELOCITY_COUNT = 5
+VELOCITY_WINDOW_MINUTES = 10
+BRANCH_HOP_MINUTES = 30
+VELOCITY_COLUMNS = ["Rule", "Entity Type", "Entity", "Transactions", "First Transaction", "Last Transaction",
+                    "Span (min)", "Branches"]
+
+def _sorted_timeline(df, date_col, entity_col):
+    """Entity codes, timestamps (ns) and row positions of the dated rows with an entity, sorted by entity then time."""
+    times = pd.to_datetime(df[date_col], errors="coerce")
+    codes, uniques = pd.factorize(df[entity_col])
+    ns = times.to_numpy(dtype="datetime64[ns]").view("int64")
+    valid = np.flatnonzero(times.notna().to_numpy() & (codes >= 0))
+    order = valid[np.lexsort((ns[valid], codes[valid]))]
+    return codes[order], ns[order], order, uniques
+
+def _merge_windows(starts, ends):
+    """Merge overlapping [start, end] position windows (ascending starts) into maximal ones.
+
+    Windows only overlap within one entity, since the positions are sorted by entity.
+    """
+    if len(starts) == 0:
+        return starts, ends
+    new = np.ones(len(starts), dtype=bool)
+    new[1:] = starts[1:] > ends[:-1]
+    last = np.append(np.flatnonzero(new)[1:] - 1, len(starts) - 1)
+    return starts[new], ends[last]
+
+def _burst_windows(codes, ns, count, window_ns):
+    """Maximal runs in which every ``count`` consecutive transactions of one entity fall within ``window_ns``."""
+    k = count - 1
+    if len(ns) <= k:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+    starts = np.flatnonzero((codes[k:] == codes[:-k]) & (ns[k:] - ns[:-k] <= window_ns))
+    return _merge_windows(starts, starts + k)
+
+def _branch_hops(codes, ns, branches, hop_ns):
+    """Maximal runs of one card's consecutive transactions at different branches, each within ``hop_ns``.
+
+    Checking neighbours is enough: two transactions at different branches
+    within ``hop_ns`` always have such a neighbouring pair between them.
+    """
+    hops = np.flatnonzero((codes[1:] == codes[:-1]) & (ns[1:] - ns[:-1] <= hop_ns)
+                          & (branches[1:] != branches[:-1]) & (branches[1:] >= 0) & (branches[:-1] >= 0))
+    return _merge_windows(hops, hops + 1)
+
+def _window_rows(rule, entity_col, uniques, codes, ns, starts, ends, branch_names=None):
+    rows = pd.DataFrame({
+        "Rule": rule,
+        "Entity Type": entity_label(entity_col),
+        "Entity": pd.Index(uniques).astype(str).to_numpy(dtype=object)[codes[starts]],
+        "Transactions": ends - starts + 1,
+        "First Transaction": pd.to_datetime(ns[starts]),
+        "Last Transaction": pd.to_datetime(ns[ends]),
+        "Span (min)": ((ns[ends] - ns[starts]) / 1e9 / 60).round(1),
+        "Branches": "",
+    })
+    if branch_names is not None:
+        # Branch sequence of each window, e.g. "B01 > B07 > B01"
+        names = branch_names.tolist()
+        rows["Branches"] = [" > ".join(names[s:e + 1]) for s, e in zip(starts.tolist(), ends.tolist())]
+    return rows
+
+def detect_velocity(df, date_col, count=VELOCITY_COUNT, window_minutes=VELOCITY_WINDOW_MINUTES,
+                    branch_minutes=BRANCH_HOP_MINUTES):
+    """Return the VelocityAlerts table for every card and cashier in ``df``.
+
+    Flags each maximal run of transactions by one card or cashier in which every
+    ``count`` consecutive ones fall within ``window_minutes``, and each run of a
+    card's consecutive transactions at different branches at most
+    ``branch_minutes`` apart (both limits inclusive). Worst (most transactions) first within each rule;
+    capped at what fits on one sheet.
+    """
+    if count < 2:
+        raise ValueError("count must be at least 2")
+    branch_col = "branch_code" if "branch_code" in df.columns else ("branch_name" if "branch_name" in df.columns else None)
+    parts = []
+    for entity_col in ("card_no", "cashier"):
+        if entity_col not in df.columns:
+            continue
+        codes, ns, order, uniques = _sorted_timeline(df, date_col, entity_col)
+        starts, ends = _burst_windows(codes, ns, count, window_minutes * 60 * 10 ** 9)
+        parts.append(_window_rows(f"{count}+ in {window_minutes} min", entity_col, uniques, codes, ns, starts, ends))
+
+        if entity_col == "card_no" and branch_col:
+            branch_codes, branch_uniques = pd.factorize(df[branch_col])
+            branches = branch_codes[order]
+            starts, ends = _branch_hops(codes, ns, branches, branch_minutes * 60 * 10 ** 9)
+            branch_names = np.append(pd.Index(branch_uniques).astype(str).to_numpy(dtype=object), "")[branches]
+            parts.append(_window_rows(f"Branch change within {branch_minutes} min", entity_col, uniques, codes, ns,
+                                      starts, ends, branch_names))
+    if not parts:
+        return pd.DataFrame(columns=VELOCITY_COLUMNS)
+    parts = [p.sort_values(["Transactions", "First Transaction"], ascending=[False, True], kind="stable") for p in parts]
+    alerts = pd.concat(parts, ignore_index=True)
+    return alerts.head(EXCEL_MAX_ROWS - 1)
+
 def encrypt_excel(input_path, desired_output_path, password):
     try:
         import pythoncom
@@ -177,194 +390,406 @@ def encrypt_excel(input_path, desired_output_path, password):
     except Exception as e_aes:
         raise RuntimeError(f"Encryption failed with all methods: {e_aes}")
 
-def process_dynamic_schema(df, output_file, top_n_cards=20, top_n_cashiers=20, separate_cards=False, include_intervals=True):
-    if "card_no" in df.columns:
-        df["card_no"] = df["card_no"].astype(str)
+REPORT_STAGES = ["read", "intervals", "card summary", "cashier summary", "velocity", "collusion", "write", "excel",
+                 "encrypt"]
+
+def report_stage(name, progress=None, cancel_event=None, stages=REPORT_STAGES):
+    """Mark the start of a report stage: stop if cancelled, otherwise report progress."""
+    check_cancelled(cancel_event, f"before {name}")
+    if progress is not None:
+        progress(name, stages.index(name), len(stages))
+
+def remove_quietly(*paths):
+    for path in paths:
+        try:
+            if path and os.path.exists(path):
+                os.remove(path)
+        except OSError:
+            pass
+
+def _split_card_summary(card_summary):
+    left = card_summary[card_summary["Card Number"].str.startswith("8880")].reset_index(drop=True)
+    right = card_summary[card_summary["Card Number"].str.startswith("8881")].reset_index(drop=True)
+    return left, right
+
+def txn_column(columns):
+    """The transaction amount column among ``columns``, or None."""
+    return "trans_total" if "trans_total" in columns else (
+        "transaction_amount" if "transaction_amount" in columns else None
+    )
+
+def expand_cashier_summary(df, date_col, cashier_summary, aggregates=None):
+    """Return the TopCashiers table: each cashier's summary row followed by one row per card handled.
+
+    Card rows keep only the per-(cashier, card) stats; the table is assembled with
+    merges over the pair aggregate rather than per-card row copies. With
+    ``aggregates`` (as for summarize_entities) the card rows of each cashier are
+    computed once and reused.
+    """
+    if "Cards List" not in cashier_summary.columns or "card_no" not in df.columns:
+        return cashier_summary.copy()
+
+    leaders = cashier_summary.reset_index(drop=True)
+    has_cards = leaders["Cards List"].fillna("").astype(bool).to_numpy()
+    leader_keys = pd.DataFrame({
+        "leader": np.arange(len(leaders))[has_cards],
+        "cashier": leaders["Cashier"].astype(str).to_numpy(dtype=object)[has_cards],  # name from summarize_entities
+    })
+    names = pd.unique(leader_keys["cashier"])
+    if aggregates is None:
+        cards = _cashier_cards(df, date_col, names)
+    else:
+        cached = aggregates.get("cashier_cards")
+        missing = names if cached is None else names[~np.isin(names, cached["names"])]
+        if cached is None or len(missing):
+            more = _cashier_cards(df, date_col, missing)
+            cached = {"names": missing, "cards": more} if cached is None else {
+                "names": np.concatenate([cached["names"], missing]),
+                "cards": pd.concat([cached["cards"], more], ignore_index=True)}
+            aggregates["cashier_cards"] = cached
+        cards = cached["cards"]
+    cards = leader_keys.merge(cards, on="cashier", how="inner", sort=False)
+    return assemble_cashier_table(leaders, cards, has_sums=txn_column(df.columns) is not None)
+
+def _cashier_cards(df, date_col, names):
+    """Return one row per (cashier, card) for the summary cashiers ``names``, each cashier's cards in first-seen order.
+
+    Rows carry the pair stats in the columns assemble_cashier_table reads.
+    """
+    txn_col = txn_column(df.columns)
+    cashier_keys = as_str_category(df["cashier"])
+
+    # Case/whitespace-insensitive match of each summary cashier to the first raw value seen in the data
+    raw_by_key = {}
+    for raw in np.asarray(pd.unique(cashier_keys.dropna()), dtype=object):
+        raw_by_key.setdefault(raw.strip().lower(), raw)
+
+    leader_keys = pd.DataFrame({
+        "cashier": np.asarray(names, dtype=object),
+        "raw_cashier": [raw_by_key.get(n.strip().lower(), n.strip()) for n in names],
+    })
+
+    # Stats per cashier-card pair, on string keys, for the rows of the cashiers involved only
+    rows = cashier_keys.isin(set(leader_keys["cashier"]) | set(leader_keys["raw_cashier"])).to_numpy()
+    pairs = pd.DataFrame({
+        "cashier": cashier_keys[rows],
+        "card_no": as_str_category(df["card_no"])[rows],
+        date_col: df[date_col][rows],
+    })
+    if txn_col:
+        pairs[txn_col] = df[txn_col][rows]
+
+    agg_dict = {
+        "Total_Transactions": ("card_no", "count"),
+        "First_Transaction": (date_col, "min"),
+        "Last_Transaction": (date_col, "max"),
+    }
+    if txn_col:
+        agg_dict["Sum_Transaction_Total"] = (txn_col, "sum")
+    card_stats = pairs.groupby(["cashier", "card_no"], observed=True).agg(**agg_dict).reset_index()
+    card_stats["cashier"] = card_stats["cashier"].astype(str).to_numpy(dtype=object)
+    card_stats["card_no"] = card_stats["card_no"].astype(str).to_numpy(dtype=object)
+
+    # Each cashier's cards in first-seen order, as in the summary's Cards List
+    seen = pairs[["cashier", "card_no"]].dropna().drop_duplicates()
+    seen = pd.DataFrame({
+        "cashier": seen["cashier"].astype(str).to_numpy(dtype=object),
+        "card": seen["card_no"].astype(str).to_numpy(dtype=object),
+    })
+
+    cards = leader_keys.merge(seen, on="cashier", how="inner", sort=False)
+    cards["card"] = cards["card"].str.strip()
+    cards = cards.merge(card_stats, left_on=["raw_cashier", "card"], right_on=["cashier", "card_no"],
+                        how="left", sort=False, suffixes=("", "_stats"))
+    return cards.drop(columns=["raw_cashier", "cashier_stats", "card_no"])
+
+def assemble_cashier_table(leaders, cards, has_sums):
+    """Interleave the cashier summary rows with their card rows.
+
+    ``cards`` holds one row per (leader position, card) with the pair stats in
+    Total_Transactions, First_Transaction, Last_Transaction and, with
+    ``has_sums``, Sum_Transaction_Total.
+    """
+    cols_to_keep = [
+        "Total Transactions",
+        "First Transaction",
+        "Last Transaction",
+        "Cards List",
+        "Sum of Transaction Total"
+    ]
+    cards = cards.sort_values("leader", kind="stable")
+
+    card_rows = pd.DataFrame({col: None for col in leaders.columns if col not in cols_to_keep}, index=cards.index)
+    card_rows["Cards List"] = cards["card"]
+    card_rows["Total Transactions"] = cards["Total_Transactions"].fillna(0).astype("int64")
+    card_rows["First Transaction"] = cards["First_Transaction"]
+    card_rows["Last Transaction"] = cards["Last_Transaction"]
+    if has_sums and "Sum of Transaction Total" in leaders.columns:
+        card_rows["Sum of Transaction Total"] = cards["Sum_Transaction_Total"].fillna(0)
+    card_rows = card_rows[[c for c in leaders.columns if c in card_rows.columns]]
+    card_rows["_leader"] = cards["leader"].to_numpy()
+
+    leader_rows = leaders.assign(_leader=np.arange(len(leaders)))
+    expanded = pd.concat([leader_rows, card_rows], ignore_index=True)
+    expanded = expanded.sort_values("_leader", kind="stable").drop(columns="_leader")
+    return expanded[list(leaders.columns)].reset_index(drop=True)
+
+def _cashier_leader_rows(expanded_df):
+    """Return the 0-based positions of the first row of each cashier group."""
+    leaders = []
+    last_cashier = None
+    for pos, current_cashier in enumerate(expanded_df["Cashier"]):
+        if current_cashier and not pd.isna(current_cashier) and current_cashier != last_cashier:
+            leaders.append(pos)
+            last_cashier = current_cashier
+    return leaders
+
+def _report_styles(card_summary, cashier_table, separate_cards):
+    """Return the fill rules for each summary sheet, applied while the sheet is written."""
+    styles = {}
+    if separate_cards and card_summary is not None and not card_summary.empty:
+        n_cols = card_summary.shape[1]
+        styles["TopCards"] = [
+            fill_rule("87CEFA", header=True, columns=range(1, n_cols + 1)),  # 8880 cards, blue
+            fill_rule("FFFF99", header=True, columns=range(n_cols + 2, 2 * n_cols + 2)),  # 8881 cards, yellow
+        ]
+    if cashier_table is not None and not cashier_table.empty:
+        # Highlight first row of each cashier group in gold
+        styles["TopCashiers"] = [fill_rule("FFD700", rows=_cashier_leader_rows(cashier_table))]
+    return styles
+
+def _write_streaming_report(df, output_file, card_summary, cashier_table, separate_cards, chunk_size=DEFAULT_CHUNK_SIZE,
+                            extra_sheets=None, cancel_event=None):
+    """Write the report with a write-only workbook so memory stays flat however large RawData is."""
+    styles = _report_styles(card_summary, cashier_table, separate_cards)
+    wb = new_streaming_workbook()
+    try:
+        if df is not None:
+            write_raw_data(wb, df, chunk_size=chunk_size, cancel_event=cancel_event)
+
+        if card_summary is not None and not card_summary.empty:
+            ws = wb.create_sheet("TopCards")
+            if separate_cards:
+                left, right = _split_card_summary(card_summary)
+                append_frame(ws, side_by_side(left, right), rules=styles.get("TopCards"), cancel_event=cancel_event)
+            else:
+                append_frame(ws, card_summary, cancel_event=cancel_event)
+
+        if cashier_table is not None and not cashier_table.empty:
+            ws = wb.create_sheet("TopCashiers")
+            append_frame(ws, cashier_table, rules=styles.get("TopCashiers"), cancel_event=cancel_event)
+
+        for name, frame in (extra_sheets or {}).items():
+            append_frame(wb.create_sheet(name), frame, cancel_event=cancel_event)
+    except ReportCancelled:
+        discard_workbook(wb)
+        raise
+
+    wb.save(output_file)
+
+def encrypt_excel_buffer(buffer, desired_output_path, password):
+    """Encrypt a workbook held in memory straight to ``desired_output_path`` (OOXML agile encryption)."""
+    from msoffcrypto.format.ooxml import OOXMLFile
+    out_abs = os.path.abspath(desired_output_path)
+    buffer.seek(0)
+    ooxml = OOXMLFile(buffer)
+    try:
+        with open(out_abs, "wb") as f_out:
+            ooxml.encrypt(password, f_out)
+    except Exception:
+        remove_quietly(out_abs)
+        raise
+    return out_abs
+
+def process_dynamic_schema(df, output_file, top_n_cards=20, top_n_cashiers=20, separate_cards=False, include_intervals=True,
+                           streaming=False, progress=None, cancel_event=None, aggregates=None, velocity_alerts=False,
+                           collusion_ranking=False, output_format="xlsx", password=None):
+    """Write the report for ``df``; ``aggregates`` (see cache.load_aggregates) reuses the summaries of earlier runs.
+
+    With ``velocity_alerts`` a VelocityAlerts sheet lists the bursts detect_velocity finds;
+    with ``collusion_ranking`` the CashierConcentration and CardRings sheets from
+    collusion.collusion_sheets are added. With ``output_format`` "parquet" or
+    "feather" each sheet is written to its own file named after ``output_file``
+    (encrypted with ``password`` when given) and {sheet name: path} is returned.
+    """
+    compact_ids(df)
 
     date_col = _choose_date_col(df)
+    if aggregates is None:
+        aggregates = {}
 
-    # Add interval_minutes column if requested
+    # Add interval_minutes column if requested; the card timeline is reused for the TopCards intervals
+    report_stage("intervals", progress, cancel_event)
+    card_timeline = None
     if include_intervals and date_col and "card_no" in df.columns:
-        df["interval_minutes"] = _build_interval_column(df, date_col, "card_no")
-
+        if "interval_minutes" not in aggregates:
+            card_timeline = entity_timeline(df, date_col, "card_no")
+            aggregates["interval_minutes"] = build_interval_column(df, date_col, "card_no",
+                                                                    timeline=card_timeline).to_numpy()
+        df["interval_minutes"] = aggregates["interval_minutes"]
+        note_rows(progress, len(df))
+
+    report_stage("card summary", progress, cancel_event)
+    card_summary = None
+    if "card_no" in df.columns and date_col:
+        card_summary = summarize_entities(df, "card_no", date_col=date_col, top_n=top_n_cards,
+                                          include_intervals=include_intervals, timeline=card_timeline,
+                                          aggregates=aggregates)
+        note_rows(progress, len(card_summary))
+
+    report_stage("cashier summary", progress, cancel_event)
+    expanded_df = None
+    if "cashier" in df.columns and date_col:
+        cashier_summary = summarize_entities(
+            df, "cashier", date_col=date_col,
+            top_n=top_n_cashiers, include_intervals=include_intervals, aggregates=aggregates
+        )
+        if not cashier_summary.empty:
+            expanded_df = expand_cashier_summary(df, date_col, cashier_summary, aggregates)
+            note_rows(progress, len(expanded_df))
+
+    report_stage("velocity", progress, cancel_event)
+    extra_sheets = {}
+    if velocity_alerts and date_col:
+        if "velocity_alerts" not in aggregates:
+            aggregates["velocity_alerts"] = detect_velocity(df, date_col)
+        extra_sheets["VelocityAlerts"] = aggregates["velocity_alerts"]
+        note_rows(progress, len(extra_sheets["VelocityAlerts"]))
+
+    report_stage("collusion", progress, cancel_event)
+    if collusion_ranking:
+        from collusion import collusion_sheets  # imports scipy; only needed for this stage
+        rankings = collusion_sheets(df, aggregates)
+        extra_sheets.update(rankings)
+        note_rows(progress, sum(len(t) for t in rankings.values()))
+
+    report_stage("write", progress, cancel_event)
+    note_rows(progress, len(df) + sum(len(t) for t in [card_summary, expanded_df, *extra_sheets.values()] if t is not None))
+    if output_format in COLUMNAR_FORMATS:
+        return _write_columnar_report(df, output_file, card_summary, expanded_df, output_format, extra_sheets, password,
+                                      cancel_event)
+    write_report(df, output_file, card_summary, expanded_df, separate_cards, streaming, extra_sheets, cancel_event)
+
+def _write_columnar_report(df, base_path, card_summary, expanded_df, fmt, extra_sheets=None, password=None,
+                           cancel_event=None):
+    """Write each sheet's frame to ``{base_path}_{sheet}.{fmt}``; returns {sheet name: path written}.
+
+    On ``cancel_event`` the files already written are removed.
+    """
+    frames = {"RawData": df, "TopCards": card_summary, "TopCashiers": expanded_df, **(extra_sheets or {})}
+    written = {}
+    try:
+        for name, frame in frames.items():
+            if frame is None or (name == "TopCards" and frame.empty):
+                continue
+            check_cancelled(cancel_event, "while writing")
+            written[name] = write_columnar(frame, f"{base_path}_{name}.{fmt}", fmt, password)
+    except ReportCancelled:
+        remove_quietly(*written.values())
+        raise
+    return written
+
+def columnar_to_excel(paths, output_file, separate_cards=False, streaming=False, password=None, cancel_event=None):
+    """Build the Excel report from the files of a columnar run ({sheet name: path}), decrypting them with ``password``."""
+    frames = {name: read_columnar(path, password) for name, path in paths.items() if name != "xlsx"}
+    write_report(frames.pop("RawData", None), output_file, frames.pop("TopCards", None), frames.pop("TopCashiers", None),
+                  separate_cards, streaming, extra_sheets=frames, cancel_event=cancel_event)
+
+def write_report(df, output_file, card_summary, expanded_df, separate_cards, streaming=False, extra_sheets=None,
+                  cancel_event=None):
+    """Write RawData (skipped when ``df`` is None), TopCards, TopCashiers and then ``extra_sheets``
+    ({sheet name: frame}, e.g. VelocityAlerts) to ``output_file``.
+
+    RawData that does not fit on one sheet is always written with the streaming
+    writer, which rolls it over into RawData_2, RawData_3, ... ``cancel_event``
+    is checked between chunks of rows; a cancelled write may leave an empty
+    workbook at ``output_file`` for the caller to remove.
+    """
+    if streaming or (df is not None and len(df) >= EXCEL_MAX_ROWS - 1):
+        _write_streaming_report(df, output_file, card_summary, expanded_df, separate_cards, extra_sheets=extra_sheets,
+                                cancel_event=cancel_event)
+        return
+
+    styles = _report_styles(card_summary, expanded_df, separate_cards)
     with pd.ExcelWriter(output_file, engine="openpyxl") as writer:
-        df.to_excel(writer, sheet_name="RawData", index=False)
+        try:
+            if df is not None:
+                write_frame(writer, df, "RawData", cancel_event=cancel_event)
 
-        if "card_no" in df.columns and date_col:
-            card_summary = summarize_entities(df, "card_no", date_col=date_col, top_n=top_n_cards, include_intervals=include_intervals)
-            if not card_summary.empty:
+            if card_summary is not None and not card_summary.empty:
                 if separate_cards:
-                    left = card_summary[card_summary["Card Number"].str.startswith("8880")].reset_index(drop=True)
-                    right = card_summary[card_summary["Card Number"].str.startswith("8881")].reset_index(drop=True)
+                    left, right = _split_card_summary(card_summary)
                     left.to_excel(writer, sheet_name="TopCards", index=False, startrow=0)
                     startcol = left.shape[1] + 1
                     right.to_excel(writer, sheet_name="TopCards", index=False, startrow=0, startcol=startcol)
+                    apply_fill_rules(writer.sheets["TopCards"], styles.get("TopCards"), startcol + right.shape[1])
                 else:
                     card_summary.to_excel(writer, sheet_name="TopCards", index=False)
 
-        if "cashier" in df.columns and date_col:
-            cashier_summary = summarize_entities(
-                df, "cashier", date_col=date_col,
-                top_n=top_n_cashiers, include_intervals=include_intervals
-            )
-            if not cashier_summary.empty:
-                expanded_rows = []
-                cols_to_keep = [
-                    "Total Transactions",
-                    "First Transaction",
-                    "Last Transaction",
-                    "Cards List",
-                    "Sum of Transaction Total"
-                ]
-                entity_col_name = "Cashier"  # column name from summarize_entities
-
-                # Ensure consistency
-                df["card_no"] = df["card_no"].astype(str)
-                df["cashier"] = df["cashier"].astype(str)
-
-                # Decide which transaction column to sum
-                txn_col = "trans_total" if "trans_total" in df.columns else (
-                    "transaction_amount" if "transaction_amount" in df.columns else None
-                )
-
-                # Precompute stats per cashier-card pair
-                agg_dict = {
-                    "Total_Transactions": ("card_no", "count"),
-                    "First_Transaction": (date_col, "min"),
-                    "Last_Transaction": (date_col, "max"),
-                }
-                if txn_col:
-                    agg_dict["Sum_Transaction_Total"] = (txn_col, "sum")
-
-                card_stats = (
-                    df.groupby(["cashier", "card_no"])
-                    .agg(**agg_dict)
-                    .to_dict("index")
-                )
-
-                for _, row in cashier_summary.iterrows():
-                    if "Cards List" in row and row["Cards List"]:
-                        cards = [c.strip() for c in row["Cards List"].split(",")]
-
-                        cashier_name = str(row[entity_col_name]).strip()
-
-                        # Attempt to match cashier from df (case-insensitive)
-                        matches = df[df["cashier"].str.strip().str.lower() == cashier_name.lower()]["cashier"].unique()
-                        if len(matches) > 0:
-                            raw_cashier_value = matches[0]
-                        else:
-                            raw_cashier_value = cashier_name  # fallback
-
-                        expanded_rows.append(row)
-
-                        for card in cards:
-                            new_row = row.copy()
-                            # Blank out all columns except key ones
-                            for col in row.index:
-                                if col not in cols_to_keep:
-                                    new_row[col] = None
-
-                                # Fill card-level stats
-                                new_row["Cards List"] = card
-                                stats = card_stats.get((raw_cashier_value, card), {})
-                                new_row["Total Transactions"] = stats.get("Total_Transactions", 0)
-                                new_row["First Transaction"] = stats.get("First_Transaction", None)
-                                new_row["Last Transaction"] = stats.get("Last_Transaction", None)
-                                if txn_col:
-                                    new_row["Sum of Transaction Total"] = stats.get("Sum_Transaction_Total", 0)
-
-                            expanded_rows.append(new_row)
-                    else:
-                        expanded_rows.append(row)
-
-                expanded_df = pd.DataFrame(expanded_rows)
+            if expanded_df is not None:
                 expanded_df.to_excel(writer, sheet_name="TopCashiers", index=False)
+                apply_fill_rules(writer.sheets["TopCashiers"], styles.get("TopCashiers"), expanded_df.shape[1])
 
-                # Apply highlighting with openpyxl
-                try:
-                    wb = load_workbook(writer.path)
-                    ws = wb["TopCashiers"]
-
-                    cashier_fill = PatternFill(start_color="FFD700", end_color="FFD700", fill_type="solid")  # gold highlight
-
-                    last_cashier = None
-                    for row_idx, row in enumerate(expanded_df.itertuples(index=False), start=2):  # row 1 is header
-                        current_cashier = getattr(row, entity_col_name, None)
-                        if current_cashier and current_cashier != last_cashier:
-                            # Highlight first row of each cashier group
-                            for col_idx in range(1, ws.max_column + 1):
-                                ws.cell(row=row_idx, column=col_idx).fill = cashier_fill
-                            last_cashier = current_cashier
-
-                    wb.save(writer.path)
-                except Exception as e:
-                    print(f"Highlighting failed: {e}")
-
-
-    if separate_cards:
-        try:
-            wb = load_workbook(output_file)
-            if "TopCards" in wb.sheetnames:
-                ws = wb["TopCards"]
-                max_col = ws.max_column
-                blank_col_idx = None
-                for c in range(1, max_col + 1):
-                    if ws.cell(row=1, column=c).value in (None, ""):
-                        blank_col_idx = c
-                        break
-                if blank_col_idx:
-                    left_end = blank_col_idx - 1
-                    right_start = blank_col_idx + 1
-                else:
-                    left_end = max_col // 2
-                    right_start = left_end + 2
+            for name, frame in (extra_sheets or {}).items():
+                write_frame(writer, frame, name, cancel_event=cancel_event)
+        except ReportCancelled:
+            discard_workbook(writer.book)  # closing the writer then saves an empty workbook
+            raise
 
-                blue_fill = PatternFill(start_color="87CEFA", end_color="87CEFA", fill_type="solid")
-                yellow_fill = PatternFill(start_color="FFFF99", end_color="FFFF99", fill_type="solid")
+# Names a folder to use instead of TopTransactionsPerMonth, e.g. to keep benchmark runs out of the real logs
+OUTPUT_DIR_ENV = "VSCAN_OUTPUT_DIR"
 
-                for col in range(1, left_end + 1):
-                    ws.cell(row=1, column=col).fill = blue_fill
-                for col in range(right_start, max_col + 1):
-                    ws.cell(row=1, column=col).fill = yellow_fill
+def output_root():
+    """The folder reports and their logs go in: TopTransactionsPerMonth next to this file, unless OUTPUT_DIR_ENV is set."""
+    return os.environ.get(OUTPUT_DIR_ENV) or os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                          "TopTransactionsPerMonth")
 
-                wb.save(output_file)
-        except Exception:
-            pass
-
-def process_file(input_file, top_n_cards=20, top_n_cashiers=20, encrypt=True, separate_cards=False, include_intervals=True):
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    output_folder = os.path.join(script_dir, "TopTransactionsPerMonth")
+def output_folders():
+    output_folder = output_root()
     os.makedirs(output_folder, exist_ok=True)
 
     password_log_folder = os.path.join(output_folder, "passwordlogs")
     os.makedirs(password_log_folder, exist_ok=True)
     log_file = os.path.join(password_log_folder, "password_log.txt")
+    return output_folder, log_file
+
+def month_range(first, last):
+    """The month part of a report's file name, e.g. "2024-03" or "2024-01_to_2024-03"; the current month without dates."""
+    if first is None or pd.isna(first):
+        return datetime.now().strftime("%Y-%m")
+    start, end = str(pd.Timestamp(first).to_period("M")), str(pd.Timestamp(last).to_period("M"))
+    return start if start == end else f"{start}_to_{end}"
 
-    df = pd.read_excel(input_file)
-    if "card_no" in df.columns:
-        df["card_no"] = df["card_no"].astype(str)
+def load_report_input(input_file, key=None):
+    df = compact_ids(read_input(input_file, key=key))
 
     date_col = _choose_date_col(df)
     if date_col:
         df[date_col] = pd.to_datetime(df[date_col], errors="coerce")
-        yearmonths = df[date_col].dt.to_period("M").dropna().unique()
-        if len(yearmonths) > 0:
-            start = str(min(yearmonths))
-            end = str(max(yearmonths))
-            month_range = start if start == end else f"{start}_to_{end}"
-        else:
-            month_range = datetime.now().strftime("%Y-%m")
-    else:
-        month_range = datetime.now().strftime("%Y-%m")
+    return df, date_col
 
-    output_file = os.path.join(output_folder, f"top_transaction_{month_range}.xlsx")
-    process_dynamic_schema(df, output_file, top_n_cards, top_n_cashiers, separate_cards=separate_cards, include_intervals=include_intervals)
+def report_target(output_file, encrypt):
+    """Where process_dynamic_schema should write: memory when the report will be encrypted."""
+    return io.BytesIO() if encrypt else output_file
 
+def encrypt_output(output_file, encrypt, buffer=None, password=None):
+    """Encrypt the report if requested; return the final path and the password (or None).
+
+    With ``buffer`` (the report serialized in memory) only the encrypted file is
+    written. The plaintext goes to ``output_file`` only if the in-memory
+    encryptor is unavailable and the on-disk fallbacks have to run. A new
+    password is generated unless one is given.
+    """
     final_file = output_file
-    password = None
     if encrypt:
-        password = generate_password()
+        password = password or generate_password()
         encrypted_target = output_file.replace(".xlsx", "_encrypted.xlsx")
+        if buffer is not None:
+            try:
+                return encrypt_excel_buffer(buffer, encrypted_target, password), password
+            except Exception:
+                with open(output_file, "wb") as f_out:
+                    f_out.write(buffer.getbuffer())
         try:
             final_file = encrypt_excel(output_file, encrypted_target, password)
             try:
@@ -373,49 +798,256 @@ def process_file(input_file, top_n_cards=20, top_n_cashiers=20, encrypt=True, se
                 pass
         except Exception as e:
             raise RuntimeError(f"Failed to encrypt '{output_file}': {e}")
+    return final_file, password
 
+def log_output(log_file, input_file, final_file, encrypt, password, separate_cards, include_intervals):
+    """Append the run to the password log; ``final_file`` is a path or, for columnar runs, {sheet name: path}."""
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    outputs = final_file.values() if isinstance(final_file, dict) else [final_file]
     with open(log_file, "a", encoding="utf-8") as log:
         log.write(f"[{timestamp}] Input: {os.path.basename(input_file)} | "
-                  f"Output: {os.path.basename(final_file)} | "
+                  f"Output: {', '.join(os.path.basename(path) for path in outputs)} | "
                   f"Encryption: {'ENABLED' if encrypt else 'DISABLED'} | "
                   f"Password: {password if encrypt else ''} | Separated: {separate_cards} | "
                   f"IncludeIntervals: {include_intervals}\n")
 
+def process_file(input_file, top_n_cards=20, top_n_cashiers=20, encrypt=True, separate_cards=False, include_intervals=True,
+                 streaming=False, progress=None, cancel_event=None, output_prefix="", stats=None, velocity_alerts=False,
+                 collusion_ranking=False, output_format="xlsx", excel=False):
+    """Build the report for ``input_file``.
+
+    ``progress(stage, index, total)`` is called as each of REPORT_STAGES starts.
+    Setting ``cancel_event`` (a threading.Event) stops the run at the next stage
+    boundary, or the next chunk of rows while writing, with ReportCancelled,
+    after removing any partial output.
+    ``output_prefix`` is prepended to the report's file name. ``velocity_alerts``
+    adds the VelocityAlerts sheet (see detect_velocity) and ``collusion_ranking``
+    the CashierConcentration and CardRings sheets (see collusion.py).
+
+    ``output_format`` "parquet" or "feather" writes RawData (with
+    interval_minutes), TopCards, TopCashiers and any analysis sheets as one
+    columnar file each instead of the workbook, encrypted with pyAesCrypt when
+    ``encrypt`` is set. The returned file is then {sheet name: path}; with
+    ``excel`` the workbook is also built from those files, under "xlsx", with the
+    same password.
+
+    Each stage's wall time, CPU time, peak RSS growth and row count are appended
+    as a JSON run record to run_log.jsonl next to the password log; if ``stats``
+    is a dict it receives the same record.
+
+    The per-entity summaries are kept in memory per input (cache.load_aggregates),
+    so running again on the same file with another top-N, separation or interval
+    setting only computes the rows not summarized before, then writes.
+    """
+    if output_format != "xlsx" and output_format not in COLUMNAR_FORMATS:
+        raise ValueError(f"Unknown output format: {output_format}")
+    output_folder, log_file = output_folders()
+    progress = recorder = RunRecorder(progress)
+
+    report_stage("read", progress, cancel_event)
+    key = cache_key(input_file)
+    df, date_col = load_report_input(input_file, key)
+    aggregates = load_aggregates(key)
+    reused = bool(aggregates)
+    rows = len(df)
+    note_rows(progress, rows)
+    first, last = (df[date_col].min(), df[date_col].max()) if date_col else (None, None)
+    base_path = os.path.join(output_folder, f"{output_prefix}top_transaction_{month_range(first, last)}")
+    output_file = base_path + ".xlsx"
+    columnar = output_format in COLUMNAR_FORMATS
+    password = generate_password() if encrypt and columnar else None
+    # Encrypted reports are built in memory, so only unencrypted output can be left behind by a cancel
+    target = report_target(output_file, encrypt)
+    columnar_files = None
+    try:
+        columnar_files = process_dynamic_schema(
+            df, base_path if columnar else target, top_n_cards, top_n_cashiers, separate_cards=separate_cards,
+            include_intervals=include_intervals, streaming=streaming, progress=progress, cancel_event=cancel_event,
+            aggregates=aggregates, velocity_alerts=velocity_alerts, collusion_ranking=collusion_ranking,
+            output_format=output_format, password=password)
+        report_stage("excel", progress, cancel_event)
+        if columnar and excel:
+            columnar_to_excel(columnar_files, target, separate_cards, streaming, password, cancel_event)
+        report_stage("encrypt", progress, cancel_event)
+    except ReportCancelled:
+        remove_quietly(*(columnar_files or {}).values())
+        if not encrypt:
+            remove_quietly(output_file)
+        raise
+
+    if columnar:
+        final_file = dict(columnar_files)
+        if excel:
+            final_file["xlsx"], password = encrypt_output(output_file, encrypt, buffer=target if encrypt else None,
+                                                           password=password)
+    else:
+        final_file, password = encrypt_output(output_file, encrypt, buffer=target if encrypt else None)
+    log_output(log_file, input_file, final_file, encrypt, password, separate_cards, include_intervals)
+    record = recorder.record(
+        input=os.path.abspath(input_file), output=final_file, rows=rows, reused_aggregates=reused,
+        options={"top_n_cards": top_n_cards, "top_n_cashiers": top_n_cashiers, "encrypt": encrypt,
+                 "separate_cards": separate_cards, "include_intervals": include_intervals, "streaming": streaming,
+                 "velocity_alerts": velocity_alerts, "collusion_ranking": collusion_ranking,
+                 "output_format": output_format, "excel": excel},
+    )
+    write_run_record(os.path.dirname(log_file), record)
+    if stats is not None:
+        stats.update(record)
+
     print(f"Saved {'and encrypted ' if encrypt else ''}{final_file}")
     return output_folder, final_file, (password if encrypt else None)
 
-def process_entity_details(input_file, card_no=None, cashier=None, include_intervals=True):
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    output_folder = os.path.join(script_dir, "TopTransactionsPerMonth", "Card_Cashier_Details_Output")
-    os.makedirs(output_folder, exist_ok=True)
+def _build_month_report(month_df, output_file, top_n_cards, top_n_cashiers, encrypt, separate_cards, include_intervals, streaming,
+                        velocity_alerts=False, collusion_ranking=False):
+    """Worker: build and optionally encrypt one month's workbook."""
+    target = report_target(output_file, encrypt)
+    process_dynamic_schema(month_df, target, top_n_cards, top_n_cashiers, separate_cards=separate_cards,
+                           include_intervals=include_intervals, streaming=streaming, velocity_alerts=velocity_alerts,
+                           collusion_ranking=collusion_ranking)
+    return encrypt_output(output_file, encrypt, buffer=target if encrypt else None)
+
+def process_file_by_month(input_file, top_n_cards=20, top_n_cashiers=20, encrypt=True, separate_cards=False,
+                          include_intervals=True, streaming=False, workers=None, progress=None, cancel_event=None,
+                          velocity_alerts=False, collusion_ranking=False):
+    """Write one report per calendar month, ranking TopCards/TopCashiers within each month.
+
+    Months are built and encrypted in parallel across ``workers`` processes
+    (default: one per CPU). Rows without a parseable date belong to no month and
+    are left out. Returns the output folder and a list of ``(month, file, password)``.
+    ``progress(stage, index, total)`` is called after the read and as each month
+    completes; on ``cancel_event`` every file written by this run is removed.
+    """
+    output_folder, log_file = output_folders()
+
+    if cancel_event is not None and cancel_event.is_set():
+        raise ReportCancelled("Cancelled before read")
+    df, date_col = load_report_input(input_file)
+    if not date_col:
+        raise RuntimeError("No transaction date column found; cannot split the report by month.")
+    months = df[date_col].dt.to_period("M")
+
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for month, month_df in df.groupby(months, sort=True):
+            output_file = os.path.join(output_folder, f"top_transaction_{month}.xlsx")
+            future = pool.submit(_build_month_report, month_df.reset_index(drop=True), output_file, top_n_cards,
+                                 top_n_cashiers, encrypt, separate_cards, include_intervals, streaming, velocity_alerts,
+                                 collusion_ranking)
+            futures[future] = (str(month), output_file)
+        if progress is not None:
+            progress("read", 1, len(futures) + 1)
+
+        for future, (month, output_file) in futures.items():
+            while cancel_event is not None and not future.done():
+                if cancel_event.wait(0.2):
+                    pool.shutdown(wait=True, cancel_futures=True)
+                    # Months that were never started are untouched; remove everything the finished ones wrote
+                    for f, (_, path) in futures.items():
+                        if f.done() and not f.cancelled():
+                            remove_quietly(path, f.result()[0] if f.exception() is None else None)
+                    raise ReportCancelled(f"Cancelled after {len(results)} of {len(futures)} months")
+            final_file, password = future.result()
+            log_output(log_file, input_file, final_file, encrypt, password, separate_cards, include_intervals)
+            print(f"Saved {'and encrypted ' if encrypt else ''}{final_file}")
+            results.append((month, final_file, password))
+            if progress is not None:
+                progress(f"month {month}", len(results) + 1, len(futures) + 1)
+
+    return output_folder, results
+
+def build_entity_index(df, entity_col):
+    """Index the rows of ``df`` by the string form of ``entity_col``.
+
+    Keys are kept sorted with each key's row positions stored contiguously, so a
+    lookup is a binary search plus a slice: O(log n + k).
+    """
+    keys = as_str_category(df[entity_col])
+    categories = np.asarray(keys.cat.categories, dtype=object)
+    rank = np.argsort(categories)
+    uniques = categories[rank]
+    sorted_code = np.empty(len(rank), dtype=np.int64)
+    sorted_code[rank] = np.arange(len(rank))
+    raw_codes = keys.cat.codes.to_numpy()
+    codes = np.full(len(raw_codes), -1, dtype=np.int64)
+    codes[raw_codes >= 0] = sorted_code[raw_codes[raw_codes >= 0]]
+    order = np.argsort(codes, kind="stable")
+    bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+    return {"keys": np.asarray(uniques, dtype=object), "order": order, "bounds": bounds}
+
+def lookup_entity_rows(index, key):
+    """Return the row positions for ``key`` in original row order (empty if absent)."""
+    keys = index["keys"]
+    key = str(key)
+    i = int(np.searchsorted(keys, key))
+    if i == len(keys) or keys[i] != key:
+        return np.empty(0, dtype=np.intp)
+    return index["order"][index["bounds"][i]:index["bounds"][i + 1]]
+
+# The most recently loaded detail dataset and its entity indexes, reused across exports
+_detail_dataset = {}
+
+def _load_detail_dataset(input_file):
+    key = cache_key(input_file)
+    if _detail_dataset.get("key") != key:
+        df = compact_ids(read_input(input_file, key=key))
+        _detail_dataset.clear()
+        _detail_dataset.update({"key": key, "df": df, "indexes": {}})
+    return _detail_dataset
+
+def _entity_index(dataset, entity_col):
+    indexes = dataset["indexes"]
+    if entity_col not in indexes:
+        indexes[entity_col] = build_entity_index(dataset["df"], entity_col)
+    return indexes[entity_col]
+
+def _write_entity_details(entity_df, entity_col, entity, date_col, output_folder, include_intervals, output_prefix=""):
+    summary_df = summarize_entities(entity_df, entity_col, date_col=date_col, top_n=1, include_intervals=include_intervals)
+    prefix = "Card" if entity_col == "card_no" else "Cashier"
+    safe_entity = str(entity).replace("/", "_").replace("\\", "_")
+    output_file = os.path.join(output_folder, f"{output_prefix}{prefix}_{safe_entity}_details.xlsx")
 
-    df = pd.read_excel(input_file)
-    if "card_no" in df.columns:
-        df["card_no"] = df["card_no"].astype(str)
+    with pd.ExcelWriter(output_file, engine="openpyxl") as writer:
+        entity_df.to_excel(writer, sheet_name="RawData", index=False)
+        if not summary_df.empty:
+            summary_df.to_excel(writer, sheet_name="Summary", index=False)
+
+    return output_file
 
+def process_entity_details_batch(input_file, card_nos=(), cashiers=(), include_intervals=True, output_prefix=""):
+    """Write one details workbook per card and per cashier, loading and indexing the input once.
+
+    Returns the output paths in the order requested; ``output_prefix`` is prepended to each file name.
+    """
+    output_folder = os.path.join(output_root(), "Card_Cashier_Details_Output")
+    os.makedirs(output_folder, exist_ok=True)
+
+    dataset = _load_detail_dataset(input_file)
+    df = dataset["df"]
     date_col = _choose_date_col(df)
 
+    requests = [("card_no", c) for c in card_nos] + [("cashier", c) for c in cashiers]
+    found = []
+    missing = []
+    for entity_col, entity in requests:
+        rows = lookup_entity_rows(_entity_index(dataset, entity_col), entity) if entity_col in df.columns else []
+        if len(rows) == 0:
+            missing.append(f"{entity_col} = {entity}")
+        found.append(rows)
+    if missing:
+        raise RuntimeError(f"No rows found for {', '.join(missing)}")
+
+    output_files = []
+    for (entity_col, entity), rows in zip(requests, found):
+        entity_df = df.iloc[rows].copy()
+        output_files.append(_write_entity_details(entity_df, entity_col, entity, date_col, output_folder, include_intervals,
+                                                  output_prefix))
+    return output_files
+
+def process_entity_details(input_file, card_no=None, cashier=None, include_intervals=True):
     if card_no:
-        entity_df = df[df["card_no"] == str(card_no)].copy()
-        if entity_df.empty:
-            raise RuntimeError(f"No rows found for card_no = {card_no}")
-        summary_df = summarize_entities(entity_df, "card_no", date_col=date_col, top_n=1, include_intervals=include_intervals)
-        safe_card = str(card_no).replace("/", "_").replace("\\", "_")
-        output_file = os.path.join(output_folder, f"Card_{safe_card}_details.xlsx")
+        return process_entity_details_batch(input_file, card_nos=[card_no], include_intervals=include_intervals)[0]
     elif cashier:
-        entity_df = df[df["cashier"] == cashier].copy()
-        if entity_df.empty:
-            raise RuntimeError(f"No rows found for cashier = {cashier}")
-        summary_df = summarize_entities(entity_df, "cashier", date_col=date_col, top_n=1, include_intervals=include_intervals)
-        safe_cashier = str(cashier).replace("/", "_").replace("\\", "_")
-        output_file = os.path.join(output_folder, f"Cashier_{safe_cashier}_details.xlsx")
+        return process_entity_details_batch(input_file, cashiers=[cashier], include_intervals=include_intervals)[0]
     else:
         raise ValueError("Either card_no or cashier must be provided.")
-
-    with pd.ExcelWriter(output_file, engine="openpyxl") as writer:
-        entity_df.to_excel(writer, sheet_name="RawData", index=False)
-        if not summary_df.empty:
-            summary_df.to_excel(writer, sheet_name="Summary", index=False)
-
-    return output_file
@@ -0,0 +1,104 @@
+import bisect
+from itertools import islice
+
+import numpy as np
+
+# Entries handed to a combobox at once
+PAGE_SIZE = 200
+_MAX_CHAR = chr(0x10FFFF)
+_BITS = 21  # every code point fits in 21 bits, so a trigram packs into one uint64
+_VERIFY_DIRECTLY = 2_000
+
+class SearchIndex:
+    """Case-insensitive prefix and substring lookup over a fixed list of values.
+
+    Keys are the values' lowercase string form, sorted; prefixes are a bisect.
+    Substrings go through a trigram index: every key is padded with two
+    terminators, each of its trigrams is packed into an integer, and the sorted
+    (trigram, key) pairs act as posting lists. Results are returned a page at a
+    time, prefix matches first, then the other matches, each in key order.
+    """
+
+    def __init__(self, values):
+        keyed = sorted((str(v).lower(), v) for v in values)
+        self.keys = [k for k, _ in keyed]
+        self.values = [v for _, v in keyed]
+        self._grams, self._rows = self._build_trigrams(self.keys)
+
+    def __len__(self):
+        return len(self.keys)
+
+    @staticmethod
+    def _build_trigrams(keys):
+        if not keys:
+            return np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int64)
+        chars = np.array(keys, dtype=str)
+        width = chars.dtype.itemsize // 4
+        codes = np.zeros((len(keys), width + 2), dtype=np.uint64)  # the zero columns are the terminators
+        codes[:, :width] = chars.view(np.uint32).reshape(len(keys), width)
+        grams = (codes[:, :-2] << (2 * _BITS)) | (codes[:, 1:-1] << _BITS) | codes[:, 2:]
+        starts = np.arange(width) < np.char.str_len(chars)[:, None]  # one trigram per real character
+
+        rows = np.broadcast_to(np.arange(len(keys))[:, None], grams.shape)[starts]
+        grams = grams[starts]
+        order = np.argsort(grams, kind="stable")  # rows stay ascending within a trigram
+        grams, rows = grams[order], rows[order]
+        unique = np.ones(len(grams), dtype=bool)
+        unique[1:] = (grams[1:] != grams[:-1]) | (rows[1:] != rows[:-1])
+        return grams[unique], rows[unique]
+
+    def prefix_range(self, query):
+        """Return the [start, stop) positions of the keys starting with ``query`` (lowercase)."""
+        return bisect.bisect_left(self.keys, query), bisect.bisect_left(self.keys, query + _MAX_CHAR)
+
+    def _posting(self, low, high):
+        """Rows whose trigrams fall in [low, high)."""
+        return self._rows[np.searchsorted(self._grams, low):np.searchsorted(self._grams, high)]
+
+    def _substring_rows(self, query, skip, need):
+        """Up to ``need`` ascending positions of keys containing ``query``, outside the range ``skip``."""
+        start, stop = skip
+        codes = [ord(c) for c in query]
+        if len(codes) >= 3:
+            grams = {(codes[i] << (2 * _BITS)) | (codes[i + 1] << _BITS) | codes[i + 2] for i in range(len(codes) - 2)}
+            postings = sorted((self._posting(np.uint64(g), np.uint64(g + 1)) for g in grams), key=len)
+            candidates = postings[0]
+            for posting in postings[1:]:
+                if len(candidates) <= _VERIFY_DIRECTLY:
+                    break  # checking the keys themselves is cheaper than intersecting long postings
+                candidates = np.intersect1d(candidates, posting, assume_unique=True)
+            candidates = candidates[(candidates < start) | (candidates >= stop)]
+            # Sharing every trigram does not guarantee the query is contiguous in the key
+            return list(islice((int(r) for r in candidates if query in self.keys[r]), need))
+
+        # One or two characters: the trigrams starting with them, terminators included
+        low = codes[0] << (2 * _BITS)
+        high = (codes[0] + 1) << (2 * _BITS)
+        if len(codes) == 2:
+            low |= codes[1] << _BITS
+            high = low + (1 << _BITS)
+        posting = self._posting(np.uint64(low), np.uint64(high))
+        if len(posting) > len(self.keys) // 4:
+            # Common characters match early: scanning in order beats building the full set
+            rows = (r for r in range(len(self.keys)) if not start <= r < stop and query in self.keys[r])
+            return list(islice(rows, need))
+        hit = np.zeros(len(self.keys), dtype=bool)
+        hit[posting] = True
+        hit[start:stop] = False
+        return np.flatnonzero(hit)[:need].tolist()
+
+    def search(self, query, offset=0, limit=PAGE_SIZE):
+        """Return up to ``limit`` values matching ``query`` from ``offset`` on, and whether more follow.
+
+        An empty query matches everything.
+        """
+        query = str(query).strip().lower()
+        need = offset + limit + 1  # one past the page tells whether another page exists
+        if not query:
+            rows = list(range(min(need, len(self.keys))))
+        else:
+            start, stop = self.prefix_range(query)
+            rows = list(range(start, min(stop, start + need)))
+            if len(rows) < need:
+                rows += self._substring_rows(query, (start, stop), need - len(rows))
+        return [self.values[r] for r in rows[offset:offset + limit]], len(rows) > offset + limit
@@ -0,0 +1,339 @@
+import os
+import sqlite3
+
+import pandas as pd
+
+from ingest import choose_date_column
+from instrument import RunRecorder, note_rows, write_run_record
+from process import (ReportCancelled, assemble_cashier_table, build_interval_column, build_intervals, compact_ids,
+                     encrypt_output, entity_label, entity_timeline, finish_summary, log_output, month_range,
+                     output_folders, remove_quietly, report_target, report_stage, txn_column, write_report)
+
+SQL_STAGES = ["rank", "card summary", "cashier summary", "raw data", "write", "encrypt"]
+# Keys bound per IN (...) list; SQLite before 3.32 allows at most 999 parameters per statement
+IN_BATCH = 500
+
+class SQLSource:
+    """A transactions table in a SQL database, read through a DB-API connection.
+
+    Subclasses set the dialect: the parameter marker, the expression for the day
+    of a timestamp, and ``row_order``, an expression giving the table's row
+    order. Ties between entities go to the one seen first, as in file reports;
+    without a row order they go to the earliest transaction. ``fetched_rows``
+    counts the result rows brought back so far.
+    """
+
+    placeholder = "?"
+    row_order = None
+
+    def __init__(self, connection, table, name=None):
+        self.connection = connection
+        self.table = table
+        self.name = name or table
+        self.fetched_rows = 0
+
+    @staticmethod
+    def quote(name):
+        return '"' + str(name).replace('"', '""') + '"'
+
+    @property
+    def table_sql(self):
+        return ".".join(self.quote(part) for part in self.table.split("."))
+
+    def day(self, column):
+        return f"DATE({column})"
+
+    def query(self, sql, params=()):
+        """Run ``sql`` and return its result as a DataFrame."""
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute(sql, tuple(params))
+            columns = [d[0] for d in cursor.description]
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+        self.fetched_rows += len(rows)
+        return pd.DataFrame.from_records(list(rows), columns=columns)
+
+    def columns(self):
+        """Return the table's column names without reading any row."""
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute(f"SELECT * FROM {self.table_sql} WHERE 1 = 0")
+            return [d[0] for d in cursor.description]
+        finally:
+            cursor.close()
+
+    def close(self):
+        self.connection.close()
+
+class SQLiteSource(SQLSource):
+    """A table in a local SQLite file, e.g. an extract loaded with ``DataFrame.to_sql``; rows keep their insert order."""
+
+    row_order = "rowid"
+
+    def __init__(self, path, table):
+        super().__init__(sqlite3.connect(path), table, name=f"{os.path.basename(path)}:{table}")
+
+class RedshiftSource(SQLSource):
+    """A Redshift table; ``connect_args`` go to redshift_connector.connect."""
+
+    placeholder = "%s"
+
+    def __init__(self, table, **connect_args):
+        import redshift_connector  # only needed for warehouse runs
+        super().__init__(redshift_connector.connect(**connect_args), table,
+                         name=f"{connect_args.get('database', 'redshift')}:{table}")
+
+    def day(self, column):
+        return f"TRUNC({column})"
+
+def _keyed_query(source, sql, keys):
+    """Run ``sql`` once per batch of ``keys``, binding each batch to its ``{keys}`` list, and concatenate the results."""
+    keys = list(keys)
+    frames = []
+    for start in range(0, len(keys), IN_BATCH):
+        batch = keys[start:start + IN_BATCH]
+        frames.append(source.query(sql.format(keys=", ".join([source.placeholder] * len(batch))), batch))
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+def _first_seen(source, date_col):
+    return source.row_order or source.quote(date_col)
+
+def _times(values):
+    return pd.to_datetime(pd.Series(values, dtype=object), errors="coerce")
+
+def rank_entities(source, entity_col, date_col, top_n):
+    """Return the ``top_n`` most frequent keys of ``entity_col``, ranked in the database."""
+    key = source.quote(entity_col)
+    ranked = source.query(
+        f"SELECT {key} AS entity, COUNT(*) AS n, MIN({_first_seen(source, date_col)}) AS first_pos "
+        f"FROM {source.table_sql} WHERE {key} IS NOT NULL GROUP BY {key} "
+        f"ORDER BY n DESC, first_pos, entity LIMIT {int(top_n)}")
+    return ranked["entity"].tolist() if len(ranked) else []
+
+def _distinct_values(source, entity_col, date_col, value_col, keys):
+    """Distinct values of ``value_col`` per key as {key: [values as strings, first seen first]}."""
+    key, value = source.quote(entity_col), source.quote(value_col)
+    pairs = _keyed_query(
+        source,
+        f"SELECT {key} AS entity, {value} AS value, MIN({_first_seen(source, date_col)}) AS first_pos "
+        f"FROM {source.table_sql} WHERE {key} IN ({{keys}}) AND {value} IS NOT NULL GROUP BY {key}, {value}", keys)
+    lists = {k: [] for k in keys}
+    if len(pairs):
+        pairs = pairs.sort_values(["first_pos", "value"], kind="stable")
+        for entity, value in zip(pairs["entity"].tolist(), pairs["value"].tolist()):
+            lists[entity].append(str(value))
+    return lists
+
+def _busiest_days(source, entity_col, date_col, keys):
+    """Return the busiest and quietest day labels per key; ties go to the day seen first."""
+    key, date = source.quote(entity_col), source.quote(date_col)
+    day = source.day(date)
+    days = _keyed_query(
+        source,
+        f"SELECT {key} AS entity, {day} AS day, COUNT(*) AS n, MIN({_first_seen(source, date_col)}) AS first_pos "
+        f"FROM {source.table_sql} WHERE {key} IN ({{keys}}) AND {date} IS NOT NULL GROUP BY {key}, {day}", keys)
+    if days.empty:
+        return {}, {}
+    days["day"] = _times(days["day"]).to_numpy()
+    days = days.dropna(subset=["day"])
+    days["label"] = days["day"].dt.strftime("%Y-%m-%d") + " (" + days["n"].astype(str) + ")"
+    peak = days.sort_values(["n", "first_pos"], ascending=[False, True], kind="stable").drop_duplicates("entity")
+    low = days.sort_values(["n", "first_pos"], kind="stable").drop_duplicates("entity")
+    return dict(zip(peak["entity"], peak["label"])), dict(zip(low["entity"], low["label"]))
+
+def _first_months(source, entity_col, date_col, keys, first_times):
+    """Month of each key's first row, as in file reports; the first transaction's month without a row order."""
+    if source.row_order is None:
+        return {k: str(t.to_period("M")) if pd.notna(t) else "NaT" for k, t in first_times.items()}
+    key, order = source.quote(entity_col), source.row_order
+    firsts = _keyed_query(
+        source,
+        f"SELECT {key} AS entity, {source.quote(date_col)} AS first_time FROM {source.table_sql} "
+        f"WHERE {order} IN (SELECT MIN({order}) FROM {source.table_sql} WHERE {key} IN ({{keys}}) GROUP BY {key})",
+        keys)
+    times = _times(firsts["first_time"]) if len(firsts) else pd.Series(dtype="datetime64[ns]")
+    return {k: str(t.to_period("M")) if pd.notna(t) else "NaT" for k, t in zip(firsts.get("entity", []), times)}
+
+def _fetch_rows(source, columns, entity_col=None, keys=None):
+    """Return ``columns`` of the rows of ``keys`` (every row when ``keys`` is None) in table order."""
+    select = ", ".join(source.quote(c) for c in columns)
+    order = f" ORDER BY {source.row_order}" if source.row_order else ""
+    if keys is None:
+        return source.query(f"SELECT {select} FROM {source.table_sql}{order}")
+    return _keyed_query(source, f"SELECT {select} FROM {source.table_sql} "
+                                f"WHERE {source.quote(entity_col)} IN ({{keys}}){order}", keys)
+
+def summarize_entities_sql(source, entity_col, date_col, columns, top_n=20, include_intervals=True, top=None):
+    """Return the same summary rows as process.summarize_entities, aggregated in the database.
+
+    The ranking, counts, first/last times, busiest days, distinct values and
+    sums are GROUP BY queries restricted to the top keys; only the key and time
+    of those keys' rows are fetched, and only for the Transaction Intervals column.
+    ``top`` is the ranking from rank_entities when already known.
+    """
+    if top is None:
+        top = rank_entities(source, entity_col, date_col, top_n)
+    if not top:
+        return pd.DataFrame()
+    key, date = source.quote(entity_col), source.quote(date_col)
+    txn_col = txn_column(columns)
+    sums = [(txn_col, "Sum of Transaction Total")] if txn_col else []
+    if "point_earned" in columns:
+        sums.append(("point_earned", "Total Points"))
+    sum_sql = "".join(f", COALESCE(SUM({source.quote(col)}), 0) AS s{i}" for i, (col, _) in enumerate(sums))
+    totals = _keyed_query(
+        source,
+        f"SELECT {key} AS entity, COUNT(*) AS n, MIN({date}) AS first_time, MAX({date}) AS last_time{sum_sql} "
+        f"FROM {source.table_sql} WHERE {key} IN ({{keys}}) GROUP BY {key}", top).set_index("entity").loc[top]
+
+    first_times = _times(totals["first_time"]).to_numpy()
+    months = _first_months(source, entity_col, date_col, top, dict(zip(top, pd.DatetimeIndex(first_times))))
+    peak, low = _busiest_days(source, entity_col, date_col, top)
+    out = pd.DataFrame({entity_label(entity_col): [str(e) for e in top]})
+    out["Month"] = [months.get(e, "NaT") for e in top]
+    out["Total Transactions"] = totals["n"].to_numpy(dtype="int64")
+    out["First Transaction"] = first_times
+    out["Last Transaction"] = _times(totals["last_time"]).to_numpy()
+    out["Day with Most Transactions"] = [peak.get(e, "N/A") for e in top]
+    out["Day with Fewest Transactions"] = [low.get(e, "N/A") for e in top]
+
+    def add_distinct(col, count_name, list_name):
+        lists = _distinct_values(source, entity_col, date_col, col, top)
+        out[count_name] = [len(lists[e]) for e in top]
+        out[list_name] = [", ".join(lists[e]) for e in top]
+
+    if "branch_code" in columns:
+        add_distinct("branch_code", "Distinct Branches", "Branch List")
+    elif "branch_name" in columns:
+        add_distinct("branch_name", "Distinct Branches", "Branch List")
+    if "cashier" in columns and entity_col != "cashier":
+        add_distinct("cashier", "Distinct Cashiers", "Cashier List")
+    if "register_no" in columns:
+        add_distinct("register_no", "Distinct Registers", "Register List")
+    if entity_col == "cashier" and "card_no" in columns:
+        add_distinct("card_no", "Distinct Cards", "Cards List")
+    for i, (_, name) in enumerate(sums):
+        out[name] = totals[f"s{i}"].astype("float64").to_numpy()
+    out.index = top
+
+    interval_strings = None
+    if include_intervals:
+        rows = _fetch_rows(source, [entity_col, date_col], entity_col, top)
+        interval_strings = build_intervals(entity_timeline(rows, date_col, entity_col), top) if len(rows) else {}
+    return finish_summary(out, top, interval_strings)
+
+def expand_cashier_summary_sql(source, date_col, columns, cashier_summary, cashiers):
+    """Return the TopCashiers table, with each cashier's card rows aggregated per (cashier, card) in the database.
+
+    ``cashiers`` are the database keys of the summary's cashiers.
+    """
+    if "Cards List" not in cashier_summary.columns or "card_no" not in columns:
+        return cashier_summary.copy()
+    leaders = cashier_summary.reset_index(drop=True)
+    leader_of = {name: i for i, name in enumerate(leaders["Cashier"]) if leaders["Cards List"][i]}
+    keys = [k for k in cashiers if str(k) in leader_of]
+    cashier, card, date = source.quote("cashier"), source.quote("card_no"), source.quote(date_col)
+    txn_col = txn_column(columns)
+    sum_sql = f", COALESCE(SUM({source.quote(txn_col)}), 0) AS Sum_Transaction_Total" if txn_col else ""
+    cards = _keyed_query(
+        source,
+        f"SELECT {cashier} AS cashier, {card} AS card, COUNT(*) AS Total_Transactions, "
+        f"MIN({date}) AS First_Transaction, MAX({date}) AS Last_Transaction{sum_sql}, "
+        f"MIN({_first_seen(source, date_col)}) AS first_pos FROM {source.table_sql} "
+        f"WHERE {cashier} IN ({{keys}}) AND {card} IS NOT NULL GROUP BY {cashier}, {card}", keys)
+    if cards.empty:
+        cards = pd.DataFrame(columns=["leader", "card", "Total_Transactions", "First_Transaction", "Last_Transaction",
+                                      "Sum_Transaction_Total"])
+    else:
+        cards["leader"] = [leader_of[str(c)] for c in cards["cashier"]]
+        cards = cards.sort_values(["leader", "first_pos"], kind="stable")
+        cards["card"] = [str(c).strip() for c in cards["card"]]
+        cards["First_Transaction"] = _times(cards["First_Transaction"]).to_numpy()
+        cards["Last_Transaction"] = _times(cards["Last_Transaction"]).to_numpy()
+    return assemble_cashier_table(leaders, cards, has_sums=txn_col is not None)
+
+def _table_range(source, date_col):
+    """Return the row count and first/last transaction time, computed in the database."""
+    date = source.quote(date_col)
+    stats = source.query(f"SELECT COUNT(*) AS n, MIN({date}) AS first_time, MAX({date}) AS last_time "
+                         f"FROM {source.table_sql}")
+    first, last = _times(stats[["first_time", "last_time"]].iloc[0].tolist())
+    return int(stats["n"].iloc[0]), first, last
+
+def process_sql_source(source, top_n_cards=20, top_n_cashiers=20, encrypt=True, separate_cards=False,
+                       include_intervals=True, streaming=False, raw_data=False, progress=None, cancel_event=None,
+                       output_prefix="", stats=None):
+    """Build TopCards/TopCashiers for a table in a SQL database (an SQLSource) without loading it.
+
+    Ranking and per-entity aggregation run in the database as GROUP BY queries
+    restricted to the top keys, so only aggregates and the top entities' rows
+    come back; the table is read in full only for ``raw_data`` (the RawData
+    sheet). The sheets match process_file on the same rows, except that sums are
+    the database's. The other arguments and the return value are as for process_file;
+    the run record also counts the rows fetched.
+    """
+    output_folder, log_file = output_folders()
+    progress = recorder = RunRecorder(progress)
+
+    report_stage("rank", progress, cancel_event, SQL_STAGES)
+    columns = source.columns()
+    date_col = choose_date_column(columns)
+    if not date_col or not ({"card_no", "cashier"} & set(columns)):
+        raise RuntimeError("A SQL source needs a transaction date column and a card_no or cashier column.")
+    rows, first, last = _table_range(source, date_col)
+    note_rows(progress, rows)
+
+    report_stage("card summary", progress, cancel_event, SQL_STAGES)
+    card_summary = None
+    if "card_no" in columns:
+        card_summary = summarize_entities_sql(source, "card_no", date_col, columns, top_n_cards, include_intervals)
+        note_rows(progress, len(card_summary))
+
+    report_stage("cashier summary", progress, cancel_event, SQL_STAGES)
+    expanded_df = None
+    if "cashier" in columns:
+        cashiers = rank_entities(source, "cashier", date_col, top_n_cashiers)
+        cashier_summary = summarize_entities_sql(source, "cashier", date_col, columns, include_intervals=include_intervals,
+                                                 top=cashiers)
+        if not cashier_summary.empty:
+            expanded_df = expand_cashier_summary_sql(source, date_col, columns, cashier_summary, cashiers)
+            note_rows(progress, len(expanded_df))
+
+    report_stage("raw data", progress, cancel_event, SQL_STAGES)
+    df = None
+    if raw_data:
+        df = compact_ids(_fetch_rows(source, columns))
+        df[date_col] = pd.to_datetime(df[date_col], errors="coerce")
+        if include_intervals and "card_no" in df.columns:
+            df["interval_minutes"] = build_interval_column(df, date_col, "card_no")
+        note_rows(progress, len(df))
+
+    report_stage("write", progress, cancel_event, SQL_STAGES)
+    if (card_summary is None or card_summary.empty) and expanded_df is None:
+        raise RuntimeError("No cards or cashiers found to summarize.")
+    output_file = os.path.join(output_folder, f"{output_prefix}top_transaction_{month_range(first, last)}.xlsx")
+    target = report_target(output_file, encrypt)
+    try:
+        write_report(df, target, card_summary, expanded_df, separate_cards, streaming, cancel_event=cancel_event)
+        report_stage("encrypt", progress, cancel_event, SQL_STAGES)
+    except ReportCancelled:
+        if not encrypt:
+            remove_quietly(output_file)
+        raise
+
+    final_file, password = encrypt_output(output_file, encrypt, buffer=target if encrypt else None)
+    log_output(log_file, source.name, final_file, encrypt, password, separate_cards, include_intervals)
+    record = recorder.record(
+        input=source.name, output=final_file, rows=rows, fetched_rows=source.fetched_rows,
+        options={"top_n_cards": top_n_cards, "top_n_cashiers": top_n_cashiers, "encrypt": encrypt,
+                 "separate_cards": separate_cards, "include_intervals": include_intervals, "streaming": streaming,
+                 "raw_data": raw_data, "sql": True},
+    )
+    write_run_record(os.path.dirname(log_file), record)
+    if stats is not None:
+        stats.update(record)
+
+    print(f"Saved {'and encrypted ' if encrypt else ''}{final_file}")
+    return output_folder, final_file, (password if encrypt else None)
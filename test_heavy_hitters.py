@@ -0,0 +1,31 @@
+import pandas as pd
+
+from benchmark import make_transactions
+from heavy_hitters import find_candidates, fold_candidates
+from incremental import expand_cashiers_from_state, summarize_from_state
+from ingest import parse_input
+from process import compact_ids, expand_cashier_summary, summarize_entities
+
+DATE_COL = "transaction_datetime"
+
+def _datetimes_ns(df):
+    return df.apply(lambda col: col.astype("datetime64[ns]") if col.dtype.kind == "M" else col)
+
+def test_two_pass_matches_full_run_on_unsorted_chunks(tmp_path):
+    # make_transactions is not in time order, so each card's rows are spread over several chunks out of order
+    input_file = tmp_path / "transactions.csv"
+    make_transactions(6000).to_csv(input_file, index=False)
+    full = compact_ids(parse_input(str(input_file)))
+    assert not full[DATE_COL].is_monotonic_increasing
+
+    top_ns = {"card_no": 20, "cashier": 20}
+    candidates, _, _, _ = find_candidates(str(input_file), list(top_ns), top_ns, chunksize=1000)
+    states, _ = fold_candidates(str(input_file), candidates, chunksize=1000)
+
+    for col, top_n in top_ns.items():
+        expected = summarize_entities(full, col, date_col=DATE_COL, top_n=top_n)
+        pd.testing.assert_frame_equal(summarize_from_state(states[col], col, top_n), expected, check_dtype=False)
+
+    cashiers = summarize_from_state(states["cashier"], "cashier", top_ns["cashier"])
+    pd.testing.assert_frame_equal(_datetimes_ns(expand_cashiers_from_state(states["cashier"], cashiers)),
+                                  _datetimes_ns(expand_cashier_summary(full, DATE_COL, cashiers)), check_dtype=False)
@@ -0,0 +1,167 @@
+import importlib
+import itertools
+import multiprocessing
+import queue
+import threading
+
+# Jobs the worker can run: name -> (module, function). The modules are only imported in the worker
+JOBS = {
+    "run_report": ("worker", "run_report"),
+    "process_file_by_month": ("process", "process_file_by_month"),
+    "process_entity_details": ("process", "process_entity_details"),
+    "entity_values": ("worker", "entity_values"),
+    "velocity_thresholds": ("worker", "velocity_thresholds"),
+    "clear_aggregates": ("cache", "clear_aggregates"),
+}
+# Imported as the worker starts, so the first report does not pay for them
+WARM_MODULES = ["pandas", "openpyxl", "process"]
+_POLL_SECONDS = 0.2
+
+class JobCancelled(Exception):
+    """Raised by ReportWorker.run when the job stopped on its cancel event."""
+
+# ---------- Jobs (run in the worker) ----------
+def run_report(file_path, **options):
+    """process_file, returning its run record after the usual (folder, file, password)."""
+    from process import process_file
+    stats = {}
+    return (*process_file(file_path, stats=stats, **options), stats)
+
+def entity_values(file_path):
+    """Return the distinct card numbers and cashiers of an input, for the Tab 2 dropdowns."""
+    from cache import read_input
+    df = read_input(file_path)
+    cards = df["card_no"].astype(str).dropna().unique().tolist() if "card_no" in df.columns else []
+    cashiers = df["cashier"].dropna().unique().tolist() if "cashier" in df.columns else []
+    return cards, cashiers
+
+def velocity_thresholds():
+    from process import BRANCH_HOP_MINUTES, VELOCITY_COUNT, VELOCITY_WINDOW_MINUTES
+    return VELOCITY_COUNT, VELOCITY_WINDOW_MINUTES, BRANCH_HOP_MINUTES
+
+def _run_job(request, results, cancel):
+    job_id, name, args, kwargs, with_progress = request
+    if with_progress:
+        def progress(stage, index, total):
+            results.put((job_id, "progress", stage, index, total))
+        kwargs = dict(kwargs, progress=progress, cancel_event=cancel)
+    from process import ReportCancelled
+    try:
+        module, function = JOBS[name]
+        results.put((job_id, "done", getattr(importlib.import_module(module), function)(*args, **kwargs)))
+    except ReportCancelled as e:
+        results.put((job_id, "cancelled", str(e)))
+    except Exception as e:
+        # Sent as text: unpickling the exception would import its module (often pandas) in the GUI
+        results.put((job_id, "error", str(e)))
+
+def _serve(requests, results, cancel):
+    """Worker process: import the report modules once, then run each job on its own thread."""
+    for module in WARM_MODULES:
+        importlib.import_module(module)
+    results.put((None, "ready"))
+    parent = multiprocessing.parent_process()
+    while True:
+        try:
+            request = requests.get(timeout=1)
+        except queue.Empty:
+            if parent is not None and not parent.is_alive():
+                return  # the GUI went away without stopping us
+            continue
+        if request is None:
+            return
+        threading.Thread(target=_run_job, args=(request, results, cancel), daemon=True).start()
+
+# ---------- Client (GUI process) ----------
+class ReportWorker:
+    """A long-lived process that keeps pandas, openpyxl and process.py imported between reports.
+
+    start() launches it without waiting, so it warms up while the window opens.
+    run() sends a job and blocks the calling thread until it finishes, passing
+    progress back and the caller's cancel event on; jobs run concurrently, but
+    only one cancellable job should run at a time since they share the worker's
+    cancel event. If the process dies, the next run starts a new one.
+    """
+
+    def __init__(self):
+        self._context = multiprocessing.get_context("spawn")
+        self._lock = threading.Lock()
+        self._process = None
+        self._waiting = {}
+        self._ids = itertools.count()
+        self.ready = threading.Event()
+
+    def start(self):
+        """Start the worker process if it is not running."""
+        with self._lock:
+            if self._process is not None and self._process.is_alive():
+                return
+            self.ready.clear()
+            self._requests = self._context.Queue()
+            self._results = self._context.Queue()
+            self._cancel = self._context.Event()
+            self._process = self._context.Process(target=_serve, args=(self._requests, self._results, self._cancel),
+                                                  name="vscan-worker")
+            self._process.start()
+            threading.Thread(target=self._dispatch, args=(self._process, self._results), daemon=True).start()
+
+    def _dispatch(self, process, results):
+        """Route the worker's events to the threads waiting on each job."""
+        while True:
+            try:
+                event = results.get(timeout=1)
+            except queue.Empty:
+                if not process.is_alive():
+                    return
+                continue
+            if event[0] is None:
+                self.ready.set()
+            elif event[0] in self._waiting:
+                self._waiting[event[0]].put(event[1:])
+
+    def run(self, name, *args, progress=None, cancel_event=None, **kwargs):
+        """Run job ``name`` (see JOBS) in the worker and return its result.
+
+        With ``progress`` the job also receives ``progress`` and ``cancel_event``
+        arguments, as process_file takes them; setting ``cancel_event`` here
+        sets the worker's. Failures are raised as RuntimeError with the
+        worker's message, cancellation as JobCancelled.
+        """
+        self.start()
+        job_id = next(self._ids)
+        events = self._waiting[job_id] = queue.Queue()
+        try:
+            if progress is not None:
+                self._cancel.clear()
+            self._requests.put((job_id, name, args, kwargs, progress is not None))
+            while True:
+                if cancel_event is not None and cancel_event.is_set():
+                    self._cancel.set()
+                try:
+                    event = events.get(timeout=_POLL_SECONDS)
+                except queue.Empty:
+                    if not self._process.is_alive():
+                        raise RuntimeError("The report worker stopped unexpectedly; please try again.")
+                    continue
+                if event[0] == "progress":
+                    if progress is not None:
+                        progress(*event[1:])
+                elif event[0] == "done":
+                    return event[1]
+                elif event[0] == "cancelled":
+                    raise JobCancelled(event[1])
+                else:
+                    raise RuntimeError(event[1])
+        finally:
+            del self._waiting[job_id]
+
+    def stop(self, timeout=5):
+        """Ask the worker to exit, terminating it if it is still busy after ``timeout`` seconds."""
+        with self._lock:
+            if self._process is None:
+                return
+            self._requests.put(None)
+            self._process.join(timeout)
+            if self._process.is_alive():
+                self._process.terminate()
+            self._process = None
@@ -0,0 +1,171 @@
+import io
+
+import pandas as pd
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import PatternFill
+
+EXCEL_MAX_ROWS = 1_048_576
+# Rows converted and written at a time; a cancel is noticed between chunks
+DEFAULT_CHUNK_SIZE = 10_000
+COLUMNAR_FORMATS = ("parquet", "feather")
+_AES_BUFFER = 64 * 1024
+
+class ReportCancelled(Exception):
+    """Raised when a report run is cancelled through its ``cancel_event``."""
+
+def check_cancelled(cancel_event, when):
+    """Raise ReportCancelled, saying ``when`` it happened, if ``cancel_event`` is set."""
+    if cancel_event is not None and cancel_event.is_set():
+        raise ReportCancelled(f"Cancelled {when}")
+
+def _frame_rows(frame, chunk_size=DEFAULT_CHUNK_SIZE, cancel_event=None):
+    """Yield the rows of ``frame`` as plain tuples, converting one chunk at a time."""
+    for start in range(0, len(frame), chunk_size):
+        check_cancelled(cancel_event, "while writing")
+        chunk = frame.iloc[start:start + chunk_size].astype(object)
+        chunk = chunk.where(chunk.notna(), None)
+        yield from chunk.itertuples(index=False, name=None)
+
+def fill_rule(color, rows=None, columns=None, header=False):
+    """Declare a solid fill for a block of a frame's cells.
+
+    ``rows`` are 0-based data-row positions (ignored when ``header`` is set) and
+    ``columns`` are 1-based sheet columns; ``None`` means every column.
+    """
+    return {"color": color, "rows": rows, "columns": columns, "header": header}
+
+def _rule_fills(rules, n_cols):
+    """Resolve fill rules into ``{row: {column: fill}}`` where row 0 is the header."""
+    fills = {}
+    for rule in rules or ():
+        fill = solid_fill(rule["color"])
+        columns = rule["columns"] if rule["columns"] is not None else range(1, n_cols + 1)
+        rows = [0] if rule["header"] else [pos + 1 for pos in rule["rows"]]
+        for row in rows:
+            fills.setdefault(row, {}).update({col: fill for col in columns})
+    return fills
+
+def apply_fill_rules(ws, rules, n_cols, startrow=0):
+    """Apply fill rules to an in-memory worksheet whose frame starts at ``startrow`` (0-based)."""
+    for row, col_fills in _rule_fills(rules, n_cols).items():
+        for col, fill in col_fills.items():
+            ws.cell(row=startrow + row + 1, column=col).fill = fill
+
+def _styled_row(ws, values, fills):
+    """Return ``values`` as write-only cells, filling the columns listed in ``fills``."""
+    if not fills:
+        return list(values)
+    cells = []
+    for col_idx, value in enumerate(values, start=1):
+        fill = fills.get(col_idx)
+        if fill is None:
+            cells.append(value)
+            continue
+        cell = WriteOnlyCell(ws, value=value)
+        cell.fill = fill
+        cells.append(cell)
+    return cells
+
+def append_frame(ws, frame, chunk_size=DEFAULT_CHUNK_SIZE, rules=None, cancel_event=None):
+    """Append ``frame`` with its header to a write-only worksheet, styling cells as they are written.
+
+    ``cancel_event`` is checked before each chunk of ``chunk_size`` rows.
+    """
+    fills = _rule_fills(rules, frame.shape[1])
+    ws.append(_styled_row(ws, [None if pd.isna(c) else str(c) for c in frame.columns], fills.get(0)))
+    for pos, values in enumerate(_frame_rows(frame, chunk_size, cancel_event), start=1):
+        ws.append(_styled_row(ws, values, fills.get(pos)))
+
+def write_raw_data(wb, df, sheet_name="RawData", chunk_size=DEFAULT_CHUNK_SIZE, max_rows=EXCEL_MAX_ROWS,
+                   cancel_event=None):
+    """Stream ``df`` into ``wb`` in chunks, rolling over into RawData_2, RawData_3, ...
+    whenever a sheet reaches Excel's row limit. Returns the sheet names written."""
+    rows_per_sheet = max_rows - 1  # leave room for the header
+    sheet_names = []
+    for part, start in enumerate(range(0, max(len(df), 1), rows_per_sheet), start=1):
+        name = sheet_name if part == 1 else f"{sheet_name}_{part}"
+        ws = wb.create_sheet(name)
+        append_frame(ws, df.iloc[start:start + rows_per_sheet], chunk_size=chunk_size, cancel_event=cancel_event)
+        sheet_names.append(name)
+    return sheet_names
+
+def write_frame(writer, frame, sheet_name, chunk_size=DEFAULT_CHUNK_SIZE, cancel_event=None):
+    """Write ``frame`` to a sheet of a pandas ExcelWriter ``chunk_size`` rows at a time, checking ``cancel_event``
+    before each chunk; the sheet is the same as from one ``to_excel`` call."""
+    for start in range(0, max(len(frame), 1), chunk_size):
+        check_cancelled(cancel_event, "while writing")
+        frame.iloc[start:start + chunk_size].to_excel(writer, sheet_name=sheet_name, index=False, header=start == 0,
+                                                      startrow=start + 1 if start else 0)
+
+def discard_workbook(wb):
+    """Drop what was written to an unsaved workbook, e.g. after a cancelled write.
+
+    Write-only sheets are closed and their temp files removed; an in-memory
+    workbook is left with one empty sheet, so saving it (as closing a pandas
+    ExcelWriter does) is instant.
+    """
+    for ws in list(wb.worksheets):
+        if wb.write_only:
+            try:
+                ws.close()
+                ws._writer.cleanup()
+            except Exception:
+                pass
+        else:
+            wb.remove(ws)
+    if not wb.write_only:
+        wb.create_sheet("Sheet")
+
+def new_streaming_workbook():
+    return Workbook(write_only=True)
+
+def solid_fill(color):
+    return PatternFill(start_color=color, end_color=color, fill_type="solid")
+
+def side_by_side(left, right):
+    """Place two frames next to each other with one blank separator column, as on the TopCards sheet."""
+    blank = pd.DataFrame({None: [None] * max(len(left), len(right))})
+    parts = [left.reset_index(drop=True), blank, right.reset_index(drop=True)]
+    return pd.concat(parts, axis=1)
+
+def _arrow_safe(frame):
+    """Return ``frame`` with object columns mixing numbers and text (as read from Excel) stored as text, which Arrow needs."""
+    mixed = {c: frame[c].where(frame[c].isna(), frame[c].astype(str)) for c in frame.columns
+             if frame[c].dtype == object and pd.api.types.infer_dtype(frame[c], skipna=True) in ("mixed", "mixed-integer")}
+    return frame.assign(**mixed) if mixed else frame
+
+def write_columnar(frame, path, fmt, password=None):
+    """Write ``frame`` to ``path`` as Parquet or uncompressed Feather (which can be memory-mapped); returns the path.
+
+    With ``password`` the file is AES-encrypted (pyAesCrypt) to ``path + ".aes"``
+    straight from memory, so the plaintext never reaches disk.
+    """
+    if fmt not in COLUMNAR_FORMATS:
+        raise ValueError(f"Unknown columnar format: {fmt}")
+    frame = _arrow_safe(frame.reset_index(drop=True))
+    target = io.BytesIO() if password else path
+    if fmt == "parquet":
+        frame.to_parquet(target, index=False)
+    else:
+        frame.to_feather(target, compression="uncompressed")
+    if not password:
+        return path
+    import pyAesCrypt
+    target.seek(0)
+    with open(path + ".aes", "wb") as f_out:
+        pyAesCrypt.encryptStream(target, f_out, password, _AES_BUFFER)
+    return path + ".aes"
+
+def read_columnar(path, password=None):
+    """Read a frame written by write_columnar, decrypting ``.aes`` files in memory with ``password``."""
+    source = path
+    if path.lower().endswith(".aes"):
+        import pyAesCrypt
+        source = io.BytesIO()
+        with open(path, "rb") as f_in:
+            pyAesCrypt.decryptStream(f_in, source, password, _AES_BUFFER)
+        source.seek(0)
+    if path.lower().removesuffix(".aes").endswith(".feather"):
+        return pd.read_feather(source)
+    return pd.read_parquet(source)